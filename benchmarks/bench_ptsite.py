@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+ck_ptsite 吞吐量基准测试
+
+在本地启动一个模拟 NexusPHP `attendance.php` 的 HTTP 服务，生成 N 个模拟站点，
+然后完整执行一次 ck_ptsite.main()，统计总耗时、请求速率、读取字节数以及
+各站点签到耗时的分位数。用于比较请求/重试路径改动前后的性能。
+
+模拟站点的类型 (通过 --mix 设置比例):
+- success: 正常签到成功
+- signed:  今日已签到 (页面同样包含签到信息)
+- cookie:  Cookie 失效，页面跳转到 gov.cn
+- error:   前若干次返回 502/503，之后成功
+- slow:    响应延迟较大
+- large:   签到信息之后附带数百 KB 的日历 HTML
+
+用法:
+    python benchmarks/bench_ptsite.py --sites 40
+    python benchmarks/bench_ptsite.py --sites 40 --no-stream --json result.json
+
+默认每个站点使用不同的回环地址 (127.0.0.2, 127.0.0.3, ...) 以模拟不同主机，
+这需要 Linux；其他系统请加 --single-host。
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ck_ptsite  # noqa: E402
+
+SCENARIOS = ('success', 'signed', 'cookie', 'error', 'slow', 'large')
+DEFAULT_MIX = 'success=50,signed=10,cookie=10,error=10,slow=10,large=10'
+
+
+def attendance_page(name: str, signed: bool, padding: int = 0) -> bytes:
+    notice = "您今天已经签到过了，请勿重复刷新。" if signed else ""
+    body = (
+        "<html><head><title>NexusPHP</title></head><body>\n"
+        f'<span class="medium">欢迎回来, {name}</span> '
+        "魔力值 [使用]: 12,345.6 | 做种积分: 789\n"
+        f"<table><tr><td>{notice}"
+        "这是您的第 <b>128</b> 次签到，已连续签到 <b>30</b> 天，"
+        "本次签到获得 <b>50</b> 个魔力值。今日签到排名：<b>7</b> / <b>500</b>"
+        "</td></tr></table>\n"
+    )
+    if padding:
+        cell = '<td class="day"><span class="dot"></span>01</td>'
+        body += "<table class=\"calendar\">" + cell * (padding // len(cell))
+        body += "</table>"
+    body += "</body></html>"
+    return body.encode('utf-8')
+
+
+COOKIE_PAGE = (
+    b'<html><head><meta http-equiv="refresh" content="0;url=https://www.gov.cn/">'
+    b'</head><body>https://www.gov.cn/</body></html>'
+)
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开属于正常情况 (流式读取提前结束)
+        pass
+
+
+class StandInServer:
+    """模拟多个 NexusPHP 站点的本地服务，路径第一段为站点名"""
+
+    def __init__(self, scenarios: dict, slow_delay: float, error_times: int,
+                 large_size: int, base_delay: float):
+        self.scenarios = scenarios
+        self.slow_delay = slow_delay
+        self.error_times = error_times
+        self.large_size = large_size
+        self.base_delay = base_delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+        self.connections = 0
+        self.hits: dict[str, int] = {}
+        self.httpd = QuietHTTPServer(('', 0), self._handler())
+        self.port = self.httpd.server_address[1]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                with server.lock:
+                    server.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                name = self.path.strip('/').split('/')[0]
+                with server.lock:
+                    server.requests += 1
+                    hit = server.hits[name] = server.hits.get(name, 0) + 1
+                status, body = server.respond(name, hit)
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前结束读取
+                    return
+                with server.lock:
+                    server.bytes_sent += len(body)
+
+        return Handler
+
+    def respond(self, name: str, hit: int):
+        scenario = self.scenarios.get(name)
+        time.sleep(self.base_delay)
+        if scenario == 'cookie':
+            return 200, COOKIE_PAGE
+        if scenario == 'error' and hit <= self.error_times:
+            if hit % 2:
+                return 502, b'<html><body>502 Bad Gateway</body></html>'
+            return 503, b'<html><body>503 Service Temporarily Unavailable</body></html>'
+        if scenario == 'slow':
+            time.sleep(self.slow_delay)
+        if scenario == 'large':
+            return 200, attendance_page(name, False, self.large_size)
+        return 200, attendance_page(name, scenario == 'signed')
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(','):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key not in SCENARIOS:
+            raise ValueError(f"未知的站点类型: {key}")
+        weights[key] = float(value or 1)
+    return weights
+
+
+def assign_scenarios(count: int, weights: dict, seed: int) -> dict:
+    rng = random.Random(seed)
+    kinds = list(weights)
+    chosen = rng.choices(kinds, weights=[weights[k] for k in kinds], k=count)
+    return {f"bench{i:03d}": kind for i, kind in enumerate(chosen)}
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_once(args, scenarios: dict, server: StandInServer) -> dict:
+    """在临时目录中执行一次完整的 ck_ptsite.main()，返回统计结果"""
+    sites = []
+    for i, name in enumerate(scenarios):
+        host = '127.0.0.1' if args.single_host else f"127.0.{i // 250}.{i % 250 + 2}"
+        sites.append({
+            'name': name,
+            'sign_in_url': f"http://{host}:{server.port}/{name}/attendance.php",
+        })
+
+    options = {
+        'max_concurrency': args.concurrency,
+        'per_host_concurrency': args.per_host,
+        'stream': not args.no_stream,
+        'http2': args.http2,
+        'retry': {'base_delay': args.retry_delay, 'max_delay': args.retry_delay * 4},
+    }
+    captured = []
+    original_format = ck_ptsite.format_and_send_notification
+
+    def capture(results):
+        captured.extend(r for r in results if r is not None)
+
+    with tempfile.TemporaryDirectory(prefix='bench_ptsite_') as workdir:
+        sites_file = os.path.join(workdir, 'sites.json')
+        with open(sites_file, 'w', encoding='utf-8') as f:
+            json.dump(sites, f)
+        options['sites_file'] = sites_file
+        os.environ['PT_CHECKIN_CONFIG'] = json.dumps({
+            'sites': {name: 'uid=1; pass=bench' for name in scenarios},
+            'options': options,
+        })
+
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        requests_before = server.requests
+        bytes_before = server.bytes_sent
+        conns_before = server.connections
+        ck_ptsite.format_and_send_notification = capture
+        try:
+            started = time.perf_counter()
+            ck_ptsite.main()
+            wall = time.perf_counter() - started
+        finally:
+            ck_ptsite.format_and_send_notification = original_format
+            os.chdir(cwd)
+
+    requests_made = server.requests - requests_before
+    latencies = {}
+    for res in captured:
+        if 'network_time' in res:
+            kind = scenarios[res['site']]
+            latencies.setdefault(kind, []).append(res['network_time'])
+    all_latencies = [v for values in latencies.values() for v in values]
+
+    return {
+        'wall_time': wall,
+        'requests': requests_made,
+        'requests_per_sec': requests_made / wall if wall else 0.0,
+        'connections': server.connections - conns_before,
+        'bytes_sent': server.bytes_sent - bytes_before,
+        'bytes_read': sum(r.get('bytes_read', 0) for r in captured),
+        'retry_wait': sum(r.get('wait_time', 0.0) for r in captured),
+        'statuses': {
+            status: sum(1 for r in captured if r['status'] == status)
+            for status in sorted({r['status'] for r in captured})
+        },
+        'latency': {
+            kind: {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+                'max': max(values),
+            }
+            for kind, values in sorted(
+                list(latencies.items()) + [('all', all_latencies)]
+            ) if values
+        },
+    }
+
+
+def print_report(args, report: dict, round_no: int):
+    print(f"\n===== 第 {round_no} 轮: {args.sites} 个站点 =====")
+    print(f"总耗时        {report['wall_time']:.3f}s")
+    print(f"请求数        {report['requests']} ({report['requests_per_sec']:.1f} req/s)")
+    print(f"TCP 连接数    {report['connections']}")
+    print(f"读取字节数    {report['bytes_read']} (服务端发送 {report['bytes_sent']})")
+    print(f"重试等待合计  {report['retry_wait']:.2f}s")
+    print("结果分布      " + ", ".join(
+        f"{status} x{count}" for status, count in report['statuses'].items()
+    ))
+    print(f"{'类型':<8}{'数量':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for kind, stats in report['latency'].items():
+        print(
+            f"{kind:<10}{stats['count']:>6}{stats['p50']:>9.3f}"
+            f"{stats['p90']:>9.3f}{stats['p99']:>9.3f}{stats['max']:>9.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ck_ptsite 吞吐量基准测试")
+    parser.add_argument('--sites', type=int, default=30, help="模拟站点数量")
+    parser.add_argument('--rounds', type=int, default=1, help="重复执行的轮数")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="各类站点的比例")
+    parser.add_argument('--seed', type=int, default=42, help="分配站点类型的随机种子")
+    parser.add_argument('--concurrency', type=int,
+                        default=ck_ptsite.DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument('--per-host', type=int,
+                        default=ck_ptsite.DEFAULT_PER_HOST_CONCURRENCY)
+    parser.add_argument('--no-stream', action='store_true', help="读取完整页面")
+    parser.add_argument('--http2', action='store_true')
+    parser.add_argument('--single-host', action='store_true',
+                        help="所有站点共用 127.0.0.1")
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="每个请求的基础延迟 (秒)")
+    parser.add_argument('--slow-delay', type=float, default=1.0,
+                        help="slow 站点额外的延迟 (秒)")
+    parser.add_argument('--error-times', type=int, default=2,
+                        help="error 站点返回 50x 的次数")
+    parser.add_argument('--large-size', type=int, default=400 * 1024,
+                        help="large 站点附带的 HTML 字节数")
+    parser.add_argument('--retry-delay', type=float, default=0.5,
+                        help="重试的基础退避时间 (秒)")
+    parser.add_argument('--json', help="将结果写入 JSON 文件")
+    parser.add_argument('--verbose', action='store_true', help="输出签到日志")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        # ck_ptsite 在第一次输出日志时才配置 loguru，先触发配置再覆盖
+        ck_ptsite.logger.remove()
+        ck_ptsite.logger.add(sys.stderr, level='WARNING')
+
+    scenarios = assign_scenarios(args.sites, parse_mix(args.mix), args.seed)
+    server = StandInServer(
+        scenarios, slow_delay=args.slow_delay, error_times=args.error_times,
+        large_size=args.large_size, base_delay=args.latency,
+    )
+    server.start()
+    reports = []
+    try:
+        for round_no in range(1, args.rounds + 1):
+            server.hits.clear()
+            report = run_once(args, scenarios, server)
+            reports.append(report)
+            print_report(args, report, round_no)
+    finally:
+        server.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'rounds': reports}, f,
+                      ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
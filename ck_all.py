@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+cron: 0 10,16,22 * * *
+new Env('签到合集');
+
+在一个进程中并发运行所有签到脚本，代替为每个脚本单独设置定时任务:
+只启动一次解释器，共用一个连接池 (SessionPool) 和一个状态库 (checkin_status.db)，
+最后发送一条合并的通知。各脚本仍可作为单独的青龙任务运行。
+
+每个签到脚本提供 task(pool=None, state=None) 函数，返回 (通知标题, 内容, 是否成功)，
+无需通知或未配置时返回 None。脚本的 TASK_ONCE_PER_DAY 为 False 时
+(如 ck_ptsite 自己按站点记录签到状态) 每次都运行，否则成功后当天不再运行 (记录在
+状态库的 task_log 表中)，失败时之后的定时运行会重试；同时运行的多个进程不会重复执行
+同一个脚本。
+
+环境变量:
+- CK_TASKS: 要运行的脚本模块，逗号分隔 (默认 ck_ptsite,ck_enshan,ck_wps,ck_siyuan)
+
+用法:
+    python ck_all.py              # 运行 CK_TASKS 中的全部脚本
+    python ck_all.py ck_wps ...   # 只运行指定的脚本
+"""
+
+from __future__ import annotations
+
+import asyncio
+import importlib
+import os
+import signal
+import sys
+from datetime import datetime
+
+from loguru import logger
+
+import ck_ptsite
+from ql_notify import replay, send
+from ql_transport import SessionPool
+
+DEFAULT_TASKS = ("ck_ptsite", "ck_enshan", "ck_wps", "ck_siyuan")
+NOTIFY_TITLE = "【每日签到汇总】"
+# 共用连接池中每个主机的最大连接数，不低于 ck_ptsite 的单主机并发上限
+POOL_SIZE = 4
+
+
+def _exit_on_sigterm(signum, frame):
+    # 转换为 SystemExit，使状态库在 finally 中刷新并释放认领
+    raise SystemExit(128 + signum)
+
+
+def load_tasks(names) -> dict:
+    """导入签到脚本，返回 {模块名: 模块}，缺少 task 函数或无法导入的跳过"""
+    modules = {}
+    for name in names:
+        try:
+            module = importlib.import_module(name)
+        except Exception as e:
+            logger.error(f"❌ 导入签到脚本 {name} 失败: {e}")
+            continue
+        if not callable(getattr(module, 'task', None)):
+            logger.warning(f"⚠️ {name} 没有提供 task 函数，已跳过。")
+            continue
+        modules[name] = module
+    return modules
+
+
+def run_task(name: str, module, pool: SessionPool, state):
+    """在工作线程中运行一个脚本，返回 (通知标题, 内容, 是否成功) 或 None"""
+    once_per_day = getattr(module, 'TASK_ONCE_PER_DAY', True)
+    if once_per_day:
+        claim = state.claim(name, task=True)
+        if claim != "claimed":
+            reason = "今日已运行" if claim == "signed" else "另一个进程正在运行"
+            logger.info(f"🟢 [{name}] {reason}，跳过。")
+            return None
+
+    logger.info(f"▶️ [{name}] 开始运行")
+    report = module.task(pool=pool, state=state)
+    # 只有成功才占用当天的运行；未配置 (None) 或失败时之后的运行会重试
+    if once_per_day and report is not None and report[2]:
+        state.mark_task_done(name)
+    logger.info(f"⏹️ [{name}] 运行结束")
+    return report
+
+
+async def run_all(modules: dict, pool: SessionPool, state) -> list:
+    """
+    并发运行所有脚本，脚本内的阻塞请求在线程池中执行
+    :return: 与 modules 顺序一致的 (通知标题, 内容, 是否成功) 列表，无需通知的为 None
+    """
+    async def run_one(name, module):
+        try:
+            return await asyncio.to_thread(run_task, name, module, pool, state)
+        except Exception as e:
+            logger.exception(f"❌ [{name}] 运行出错: {e}")
+            return name, f"❌ 运行出错: {type(e).__name__}: {e}", False
+
+    return await asyncio.gather(
+        *(run_one(name, module) for name, module in modules.items())
+    )
+
+
+def format_report(reports) -> str | None:
+    """合并各脚本的通知内容，全部无需通知时返回 None"""
+    sections = [
+        f"══════ {title} ══════\n{content.strip()}"
+        for title, content, _ in (report for report in reports if report)
+    ]
+    if not sections:
+        return None
+    header = f"🕐 时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    return "\n\n".join([header, *sections])
+
+
+def main(argv=None):
+    # 在启动工作线程之前统一配置 loguru 的输出
+    ck_ptsite.setup_logging()
+    names = argv or [
+        name.strip() for name in
+        (os.getenv("CK_TASKS") or ",".join(DEFAULT_TASKS)).split(",")
+        if name.strip()
+    ]
+    modules = load_tasks(names)
+    if not modules:
+        logger.error("❌ 没有可运行的签到脚本。")
+        return
+
+    logger.info(f"===== 开始运行 {len(modules)} 个签到脚本: {', '.join(modules)} =====")
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    state = ck_ptsite.StateStore(ck_ptsite.DB_FILE)
+    pool = SessionPool(pool_size=POOL_SIZE)
+    try:
+        state.start_lease()
+        reports = asyncio.run(run_all(modules, pool, state))
+    finally:
+        pool.close()
+        state.close()
+
+    content = format_report(reports)
+    if content is None:
+        logger.info("所有脚本均无需通知。")
+    else:
+        send(NOTIFY_TITLE, content)
+        logger.info("汇总通知已提交，在后台发送。")
+    replay()
+    logger.info("===== 所有签到脚本运行完毕 =====")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -9,13 +9,12 @@ import os
 import re
 import sys
 
-import requests
-from lxml import etree
+from ql_transport import SessionPool, header_profile
 
 # 测试用环境变量
 # os.environ['COOKIE_ENSHAN'] = ''
 
-from notify import send  # 导入青龙后自动有这个文件
+from ql_notify import replay, send  # 后台限时发送，内部使用青龙的 notify.py
 
 
 # 获取环境变量
@@ -35,7 +34,7 @@ def get_env():
 
 
 class EnShan:
-    def __init__(self, cookie):
+    def __init__(self, cookie, pool=None):
         self.cookie = cookie
         self.user_name = None
         self.user_group = None
@@ -43,11 +42,14 @@ class EnShan:
         self.contribution = None
         self.point = None
         self.date = None
+        # 带默认超时和重试的会话，两个请求复用同一个连接；可传入 ck_all 的共享池
+        self.pool = pool or SessionPool()
+        self.headers = header_profile('navigate', {'Cookie': self.cookie})
 
     def get_user(self):
         """获取用户积分"""
         user_url = "https://www.right.com.cn/FORUM/home.php?mod=spacecp&ac=credit"
-        user_res = requests.get(url=user_url, headers={'Cookie': self.cookie, 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64;)'})
+        user_res = self.pool.get(user_url, headers=self.headers)
         self.user_name = re.findall(r'访问我的空间">(.*?)</a>', user_res.text)[0]
         self.user_group = re.findall(r'用户组: (.*?)</a>', user_res.text)[0]
         self.contribution = re.findall(r'贡献: </em>(.*?) 分', user_res.text)[0]
@@ -56,8 +58,10 @@ class EnShan:
 
     def get_log(self):
         """获取签到日期记录"""
+        from lxml import etree  # 只有这里用到，延迟导入以加快启动
+
         log_url = "https://www.right.com.cn/forum/home.php?mod=spacecp&ac=credit&op=log&suboperation=creditrulelog"
-        log_res = requests.get(url=log_url, headers={'Cookie': self.cookie, 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64;)'})
+        log_res = self.pool.get(log_url, headers=self.headers)
         html = etree.HTML(log_res.text)
         self.date = html.xpath('//tr/td[6]/text()')[0]
 
@@ -76,23 +80,36 @@ class EnShan:
             return '❌️签到失败，可能是cookie失效了！'
 
 
-if __name__ == "__main__":
-    print("----------恩山论坛开始尝试签到----------")
-
-    msg, cookie_EnShan = "", get_env()
-
-
+def run(cookie, pool=None):
+    """签到并返回 (通知内容, 是否成功)"""
     log = f"恩山论坛开始尝试签到\n"
+    enshan = EnShan(cookie, pool)
     try:
-        log += EnShan(cookie_EnShan).main()
+        log += enshan.main()
     except Exception as e:
         log += f"处理时发生错误: {str(e)}\n"
         print(f"处理时发生错误: {str(e)}")
-    msg += log + "\n\n"
+    return log + "\n\n", bool(enshan.date)
+
+
+def task(pool=None, state=None):
+    """供 ck_all.py 调用，未配置 COOKIE_ENSHAN 时跳过；返回 (通知标题, 内容, 是否成功)"""
+    cookie = os.environ.get('COOKIE_ENSHAN')
+    if not cookie:
+        print('未添加COOKIE_ENSHAN变量，跳过恩山论坛签到')
+        return None
+    return ('恩山论坛签到', *run(cookie, pool))
+
+
+if __name__ == "__main__":
+    print("----------恩山论坛开始尝试签到----------")
+
+    msg, _ = run(get_env())
 
     try:
         send('恩山论坛签到', msg)
     except Exception as err:
         print('%s\n❌️错误，请查看运行日志！' % err)
 
+    replay()
     print("----------恩山论坛签到执行完毕----------")
@@ -15,7 +15,7 @@ new Env('PT多站签到');
 
 一、 `sites` 对象 (必需)
 --------------------------------------------------------------------------------
-`sites` 是一个JSON对象，"键" 是站点名称 (必须与脚本内置的SITES_CONFIG匹配)，
+`sites` 是一个JSON对象，"键" 是站点名称或域名 (必须能在站点定义中找到，见第四节)，
 "值" 决定了如何获取该站点的Cookie:
 
 1.  **使用 CookieCloud**:
@@ -29,6 +29,17 @@ new Env('PT多站签到');
 
     示例: "siqi": "uid=789; pass=xyz;"
 
+3.  **多个账号**:
+    将站点的值设置为一个**列表**，每一项是一个账号，可以是 Cookie 字符串，
+    或 {"name": "账号名称", "cookie": "..."}。Cookie 为空时从 CookieCloud 获取
+    (CookieCloud 每个站点只有一份 Cookie，因此最多一个账号这样配置)。
+    未命名的账号按位置命名为 "1"、"2"...；通知、签到记录和历史查询中以
+    "站点@账号" 区分，建议写明 name 以免调整顺序后对不上之前的记录。
+    同一主机的所有账号共用连接池，并受 `per_host_concurrency` 限制。
+
+    示例: "siqi": [{"name": "me", "cookie": "uid=1; pass=a;"},
+                   {"name": "mom", "cookie": "uid=2; pass=b;"}]
+
 二、 `cookie_cloud` 对象 (可选)
 --------------------------------------------------------------------------------
 如果 `sites` 对象中**至少有一个**站点配置为使用 CookieCloud，则此 `cookie_cloud`
@@ -39,6 +50,14 @@ new Env('PT多站签到');
 - `uuid`: 你的用户 UUID
 - `password`: 你的加密密码
 
+以及两个可选键:
+- `cache_ttl`: 本地加密缓存的有效秒数 (默认 21600，即 6 小时；0 表示不缓存)
+- `cache_file`: 本地缓存文件路径 (默认 "cookiecloud_cache.bin")
+缓存过期，或有站点从缓存取得的 Cookie 返回 "🍪 Cookie失效" 时，
+才会重新从 CookieCloud 下载。
+只有使用 CookieCloud 的站点所在的域名 (及其父域名) 会被保留和缓存，
+Cookie 字符串在签到时按需拼接。
+
 ---
 完整配置示例:
 {
@@ -55,87 +74,434 @@ new Env('PT多站签到');
 }
 
 如果所有站点都直接提供Cookie，`cookie_cloud` 键可以省略。
+
+三、 `options` 对象 (可选)
+--------------------------------------------------------------------------------
+调整签到引擎的运行参数，所有键均可省略:
+- `max_concurrency`: 同时进行签到的站点数上限 (默认 8)
+- `per_host_concurrency`: 同一主机同时进行的请求数上限 (默认 1)
+- `http2`: 是否启用 HTTP/2 (默认 false，需要安装 `httpx[http2]`)
+- `stream`: 是否流式读取签到页面，提取到所需信息后即停止下载 (默认 true)
+- `sites_file`: 站点定义文件或目录，见第四节 (也可用环境变量 `PT_SITES_FILE`)
+- `retry`: 默认重试策略，可被站点定义中的 `retry` 覆盖
+    - `max_attempts`: 最多尝试次数 (默认 3)
+    - `base_delay`: 首次重试前的等待秒数 (默认 5)
+    - `multiplier`: 每次重试等待时间的倍数 (默认 2)
+    - `max_delay`: 单次等待的上限秒数 (默认 60)
+    - `jitter`: 随机缩短等待时间的比例，0~1 (默认 0.5)
+- `circuit_breaker`: 跨运行的熔断设置
+    - `threshold`: 连续多少次运行签到失败后熔断 (默认 3)
+    - `cooldown`: 熔断后等待多少秒再允许一次探测 (默认 43200，即 12 小时)
+  熔断中的站点不发起请求，在通知中显示为 "⛔ 熔断"；冷却结束后只尝试一次，
+  成功则恢复，失败则重新计算冷却时间。
+- `preflight`: 是否为所有站点启用 Cookie 预检 (默认 false)，见第四节 `preflight`
+- `lease_timeout`: 运行租约的过期秒数 (默认 600)。同时运行的多个任务按站点
+  认领，其他任务正在签到的站点显示为 "🔒 跳过"；进程被强制结束后，
+  其认领的站点在租约过期后才能被再次签到
+- `metrics`: 运行指标输出，记录每个站点每次尝试的 DNS/建立连接/首字节/总耗时、
+  读取字节数、HTTP 状态码、重试次数和结果分类 (默认不输出)
+    - `textfile`: Prometheus textfile collector 文件路径，每次运行覆盖写入
+      (也可用环境变量 `PT_METRICS_TEXTFILE`)
+    - `jsonl`: JSON Lines 文件路径，每次运行追加写入
+      (也可用环境变量 `PT_METRICS_JSONL`)
+
+示例: "options": {"max_concurrency": 16, "retry": {"max_attempts": 4}}
+
+四、 站点定义
+--------------------------------------------------------------------------------
+脚本内置了 SITES_CONFIG 中的站点。更多站点可写在 JSON/YAML 文件中 (或放在一个
+目录下的多个文件中)，通过 `options.sites_file` 指定，同名站点以文件为准。
+文件内容为站点列表，或 {"sites": [...]}。每个站点支持以下键:
+- `name`: 站点名称 (必需)
+- `sign_in_url`: 签到页面地址 (必需)
+- `magic_keyword`: 页面中魔力值的名称 (默认 "魔力值")
+- `headers`: 站点专用请求头 (默认根据签到地址生成 authority 和 referer)
+- `success_markers`: 表示签到成功的文本列表 (默认 ["这是您的第"])
+- `cookie_invalid_markers`: 表示 Cookie 失效的文本列表
+- `server_error_markers`: 表示服务器异常、需要重试的文本列表
+- `extractors`: 额外或覆盖的字段正则，{字段名: 正则}；内置字段为
+  `magic` (魔力值)、`rank` (签到次数与排名) 和 `streak` (连续签到天数)，
+  设为空字符串可禁用
+- `retry`: 该站点的重试策略，键同 options.retry
+- `preflight`: Cookie 预检，true/false 或 {"url": ..., "method": "HEAD"}。
+  签到前先用一个不跟随跳转的轻量请求 (默认 HEAD 站点的 usercp.php) 检查登录状态，
+  被重定向到登录页或 cookie_invalid_markers 中的地址即判定 Cookie 失效，
+  不再下载签到页面；预检出错时照常签到。
+  无论是否预检，判定失效的 Cookie 都会按其指纹记录下来，之后的运行在 Cookie
+  更新之前直接跳过该账号，不发起任何请求
+
+示例:
+[
+  {"name": "MyPT", "sign_in_url": "https://pt.example.com/attendance.php",
+   "magic_keyword": "憨豆"}
+]
+
+五、 魔力值与排名历史
+--------------------------------------------------------------------------------
+每次签到成功时，页面中的魔力值、连续签到天数和今日排名会记录到状态数据库的
+site_values 表中。带参数运行脚本即可查询 (不会执行签到):
+    python ck_ptsite.py history [--site GGPT] [--days 30]   逐条记录
+    python ck_ptsite.py daily   [--site GGPT] [--days 30]   每天的魔力值及变化
+    python ck_ptsite.py summary [--days 30]                 各站点汇总
+加 `--json` 输出 JSON，`--days 0` 查询全部记录。
 ================================================================================
 """
 
-import requests
+from __future__ import annotations
+
+import codecs
+import hashlib
+import importlib
+import importlib.util
 import re
 import os
-import time
+import random
 import json
-import urllib3
-from loguru import logger
+import math
+import signal
 import sys
 import sqlite3
+import threading
+import time
 from datetime import datetime
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
+
+from ql_transport import (
+    RetryPolicy, SessionPool, collect_request_stats, header_profile,
+)
 
 # 数据库文件名
 DB_FILE = "checkin_status.db"
+# CookieCloud 本地缓存文件名
+COOKIE_CACHE_FILE = "cookiecloud_cache.bin"
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 延迟导入
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 青龙每次运行都启动新的解释器，较重的依赖只在真正用到时才导入，
+# 所有站点今日都已签到时可以不加载网络和加密相关的模块。
+# 设置环境变量 CK_IMPORT_PROFILE=1 可在结束时输出各模块的导入耗时。
+
+IMPORT_PROFILE = os.getenv("CK_IMPORT_PROFILE", "").lower() in ("1", "true", "yes")
+_import_times: dict[str, float] = {}
+
+
+def lazy_import(name: str):
+    """导入模块并记录耗时，已导入的模块直接返回"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    _import_times[name] = time.perf_counter() - started
+    return module
+
+
+class LazyModule:
+    """模块代理，第一次访问属性时才真正导入"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = lazy_import(self._name)
+        return getattr(self._module, attr)
+
 
-# 禁用SSL警告
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+asyncio = LazyModule('asyncio')
 
-# 配置 loguru
-logger.remove()
-log_format = (
+
+LOG_FORMAT = (
     "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
     "<level>{level: <8}</level> | "
     "<level>{message}</level>"
 )
-logger.add(sys.stdout, format=log_format)
+
+
+class _LazyLogger:
+    """
+    loguru 的代理，第一次使用时导入，之后替换为真正的 logger。
+    这里不改动 loguru 的输出配置，作为库导入时沿用调用方的配置
+    """
+
+    def __getattr__(self, attr):
+        global logger
+        logger = lazy_import('loguru').logger
+        return getattr(logger, attr)
+
+
+logger = _LazyLogger()
+
+
+def setup_logging():
+    """
+    将 loguru 的输出替换为本脚本的格式，只在脚本入口 (main) 启动其他线程之前
+    调用一次；loguru 的 logger 是进程共用的，工作线程中替换会丢失其他线程的日志
+    """
+    real_logger = lazy_import('loguru').logger
+    real_logger.remove()
+    real_logger.add(sys.stdout, format=LOG_FORMAT)
+
+
+def report_import_times():
+    """输出各延迟导入模块的耗时 (用 print，不为此导入 loguru)"""
+    if not IMPORT_PROFILE:
+        return
+    lines = ["⏱️ 延迟导入的模块:"]
+    for name, seconds in sorted(
+        _import_times.items(), key=lambda item: item[1], reverse=True
+    ):
+        lines.append(f"    {name:<24}{seconds * 1000:>8.1f}ms")
+    if not _import_times:
+        lines.append("    (无)")
+    print("\n".join(lines))
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # CookieCloud 相关代码
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-try:
-    from PyCookieCloud import PyCookieCloud
-except ImportError:
-    PyCookieCloud = None
+def pycookiecloud_available() -> bool:
+    """检查 PyCookieCloud 是否已安装 (不实际导入)"""
+    if importlib.util.find_spec('PyCookieCloud') is not None:
+        return True
     logger.warning("⚠️ PyCookieCloud 模块未安装，CookieCloud功能将不可用。")
     logger.warning("请执行 `pip install PyCookieCloud` 进行安装。")
+    return False
+
+
+DEFAULT_COOKIE_CACHE_TTL = 6 * 3600
+
+
+class DomainIndex:
+    """
+    域名后缀索引。
+    按域名标签倒序组织成 trie (org -> hdtime -> www)，查找只需遍历目标域名
+    的各级标签，且只在标签边界上匹配，返回最具体的父域名。
+    """
+
+    _ENTRY = ''  # 合法的域名标签不会是空串，用作节点上的取值键
+
+    def __init__(self, mapping: dict | None = None):
+        self._root: dict = {}
+        for domain, value in (mapping or {}).items():
+            self.add(domain, value)
+
+    @staticmethod
+    def _labels(domain: str) -> list[str]:
+        return domain.lower().strip('.').split('.')[::-1]
+
+    def add(self, domain: str, value):
+        node = self._root
+        for label in self._labels(domain):
+            node = node.setdefault(label, {})
+        node[self._ENTRY] = (domain, value)
+
+    def longest_match(self, domain: str) -> tuple | None:
+        """
+        查找 domain 自身或其最近的父域名
+        :return: (匹配到的域名, 值)，未找到时返回 None
+        """
+        node = self._root
+        best = None
+        for label in self._labels(domain):
+            node = node.get(label)
+            if node is None:
+                break
+            best = node.get(self._ENTRY, best)
+        return best
+
+
+class CookieJar:
+    """
+    CookieCloud 解密数据的惰性视图。
+    保留原始结构 {域名: [cookie, ...]}，只在查找某个域名时才拼接 Cookie 字符串，
+    拼接结果和父域名索引都在第一次用到时才生成并缓存。
+    给出 domains 时只保留这些主机自身及其父域名的 Cookie，其余域名直接丢弃。
+    """
+
+    def __init__(self, data: dict | None = None, domains=None):
+        wanted = self._suffixes(domains) if domains is not None else None
+        self.data: dict[str, list] = {}
+        for domain, content_list in (data or {}).items():
+            if domain.startswith('.'):
+                domain = domain[1:]
+            if wanted is not None and domain.lower() not in wanted:
+                continue
+            self.data[domain] = content_list
+        self._strings: dict[str, str | None] = {}
+        self._index: DomainIndex | None = None
+
+    @staticmethod
+    def _suffixes(domains) -> set[str]:
+        """各主机在标签边界上的所有后缀 (a.b.org -> a.b.org, b.org, org)"""
+        suffixes = set()
+        for domain in domains:
+            labels = domain.lower().strip('.').split('.')
+            suffixes.update('.'.join(labels[i:]) for i in range(len(labels)))
+        return suffixes
+
+    def __bool__(self):
+        return bool(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def cookie_string(self, domain: str) -> str | None:
+        """
+        domain 下所有 Cookie 拼接成的请求头，结果会被缓存
+        :return: Cookie 字符串；没有 Cookie 或只有 cf_clearance 时返回 None
+        """
+        if domain in self._strings:
+            return self._strings[domain]
+        content_list = self.data.get(domain)
+        cookie = None
+        if content_list and not all(
+            c.get("name") == "cf_clearance" for c in content_list
+        ):
+            cookie = "; ".join(
+                f"{c.get('name')}={c.get('value')}"
+                for c in content_list if c.get("name") and c.get("value")
+            )
+        self._strings[domain] = cookie
+        return cookie
+
+    @property
+    def index(self) -> DomainIndex:
+        """有可用 Cookie 的域名的后缀索引，只在需要父域名匹配时建立"""
+        if self._index is None:
+            self._index = DomainIndex({
+                domain: None for domain, content_list in self.data.items()
+                if content_list and not all(
+                    c.get("name") == "cf_clearance" for c in content_list
+                )
+            })
+        return self._index
+
+    def lookup(self, domain: str) -> tuple[str, str] | None:
+        """
+        查找 domain 自身或其最近的父域名的 Cookie
+        :return: (匹配到的域名, Cookie 字符串)，未找到时返回 None
+        """
+        if cookie := self.cookie_string(domain):
+            return domain, cookie
+        if match := self.index.longest_match(domain):
+            matched = match[0]
+            return matched, self.cookie_string(matched)
+        return None
 
 
 class CookieCloud:
-    def __init__(self, url: str, uuid: str, password: str):
-        if PyCookieCloud is None:
+    def __init__(self, url: str, uuid: str, password: str,
+                 cache_file: str | None = COOKIE_CACHE_FILE,
+                 cache_ttl: float = DEFAULT_COOKIE_CACHE_TTL):
+        if not pycookiecloud_available():
             raise ImportError("PyCookieCloud 模块未安装，无法初始化 CookieCloud。")
-        self.client = PyCookieCloud(url, uuid, password)
-        self.cookies: dict | None = None
+        self.url = url
+        self.uuid = uuid
+        self.password = password
+        self._client = None
+        self.jar: CookieJar | None = None
+        # 需要 Cookie 的主机，设置后只保留这些主机相关的域名
+        self.domains: set[str] | None = None
+        self.cache_file = cache_file
+        self.cache_ttl = cache_ttl
+        # 当前 cookies 是否来自本地缓存 (而非本次运行从服务器下载)
+        self.from_cache = False
+
+    @property
+    def client(self):
+        """PyCookieCloud 客户端，第一次需要 Cookie 时才导入和创建"""
+        if self._client is None:
+            self._client = lazy_import('PyCookieCloud').PyCookieCloud(
+                self.url, self.uuid, self.password
+            )
+        return self._client
+
+    @property
+    def crypto(self):
+        return lazy_import('PyCookieCloud.PyCryptoJS')
+
+    def _load_cache(self) -> CookieJar | None:
+        """读取未过期的本地缓存，缓存缺失、过期或无法解密时返回 None"""
+        if not self.cache_file or self.cache_ttl <= 0:
+            return None
+        try:
+            with open(self.cache_file, 'rb') as f:
+                encrypted = f.read()
+            payload = json.loads(
+                self.crypto.decrypt(
+                    encrypted, self.client.get_the_key().encode('utf-8')
+                )
+            )
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f'⚠️ CookieCloud 本地缓存无法读取，已忽略: {e}')
+            return None
+
+        age = time.time() - payload.get('fetched_at', 0)
+        if not 0 <= age < self.cache_ttl:
+            logger.info('☁️ CookieCloud 本地缓存已过期。')
+            return None
+        if 'jar' not in payload:
+            # 旧版缓存保存的是拼接好的字符串，重新下载
+            return None
+        return CookieJar(payload['jar'], self.domains)
+
+    def _save_cache(self):
+        """使用 CookieCloud 密钥加密后原子地写入本地缓存"""
+        if not self.cache_file or self.cache_ttl <= 0 or not self.jar:
+            return
+        payload = json.dumps({
+            'fetched_at': time.time(),
+            'jar': self.jar.data,
+        }).encode('utf-8')
+        tmp_file = f"{self.cache_file}.tmp"
+        try:
+            encrypted = self.crypto.encrypt(
+                payload, self.client.get_the_key().encode('utf-8')
+            )
+            with open(tmp_file, 'wb') as f:
+                f.write(encrypted)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logger.warning(f'⚠️ 写入 CookieCloud 本地缓存失败: {e}')
 
     def _fetch_all_cookies(self):
+        cached = self._load_cache()
+        if cached is not None:
+            self.jar = cached
+            self.from_cache = True
+            logger.info('☁️ 使用 CookieCloud 本地缓存。')
+            return
+        self.refresh()
+
+    def refresh(self):
+        """忽略本地缓存，从 CookieCloud 重新下载并更新缓存"""
         logger.info('☁️ 从 CookieCloud 获取所有 cookies...')
+        self.from_cache = False
         try:
             decrypted_data = self.client.get_decrypted_data()
             if not decrypted_data:
                 logger.error('❌ 从 CookieCloud 解密数据失败。')
-                self.cookies = {}
+                self.jar = CookieJar()
                 return
 
-            self.cookies = self._process_cookies(decrypted_data)
-            logger.success('✅ 成功从 CookieCloud 获取所有 cookies。')
+            self.jar = CookieJar(decrypted_data, self.domains)
+            if self.domains is not None:
+                logger.success(
+                    f'✅ 成功从 CookieCloud 获取 cookies，保留 {len(self.jar)}/'
+                    f'{len(decrypted_data)} 个相关域名。'
+                )
+            else:
+                logger.success('✅ 成功从 CookieCloud 获取所有 cookies。')
+            self._save_cache()
         except Exception as e:
             logger.error(f'❌ 从 CookieCloud 获取所有 cookies 时发生错误: {e}')
-            self.cookies = {}
-
-    def _process_cookies(self, decrypted_data: dict) -> dict:
-        processed_cookies = {}
-        for domain, content_list in decrypted_data.items():
-            if not content_list or all(
-                c.get("name") == "cf_clearance" for c in content_list
-            ):
-                continue
-
-            cookie_list = [
-                f"{c.get('name')}={c.get('value')}"
-                for c in content_list if c.get("name") and c.get("value")
-            ]
-
-            if domain.startswith('.'):
-                domain = domain[1:]
-            processed_cookies[domain] = "; ".join(cookie_list)
-        return processed_cookies
+            self.jar = CookieJar()
 
     def get_cookies(self, domain: str) -> str | None:
         """
@@ -154,68 +520,110 @@ class CookieCloud:
             logger.warning('⚠️ 无效或空的域名，无法获取 cookies。')
             return None
 
-        if self.cookies is None:
+        if self.jar is None:
             self._fetch_all_cookies()
 
-        if not self.cookies:
+        cookie = self._lookup(domain)
+        # 缓存中没有该域名时，可能是缓存之后新增的站点，重新下载一次
+        if cookie is None and self.from_cache:
+            logger.info(f'☁️ 本地缓存中未找到 {domain}，重新从 CookieCloud 获取。')
+            self.refresh()
+            cookie = self._lookup(domain)
+
+        if cookie is None and self.jar:
+            logger.warning(f'⚠️ 未找到域名 {domain} 的 cookies。')
+        return cookie
+
+    def _lookup(self, domain: str) -> str | None:
+        if not self.jar:
             logger.warning('⚠️ 在 CookieCloud 中未找到任何 cookies。')
             return None
 
-        # Direct match
-        if cookie := self.cookies.get(domain):
+        # Direct match, or parent domain match on label boundaries only
+        match = self.jar.lookup(domain)
+        if match is None:
+            return None
+        d, c = match
+        if d == domain:
             logger.success(f'✅ 成功获取域名 {domain} 的 cookies。')
-            return cookie
+        else:
+            logger.info(f"🔍 在 {domain} 未找到 cookie，但在 {d} 找到了。")
+        return c
 
-        # Subdomain match
-        for d, c in self.cookies.items():
-            if domain.endswith(d):
-                logger.info(f"🔍 在 {domain} 未找到 cookie，但在 {d} 找到了。")
-                return c
 
-        logger.warning(f'⚠️ 未找到域名 {domain} 的 cookies。')
-        return None
+def parse_accounts(site_key: str, value) -> list[tuple[str | None, str]]:
+    """
+    将 sites 中一个站点的值整理为账号列表 [(账号名称, Cookie), ...]。
+    Cookie 为空字符串表示从 CookieCloud 获取；单个 Cookie 的账号名称为 None，
+    列表中未命名的账号按位置命名为 "1"、"2"...
+    """
+    if not isinstance(value, list):
+        return [(None, value or "")]
+
+    accounts = []
+    for index, item in enumerate(value, 1):
+        if item is None or isinstance(item, str):
+            accounts.append((str(index), item or ""))
+        elif isinstance(item, dict):
+            name = item.get('name') or str(index)
+            accounts.append((str(name), item.get('cookie') or ""))
+        else:
+            logger.warning(f"⚠️ 站点 '{site_key}' 的第 {index} 个账号配置无效，已跳过。")
+    return accounts
 
 
 def load_configuration():
     """
     从环境变量 PT_CHECKIN_CONFIG 加载并解析统一的配置。
-    :return: 一个元组 (cookie_manager, sites_to_checkin)。
+    :return: 一个元组 (cookie_manager, sites_to_checkin, options)。
              cookie_manager: CookieCloud实例或None。
-             sites_to_checkin: 站点配置字典或None。
+             sites_to_checkin: {站点: [(账号, Cookie), ...]} 或None，
+                               见 parse_accounts。
+             options: 引擎运行参数字典。
     """
     config_str = os.getenv("PT_CHECKIN_CONFIG")
     if not config_str:
         logger.error("❌ 环境变量 `PT_CHECKIN_CONFIG` 未设置！")
-        return None, None
+        return None, None, {}
 
     try:
         config = json.loads(config_str)
     except json.JSONDecodeError:
         logger.error("❌ `PT_CHECKIN_CONFIG` 环境变量格式错误，不是有效的JSON。")
-        return None, None
+        return None, None, {}
 
     if 'sites' not in config or not isinstance(config['sites'], dict):
         logger.error("❌ 配置中缺少 'sites' 键，或其值不是一个对象。")
-        return None, None
+        return None, None, {}
 
-    sites_to_checkin = config['sites']
+    sites_to_checkin = {
+        site_key: parse_accounts(site_key, value)
+        for site_key, value in config['sites'].items()
+    }
     cookie_manager = None
 
+    options = config.get('options') or {}
+    if not isinstance(options, dict):
+        logger.warning("⚠️ 'options' 不是一个对象，已忽略。")
+        options = {}
+
     # 检查是否有站点需要使用CookieCloud
     needs_cc = any(
-        not value for value in sites_to_checkin.values()
+        not cookie
+        for accounts in sites_to_checkin.values()
+        for _, cookie in accounts
     )
 
     if needs_cc:
         logger.info("☁️ 检测到需要使用 CookieCloud 的站点。")
-        if PyCookieCloud is None:
+        if not pycookiecloud_available():
             logger.error("❌ 配置了使用CookieCloud，但PyCookieCloud模块未安装。")
-            return None, None
+            return None, None, {}
 
         cc_config = config.get('cookie_cloud')
         if not cc_config:
             logger.error("❌ 配置了使用CookieCloud，但缺少 'cookie_cloud' 配置块。")
-            return None, None
+            return None, None, {}
 
         url = cc_config.get('url')
         uuid = cc_config.get('uuid')
@@ -223,17 +631,23 @@ def load_configuration():
 
         if not (url and uuid and password):
             logger.error("❌ CookieCloud 配置不完整 (需要 url, uuid, password)。")
-            return None, None
+            return None, None, {}
 
         try:
-            cookie_manager = CookieCloud(url, uuid, password)
+            cookie_manager = CookieCloud(
+                url, uuid, password,
+                cache_file=cc_config.get('cache_file', COOKIE_CACHE_FILE),
+                cache_ttl=float(
+                    cc_config.get('cache_ttl', DEFAULT_COOKIE_CACHE_TTL)
+                ),
+            )
             logger.info("✅ CookieCloud 管理器初始化成功。")
         except ImportError as e:
             logger.error(f"❌ 初始化 CookieCloud 失败: {e}")
-            return None, None
+            return None, None, {}
 
     logger.info("✅ 配置加载成功。")
-    return cookie_manager, sites_to_checkin
+    return cookie_manager, sites_to_checkin, options
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -241,70 +655,558 @@ def load_configuration():
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
 
-def init_db():
-    """初始化数据库和表"""
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS checkin_log (
-                site_name TEXT PRIMARY KEY,
-                last_checkin_date TEXT
+# 运行租约的过期时间 (秒)，运行中每三分之一过期时间续期一次
+DEFAULT_LEASE_TIMEOUT = 600
+
+
+class StateStore:
+    """
+    签到状态存储。
+    整个运行期间只打开一个数据库连接 (WAL 模式)，启动时用一次查询读取所有
+    站点的最后签到日期；签到成功的记录先缓存在内存中，攒够一批或超过刷新
+    间隔后在同一个事务中写入。每次写入都是完整事务，进程中途被杀时最多丢失
+    尚未刷新的记录，这些站点会在下次运行时重新签到。
+
+    同一个库中的 site_health 表记录各站点连续失败的次数和熔断时间，
+    用于跨运行的熔断判断；site_values 表按 (站点, 时间) 记录每次签到成功时的
+    魔力值、连续签到天数和排名，供 history/daily/summary 查询。
+
+    bad_cookies 表按站点记录已判定失效的 Cookie 的指纹，Cookie 更新前不再请求。
+    task_log 表记录 ck_all.py 中每天只运行一次的脚本最后一次成功运行的日期，
+    与站点的 checkin_log 分开保存。
+
+    多个运行可能重叠 (定时任务与手动运行，或上一次运行仍在重试)。每个运行在
+    runs 表中持有一个带过期时间的租约并定期续期，签到前在 site_claims 表中
+    认领站点；已被其他存活运行认领的站点直接跳过。运行结束时释放认领，
+    进程被强制结束时，其认领在租约过期后自动失效。
+    """
+
+    def __init__(self, path: str = DB_FILE, flush_every: int = 10,
+                 flush_interval: float = 30.0):
+        self.path = path
+        self.flush_every = max(1, int(flush_every))
+        self.flush_interval = flush_interval
+        self._last_dates: dict[str, str] = {}
+        self._pending: dict[str, str] = {}
+        # site_name -> (连续失败次数, 熔断开始的时间戳或None)
+        self._health: dict[str, tuple[int, float | None]] = {}
+        self._pending_health: dict[str, tuple[int, float | None]] = {}
+        # (site_name, 时间戳, magic, streak, rank)
+        self._pending_values: list[tuple] = []
+        # site_name -> 失效 Cookie 的指纹；待写入的值为 None 表示删除
+        self._bad_cookies: dict[str, str] = {}
+        self._pending_cookies: dict[str, str | None] = {}
+        self._last_flush = time.monotonic()
+        # 本次运行的租约标识，start_lease 之后才参与跨运行的认领
+        self.owner = f"{os.getpid()}-{int(time.time())}-{random.getrandbits(32):08x}"
+        self.lease_timeout = DEFAULT_LEASE_TIMEOUT
+        self._lease_renewed: float | None = None
+        self._lock = threading.Lock()
+        self.conn = None
+        try:
+            self.conn = sqlite3.connect(
+                path, timeout=30, check_same_thread=False
             )
-        ''')
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"❌ 数据库初始化失败: {e}")
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            with self.conn:
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS checkin_log (
+                        site_name TEXT PRIMARY KEY,
+                        last_checkin_date TEXT
+                    )
+                ''')
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS site_health (
+                        site_name TEXT PRIMARY KEY,
+                        consecutive_failures INTEGER NOT NULL DEFAULT 0,
+                        opened_at REAL
+                    )
+                ''')
+                # 主键即索引，按站点和时间范围查询时不需要回表
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS site_values (
+                        site_name TEXT NOT NULL,
+                        ts INTEGER NOT NULL,
+                        magic REAL,
+                        streak INTEGER,
+                        rank INTEGER,
+                        PRIMARY KEY (site_name, ts)
+                    ) WITHOUT ROWID
+                ''')
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS bad_cookies (
+                        site_name TEXT PRIMARY KEY,
+                        fingerprint TEXT NOT NULL,
+                        marked_at REAL NOT NULL
+                    )
+                ''')
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS task_log (
+                        task_name TEXT PRIMARY KEY,
+                        last_run_date TEXT
+                    )
+                ''')
+                # 早期版本把 ck_all 的脚本以 "task:" 前缀记录在 checkin_log 中
+                self.conn.execute(
+                    "DELETE FROM checkin_log WHERE site_name LIKE 'task:%'"
+                )
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS runs (
+                        owner TEXT PRIMARY KEY,
+                        started_at REAL NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                ''')
+                self.conn.execute('''
+                    CREATE TABLE IF NOT EXISTS site_claims (
+                        site_name TEXT PRIMARY KEY,
+                        owner TEXT NOT NULL,
+                        claimed_at REAL NOT NULL
+                    )
+                ''')
+            rows = self.conn.execute(
+                "SELECT site_name, last_checkin_date FROM checkin_log"
+            ).fetchall()
+            self._last_dates = dict(rows)
+            rows = self.conn.execute(
+                "SELECT site_name, consecutive_failures, opened_at "
+                "FROM site_health"
+            ).fetchall()
+            self._health = {name: (fails, opened) for name, fails, opened in rows}
+            self._bad_cookies = dict(self.conn.execute(
+                "SELECT site_name, fingerprint FROM bad_cookies"
+            ).fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"❌ 数据库初始化失败: {e}")
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now().strftime('%Y-%m-%d')
+
+    def signed_today(self, site_name: str) -> bool:
+        """检查今天是否已经签到过"""
+        with self._lock:
+            return self._last_dates.get(site_name) == self._today()
+
+    def mark_signed(self, site_name: str):
+        """记录签到成功，按批量大小和刷新间隔决定是否立即写入"""
+        today_str = self._today()
+        with self._lock:
+            self._last_dates[site_name] = today_str
+            self._pending[site_name] = today_str
+        self._maybe_flush()
+
+    def circuit(self, site_name: str, threshold: int,
+                cooldown: float) -> tuple[str, int, float | None]:
+        """
+        查询站点的熔断状态
+        :return: (state, failures, retry_at)。state 为 "closed" (正常)、
+                 "open" (熔断中，跳过) 或 "half_open" (冷却结束，允许一次探测)；
+                 retry_at 为熔断中时允许探测的时间戳。
+        """
+        with self._lock:
+            failures, opened_at = self._health.get(site_name, (0, None))
+        if failures < threshold or opened_at is None:
+            return "closed", failures, None
+        retry_at = opened_at + cooldown
+        if time.time() < retry_at:
+            return "open", failures, retry_at
+        return "half_open", failures, retry_at
+
+    def record_health(self, site_name: str, ok: bool, threshold: int):
+        """
+        记录一次签到的最终结果。成功时清零；失败时累加连续失败次数，
+        达到阈值 (或探测失败) 时重新开始计算冷却时间。
+        """
+        with self._lock:
+            failures, opened_at = self._health.get(site_name, (0, None))
+            if ok:
+                health = (0, None)
+            else:
+                failures += 1
+                if failures >= threshold:
+                    opened_at = time.time()
+                health = (failures, opened_at)
+            if health == self._health.get(site_name, (0, None)):
+                return
+            self._health[site_name] = health
+            self._pending_health[site_name] = health
+        self._maybe_flush()
+
+    @staticmethod
+    def cookie_fingerprint(cookie: str) -> str:
+        return hashlib.sha256(cookie.encode('utf-8')).hexdigest()[:32]
+
+    def cookie_known_bad(self, site_name: str, cookie: str) -> bool:
+        """该 Cookie 是否已被判定失效且之后没有更新"""
+        with self._lock:
+            fingerprint = self._bad_cookies.get(site_name)
+        return fingerprint == self.cookie_fingerprint(cookie)
+
+    def record_cookie(self, site_name: str, cookie: str, valid: bool):
+        """记录 Cookie 是否有效，失效时保存其指纹"""
+        fingerprint = None if valid else self.cookie_fingerprint(cookie)
+        with self._lock:
+            if self._bad_cookies.get(site_name) == fingerprint:
+                return
+            if fingerprint is None:
+                self._bad_cookies.pop(site_name, None)
+            else:
+                self._bad_cookies[site_name] = fingerprint
+            self._pending_cookies[site_name] = fingerprint
+        self._maybe_flush()
+
+    def record_values(self, site_name: str, values: dict):
+        """记录签到页面中的魔力值、连续签到天数和排名，随签到状态一起写入"""
+        with self._lock:
+            self._pending_values.append((
+                site_name, int(time.time()), values.get('magic'),
+                values.get('streak'), values.get('rank')
+            ))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        with self._lock:
+            pending = (
+                len(self._pending) + len(self._pending_health) +
+                len(self._pending_values) + len(self._pending_cookies)
+            )
+            due = (
+                pending >= self.flush_every or
+                time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """在一个事务中写入所有缓存的签到记录和站点健康状态"""
+        with self._lock:
+            if self.conn is None:
+                return
+            if not (self._pending or self._pending_health or
+                    self._pending_values or self._pending_cookies):
+                return
+            now = time.time()
+            bad_rows = [
+                (name, fingerprint, now)
+                for name, fingerprint in self._pending_cookies.items()
+                if fingerprint is not None
+            ]
+            fixed_rows = [
+                (name,) for name, fingerprint in self._pending_cookies.items()
+                if fingerprint is None
+            ]
+            rows = list(self._pending.items())
+            health_rows = [
+                (name, failures, opened_at)
+                for name, (failures, opened_at) in self._pending_health.items()
+            ]
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        "REPLACE INTO checkin_log (site_name, last_checkin_date) "
+                        "VALUES (?, ?)",
+                        rows
+                    )
+                    self.conn.executemany(
+                        "REPLACE INTO site_health "
+                        "(site_name, consecutive_failures, opened_at) "
+                        "VALUES (?, ?, ?)",
+                        health_rows
+                    )
+                    self.conn.executemany(
+                        "REPLACE INTO site_values "
+                        "(site_name, ts, magic, streak, rank) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        self._pending_values
+                    )
+                    self.conn.executemany(
+                        "REPLACE INTO bad_cookies "
+                        "(site_name, fingerprint, marked_at) VALUES (?, ?, ?)",
+                        bad_rows
+                    )
+                    self.conn.executemany(
+                        "DELETE FROM bad_cookies WHERE site_name = ?",
+                        fixed_rows
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"❌ 记录签到状态失败: {e}")
+                return
+            self._pending.clear()
+            self._pending_health.clear()
+            self._pending_values.clear()
+            self._pending_cookies.clear()
+            self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.release()
+        with self._lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    # ---- 跨运行的租约和站点认领 ----
+
+    def start_lease(self, timeout: float = DEFAULT_LEASE_TIMEOUT):
+        """
+        登记本次运行的租约，超过 timeout 秒未续期即视为进程已退出，
+        其认领的站点可以被其他运行重新认领
+        """
+        self.lease_timeout = max(1.0, float(timeout))
+        now = time.time()
+        with self._lock:
+            if self.conn is None:
+                return
+            try:
+                with self.conn:
+                    self.conn.execute(
+                        "REPLACE INTO runs (owner, started_at, expires_at) "
+                        "VALUES (?, ?, ?)",
+                        (self.owner, now, now + self.lease_timeout)
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"❌ 登记运行租约失败: {e}")
+                return
+            self._lease_renewed = time.monotonic()
 
+    def renew_lease(self):
+        """续期租约，距上次续期超过租约时长的三分之一时才写入"""
+        with self._lock:
+            if self.conn is None or self._lease_renewed is None:
+                return
+            if time.monotonic() - self._lease_renewed < self.lease_timeout / 3:
+                return
+            try:
+                with self.conn:
+                    self.conn.execute(
+                        "UPDATE runs SET expires_at = ? WHERE owner = ?",
+                        (time.time() + self.lease_timeout, self.owner)
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ 续期运行租约失败: {e}")
+                return
+            self._lease_renewed = time.monotonic()
 
-def check_if_signed_today(site_name):
-    """检查今天是否已经签到过"""
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        sql = "SELECT last_checkin_date FROM checkin_log WHERE site_name = ?"
-        cursor.execute(sql, (site_name,))
-        result = cursor.fetchone()
-        conn.close()
-        if result:
-            last_date_str = result[0]
-            today_str = datetime.now().strftime('%Y-%m-%d')
-            if last_date_str == today_str:
-                return True
-    except Exception as e:
-        logger.error(f"❌ 查询签到状态失败 for {site_name}: {e}")
-    return False
+    def claim(self, site_name: str, task: bool = False) -> str:
+        """
+        为本次运行认领站点
+        :param task: 为 True 时认领的是 ck_all.py 的脚本，按 task_log 判断今日是否已运行
+        :return: "claimed" (认领成功或未启用租约)；"signed" (其他运行已完成
+                 今日签到)；"busy" (其他存活的运行正在签到该站点)
+        """
+        today = self._today()
+        now = time.time()
+        if task:
+            query = "SELECT last_run_date FROM task_log WHERE task_name = ?"
+            claim_key = f"task:{site_name}"
+        else:
+            query = ("SELECT last_checkin_date FROM checkin_log "
+                     "WHERE site_name = ?")
+            claim_key = site_name
+        with self._lock:
+            if self.conn is None or self._lease_renewed is None:
+                return "claimed"
+            try:
+                with self.conn:
+                    # 写锁保证认领和检查之间没有其他运行插入
+                    self.conn.execute("BEGIN IMMEDIATE")
+                    row = self.conn.execute(query, (site_name,)).fetchone()
+                    if row and row[0] == today:
+                        if not task:
+                            self._last_dates[site_name] = today
+                        return "signed"
+                    # 清理租约已过期的运行留下的认领
+                    self.conn.execute(
+                        "DELETE FROM site_claims WHERE site_name = ? AND "
+                        "owner NOT IN (SELECT owner FROM runs WHERE expires_at > ?)",
+                        (claim_key, now)
+                    )
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO site_claims "
+                        "(site_name, owner, claimed_at) VALUES (?, ?, ?)",
+                        (claim_key, self.owner, now)
+                    )
+                    owner = self.conn.execute(
+                        "SELECT owner FROM site_claims WHERE site_name = ?",
+                        (claim_key,)
+                    ).fetchone()[0]
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ [{site_name}] 认领站点失败，按未认领处理: {e}")
+                return "claimed"
+        return "claimed" if owner == self.owner else "busy"
+
+    def mark_task_done(self, task_name: str):
+        """记录 ck_all.py 的脚本今日已成功运行，立即写入 task_log"""
+        with self._lock:
+            if self.conn is None:
+                return
+            try:
+                with self.conn:
+                    self.conn.execute(
+                        "REPLACE INTO task_log (task_name, last_run_date) "
+                        "VALUES (?, ?)", (task_name, self._today())
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ [{task_name}] 记录运行状态失败: {e}")
+
+    def release(self):
+        """释放本次运行的租约和全部认领"""
+        with self._lock:
+            if self.conn is None or self._lease_renewed is None:
+                return
+            try:
+                with self.conn:
+                    self.conn.execute(
+                        "DELETE FROM site_claims WHERE owner = ?", (self.owner,)
+                    )
+                    self.conn.execute(
+                        "DELETE FROM runs WHERE owner = ? OR expires_at < ?",
+                        (self.owner, time.time())
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ 释放运行租约失败: {e}")
+                return
+            self._lease_renewed = None
+
+    # ---- site_values 查询 ----
+
+    @staticmethod
+    def _range_filter(sites, since: float | None,
+                      until: float | None) -> tuple[str, list]:
+        clauses = []
+        params = []
+        if sites:
+            clauses.append(f"site_name IN ({','.join('?' * len(sites))})")
+            params.extend(sites)
+        # ts 为整数秒，边界向上取整后与小数时间戳的比较结果相同
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(math.ceil(since))
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(math.ceil(until))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def _query(self, sql: str, params) -> list[dict]:
+        self.flush()
+        with self._lock:
+            if self.conn is None:
+                return []
+            cursor = self.conn.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def history(self, sites=None, since: float | None = None,
+                until: float | None = None) -> list[dict]:
+        """
+        按时间顺序返回各站点的记录
+        :param sites: 站点名称列表，None 表示全部站点
+        :param since: 起始时间戳 (包含)
+        :param until: 结束时间戳 (不包含)
+        """
+        where, params = self._range_filter(sites, since, until)
+        return self._query(
+            "SELECT site_name, ts, magic, streak, rank FROM site_values "
+            f"{where} ORDER BY site_name, ts",
+            params
+        )
 
+    def daily(self, sites=None, since: float | None = None,
+              until: float | None = None) -> list[dict]:
+        """
+        每个站点每天最后一条记录，以及魔力值相对前一条日记录的变化 (delta)。
+        只统计 since 之后的记录 (起始时间可以在一天中间)；范围内第一天的 delta
+        以 since 之前的最后一条记录为基准。
+        """
+        where, params = self._range_filter(sites, since, until)
+        # SQLite 中与 MAX() 一起选出的其他列取自 ts 最大的那一行
+        rows = self._query(
+            "SELECT site_name, date(ts, 'unixepoch', 'localtime') AS day, "
+            "magic, streak, rank, MAX(ts) AS ts FROM site_values "
+            f"{where} GROUP BY site_name, day ORDER BY site_name, day",
+            params
+        )
+        previous = {}
+        if since is not None:
+            where, params = self._range_filter(sites, None, since)
+            where = (f"{where} AND magic IS NOT NULL" if where
+                     else "WHERE magic IS NOT NULL")
+            previous = {
+                row['site_name']: row['magic'] for row in self._query(
+                    "SELECT site_name, magic, MAX(ts) AS ts FROM site_values "
+                    f"{where} GROUP BY site_name",
+                    params
+                )
+            }
+        for row in rows:
+            site_name = row['site_name']
+            last_magic = previous.get(site_name)
+            row['delta'] = (
+                row['magic'] - last_magic
+                if row['magic'] is not None and last_magic is not None
+                else None
+            )
+            if row['magic'] is not None:
+                previous[site_name] = row['magic']
+        return rows
 
-def record_signin(site_name):
-    """记录签到成功"""
-    try:
-        today_str = datetime.now().strftime('%Y-%m-%d')
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        sql = (
-            "REPLACE INTO checkin_log (site_name, last_checkin_date) "
-            "VALUES (?, ?)"
+    def summary(self, sites=None, since: float | None = None,
+                until: float | None = None) -> list[dict]:
+        """
+        每个站点在时间范围内的汇总: 记录数、首末魔力值及其变化、
+        最好/平均排名、最长连续签到天数
+        """
+        where, params = self._range_filter(sites, since, until)
+        bounds = ""
+        bound_params = []
+        if since is not None:
+            bounds += " AND ts >= ?"
+            bound_params.append(math.ceil(since))
+        if until is not None:
+            bounds += " AND ts < ?"
+            bound_params.append(math.ceil(until))
+        # 首末魔力值通过主键索引直接定位，不扫描整个站点的记录
+        rows = self._query(
+            "SELECT site_name, COUNT(*) AS records, "
+            "MIN(ts) AS first_ts, MAX(ts) AS last_ts, "
+            "(SELECT magic FROM site_values AS v WHERE "
+            f"v.site_name = s.site_name AND magic IS NOT NULL{bounds} "
+            "ORDER BY ts LIMIT 1) AS first_magic, "
+            "(SELECT magic FROM site_values AS v WHERE "
+            f"v.site_name = s.site_name AND magic IS NOT NULL{bounds} "
+            "ORDER BY ts DESC LIMIT 1) AS last_magic, "
+            "MIN(rank) AS best_rank, AVG(rank) AS avg_rank, "
+            "MAX(streak) AS max_streak "
+            f"FROM site_values AS s {where} "
+            "GROUP BY site_name ORDER BY site_name",
+            bound_params * 2 + params
         )
-        cursor.execute(sql, (site_name, today_str))
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logger.error(f"❌ 记录签到状态失败 for {site_name}: {e}")
+        for row in rows:
+            first, last = row['first_magic'], row['last_magic']
+            row['magic_change'] = (
+                last - first if first is not None and last is not None
+                else None
+            )
+        return rows
 
 
-# 通知服务
-try:
-    from notify import send
-except ImportError:
-    logger.warning("⚠️ `notify.py` not found, notifications will be skipped.")
+# 通知服务，第一次发送时才导入，由 ql_notify 在后台限时发送
+def send(title, content):
+    lazy_import('ql_notify').send(title, content)
 
-    def send(title, content):
-        logger.info(f"Notification -> Title: {title}, Content: {content}")
 
+def replay_notifications():
+    """重发之前的运行未能发出的通知，本次没有通知要发送时也在退出前调用"""
+    lazy_import('ql_notify').replay()
 
-# PT站点配置
+
+# 内置PT站点定义，可用的键见脚本说明第四节
 SITES_CONFIG = [
     {
         "name": "GGPT",
@@ -336,143 +1238,560 @@ SITES_CONFIG = [
 ]
 
 # 通用請求頭
-COMMON_HEADERS = {
-    'accept': (
-        'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,'
-        'image/webp,image/apng,*/*;q=0.8,'
-        'application/signed-exchange;v=b3;q=0.7'
-    ),
-    'accept-language': 'zh-CN,zh;q=0.9,und;q=0.8',
-    'sec-ch-ua': (
-        '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"'
-    ),
-    'sec-ch-ua-mobile': '?0',
-    'sec-ch-ua-platform': '"Windows"',
-    'sec-fetch-dest': 'document',
-    'sec-fetch-mode': 'navigate',
-    'sec-fetch-site': 'same-origin',
-    "sec-fetch-user": '?1',
-    "sec-gpc": '1',
-    "upgrade-insecure-requests": '1',
-    'user-agent': (
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
-        '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    ),
-}
+COMMON_HEADERS = header_profile('navigate')
 
 
-def sign_in(site_config, cookie):
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 站点定义与页面解析
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+DEFAULT_SUCCESS_MARKERS = ("这是您的第",)
+DEFAULT_COOKIE_INVALID_MARKERS = ("https://www.gov.cn/",)
+DEFAULT_SERVER_ERROR_MARKERS = ("503 Service Temporarily", "502 Bad Gateway")
+DEFAULT_RANK_PATTERN = (
+    r'这是您的第 <b>(\d+)</b>[\s\S]*?'
+    r'今日签到排名：<b>(\d+)</b>'
+)
+DEFAULT_STREAK_PATTERN = r'已连续签到\s*<b>(\d+)</b>'
+
+
+def default_magic_pattern(magic_keyword: str) -> str:
+    return rf"{re.escape(magic_keyword)}.*?(\d+(?:,\d+)*(?:\.\d+)?)"
+
+
+class SiteParser:
     """
-    通用的签到函数
-    :param site_config: 站点配置字典
-    :param cookie: 对应站点的cookie字符串
-    :return: 包含签到结果的字典
+    站点签到页面的解析规则，构建站点定义时编译一次，之后所有请求复用。
+    extractors 为 {字段名: 正则}；"magic" 取第一个分组作为魔力值，
+    "rank" 取整个匹配作为签到排名描述，"streak" 取第一个分组作为连续签到天数，
+    其他字段取第一个分组。
     """
-    site_name = site_config["name"]
-    logger.info(f"开始为站点 [{site_name}] 执行签到...")
 
-    max_retries = 3
-    retries = 0
+    def __init__(self, magic_keyword: str, success_markers=None,
+                 cookie_invalid_markers=None, server_error_markers=None,
+                 extractors: dict | None = None):
+        self.magic_keyword = magic_keyword
+        self.success_markers = tuple(
+            success_markers or DEFAULT_SUCCESS_MARKERS
+        )
+        self.cookie_invalid_markers = tuple(
+            cookie_invalid_markers or DEFAULT_COOKIE_INVALID_MARKERS
+        )
+        self.server_error_markers = tuple(
+            server_error_markers or DEFAULT_SERVER_ERROR_MARKERS
+        )
+        patterns = {
+            'magic': default_magic_pattern(magic_keyword),
+            'rank': DEFAULT_RANK_PATTERN,
+            'streak': DEFAULT_STREAK_PATTERN,
+        }
+        patterns.update(extractors or {})
+        self.extractors = {
+            name: re.compile(pattern) for name, pattern in patterns.items()
+            if pattern
+        }
+
+    def format_success(self, fields: dict) -> str:
+        msg = '🎉 签到成功! '
+        for name, match in fields.items():
+            if name == 'magic':
+                magic_value = match.group(1).replace(',', '')
+                msg += f"当前{self.magic_keyword}为: {magic_value}。 "
+            elif name == 'rank':
+                result = match.group(0)
+                result = result.replace("<b>", "").replace("</b>", "")
+                result = result.replace(
+                    "点击白色背景的圆点进行补签。", ""
+                ).replace('<span style="float:right">', "")
+                msg += result
+            elif name == 'streak':
+                # 默认的签到排名描述中已包含连续签到天数
+                if 'rank' not in fields and match.re.groups:
+                    msg += f" 已连续签到 {match.group(1)} 天。"
+            else:
+                value = match.group(1) if match.re.groups else match.group(0)
+                msg += f" {name}: {value}"
+        return msg.strip()
 
-    headers = COMMON_HEADERS.copy()
-    headers.update(site_config["headers"])
-    headers['Cookie'] = cookie
+    def numeric_values(self, fields: dict) -> dict:
+        """
+        从提取结果中取出可以长期记录的数值:
+        magic (魔力值)、streak (连续签到天数)、rank (今日签到排名)
+        """
+        values = {}
+        magic = fields.get('magic')
+        if magic is not None and magic.re.groups:
+            values['magic'] = _parse_number(magic.group(1))
+        rank = fields.get('rank')
+        if rank is not None and rank.re.groups >= 2:
+            # 第一个分组是累计签到次数，不是连续签到天数
+            values['rank'] = _parse_number(rank.group(2), int)
+        streak = fields.get('streak')
+        if streak is not None and streak.re.groups:
+            values['streak'] = _parse_number(streak.group(1), int)
+        return {name: value for name, value in values.items()
+                if value is not None}
+
+
+def _parse_number(text: str | None, kind=float):
+    try:
+        return kind(text.replace(',', ''))
+    except (AttributeError, ValueError):
+        return None
 
-    while retries < max_retries:
-        try:
-            logger.info(f"[{site_name}] 第 {retries + 1} 次尝试签到...")
 
-            response = requests.get(
-                url=site_config["sign_in_url"],
-                headers=headers,
-                timeout=15,
-                verify=False
+class SiteDefinition:
+    """单个站点的定义：签到地址、请求头、重试策略和编译好的解析规则"""
+
+    def __init__(self, name: str, sign_in_url: str, magic_keyword: str = "魔力值",
+                 headers: dict | None = None, retry: dict | None = None,
+                 success_markers=None, cookie_invalid_markers=None,
+                 server_error_markers=None, extractors: dict | None = None,
+                 preflight=None):
+        if not name or not sign_in_url:
+            raise ValueError("站点定义缺少 name 或 sign_in_url")
+        self.name = name
+        self.sign_in_url = sign_in_url
+        self.host = urlparse(sign_in_url).netloc
+        if not self.host:
+            raise ValueError(f"站点 {name} 的 sign_in_url 无效: {sign_in_url}")
+        self.magic_keyword = magic_keyword
+        self.headers = dict(headers) if headers is not None else {
+            'authority': self.host,
+            'referer': sign_in_url,
+        }
+        self.retry = retry
+        # None 表示沿用 options.preflight
+        self.preflight = preflight
+        self.parser = SiteParser(
+            magic_keyword,
+            success_markers=success_markers,
+            cookie_invalid_markers=cookie_invalid_markers,
+            server_error_markers=server_error_markers,
+            extractors=extractors,
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        optional = (
+            'magic_keyword', 'headers', 'retry', 'success_markers',
+            'cookie_invalid_markers', 'server_error_markers', 'extractors',
+            'preflight',
+        )
+        return cls(
+            data.get('name'), data.get('sign_in_url'),
+            **{key: data[key] for key in optional if key in data}
+        )
+
+    def preflight_config(self, default: bool = False) -> dict | None:
+        """预检的 {url, method}，未启用时返回 None"""
+        preflight = default if self.preflight is None else self.preflight
+        if not preflight:
+            return None
+        config = preflight if isinstance(preflight, dict) else {}
+        return {
+            'url': config.get('url') or urljoin(self.sign_in_url, 'usercp.php'),
+            'method': str(config.get('method', 'HEAD')).upper(),
+        }
+
+
+class SiteRegistry:
+    """
+    站点定义注册表。
+    以内置的 SITES_CONFIG 为基础，叠加从 JSON/YAML 文件或目录中读取的站点
+    (同名站点以文件中的为准)。定义在第一次查询时才加载，按站点名和域名建立索引。
+    """
+
+    FILE_SUFFIXES = ('.json', '.yaml', '.yml')
+
+    def __init__(self, builtin: list | None = None, path: str | None = None):
+        self.builtin = builtin or []
+        self.path = path
+        self._by_name: dict[str, SiteDefinition] | None = None
+        self._by_domain = DomainIndex()
+
+    def _load(self):
+        self._by_name = {}
+        self._by_domain = DomainIndex()
+        for data in self.builtin + self._read_path():
+            try:
+                site = SiteDefinition.from_dict(data)
+            except (TypeError, ValueError, re.error) as e:
+                logger.error(f"❌ 站点定义无效，已跳过: {e}")
+                continue
+            self._by_name[site.name] = site
+        for site in self._by_name.values():
+            self._by_domain.add(site.host, site)
+        logger.info(f"✅ 已加载 {len(self._by_name)} 个站点定义。")
+
+    def _read_path(self) -> list:
+        if not self.path:
+            return []
+        if os.path.isdir(self.path):
+            files = sorted(
+                os.path.join(self.path, name)
+                for name in os.listdir(self.path)
+                if name.endswith(self.FILE_SUFFIXES)
             )
-            response.raise_for_status()
+        else:
+            files = [self.path]
 
-            rsp_text = response.text
-            msg = ""
+        definitions = []
+        for file in files:
+            try:
+                data = self._read_file(file)
+            except (OSError, ValueError, ImportError) as e:
+                logger.error(f"❌ 读取站点定义文件 {file} 失败: {e}")
+                continue
+            if isinstance(data, dict):
+                data = data.get('sites', [data])
+            if not isinstance(data, list):
+                logger.error(f"❌ 站点定义文件 {file} 格式错误，应为站点列表。")
+                continue
+            definitions.extend(d for d in data if isinstance(d, dict))
+        return definitions
 
-            if "这是您的第" in rsp_text:
-                msg += '🎉 签到成功! '
-                record_signin(site_name)
+    @staticmethod
+    def _read_file(file: str):
+        with open(file, 'r', encoding='utf-8') as f:
+            if file.endswith(('.yaml', '.yml')):
+                import yaml
+                return yaml.safe_load(f)
+            return json.load(f)
 
-                magic_keyword = site_config["magic_keyword"]
-                magic_pattern = rf"{magic_keyword}.*?(\d+(?:,\d+)*(?:\.\d+)?)"
-                magic_match = re.search(magic_pattern, rsp_text)
-                if magic_match:
-                    magic_value = magic_match.group(1).replace(',', '')
-                    msg += f"当前{magic_keyword}为: {magic_value}。 "
+    def _sites(self) -> dict:
+        if self._by_name is None:
+            self._load()
+        return self._by_name
 
-                pattern = (
-                    r'这是您的第 <b>(\d+)</b>[\s\S]*?'
-                    r'今日签到排名：<b>(\d+)</b>'
-                )
-                result_match = re.search(pattern, rsp_text)
-                if result_match:
-                    result = result_match.group(0)
-                    result = result.replace("<b>", "").replace("</b>", "")
-                    result = result.replace(
-                        "点击白色背景的圆点进行补签。", ""
-                    ).replace('<span style="float:right">', "")
-                    msg += result
-
-                logger.info(f"✅ [{site_name}] {msg.strip()}")
-                return {
-                    'site': site_name,
-                    'status': '✅ 成功',
-                    'message': msg.strip()
-                }
-
-            elif "https://www.gov.cn/" in rsp_text:
-                msg = "Cookie值错误! 响应跳转到第三方网站, 请检查网站cookie值"
-                logger.error(f"❌ [{site_name}] {msg}")
-                return {
-                    'site': site_name,
-                    'status': '🍪 Cookie失效',
-                    'message': msg
-                }
+    def get(self, name: str) -> SiteDefinition | None:
+        """按站点名查找"""
+        return self._sites().get(name)
 
-            elif ("503 Service Temporarily" in rsp_text or
-                  "502 Bad Gateway" in rsp_text):
-                msg = "服务器异常 (50x)！"
-                logger.warning(f"⚠️ [{site_name}] {msg}")
+    def find_by_domain(self, domain: str) -> SiteDefinition | None:
+        """按域名查找，子域名会匹配到其父域名的站点"""
+        self._sites()
+        match = self._by_domain.longest_match(domain)
+        return match[1] if match else None
 
-            else:
-                msg = "未知异常!"
-                logger.error(f"❌ [{site_name}] {msg}\n响应内容: {rsp_text[:200]}")
+    def resolve(self, key: str) -> SiteDefinition | None:
+        """先按站点名，再按域名查找"""
+        return self.get(key) or self.find_by_domain(key)
+
+    def __iter__(self):
+        return iter(self._sites().values())
+
+
+class AttendanceScanner:
+    """
+    签到页面的增量扫描器。
+    逐块喂入解码后的文本；签到成功且站点声明的字段都已提取到时即可停止读取
+    剩余的页面。其他情况 (Cookie 失效、50x) 仍读完整个响应后再判定，
+    与一次性读取整页的结果保持一致。
+    每个字段只从上次搜索停下的位置 (留出 SEARCH_OVERLAP 个字符的重叠) 继续搜索，
+    只保留仍需搜索的页面尾部用于拼接；跨度超过重叠部分的匹配在 finish() 时
+    对整页补搜一次。
+    """
+
+    # 跨块边界的匹配最多向前回看的字符数
+    SEARCH_OVERLAP = 2048
+
+    def __init__(self, parser: SiteParser):
+        self.parser = parser
+        self.bytes_read = 0
+        self.finished = False
+        self.success_at = -1
+        self.fields: dict[str, re.Match] = {}
+        self._chunks: list[str] = []
+        self._length = 0
+        # 仍需搜索的页面尾部及其在整页中的起始位置
+        self._tail = ""
+        self._tail_start = 0
+        self._marker_from = 0
+        self._search_from: dict[str, int] = {}
+
+    @property
+    def text(self) -> str:
+        """目前为止读到的全部文本"""
+        if len(self._chunks) > 1:
+            self._chunks[:] = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    @property
+    def complete(self) -> bool:
+        """是否已经提取到成功页面所需的全部字段"""
+        return (
+            self.success_at >= 0 and
+            len(self.fields) == len(self.parser.extractors)
+        )
+
+    def _find_success(self, tail: str):
+        base = self._tail_start
+        positions = [
+            pos for pos in (
+                tail.find(marker, max(0, self._marker_from - base))
+                for marker in self.parser.success_markers
+            ) if pos >= 0
+        ]
+        if positions:
+            self.success_at = base + min(positions)
+        longest = max(len(m) for m in self.parser.success_markers)
+        self._marker_from = max(0, self._length - longest + 1)
+
+    def _search(self, name: str, pattern: re.Pattern, tail: str):
+        if self.finished:
+            # 读完后对整页补搜一次，找回跨度超过重叠部分的匹配
+            match = pattern.search(self.text)
+            if match:
+                self.fields[name] = match
+            return
+        base = self._tail_start
+        start = max(0, self._search_from.get(name, 0) - base)
+        match = pattern.search(tail, start)
+        # 数字可能在块边界被截断 (如 "1," 之后还有 "234")，
+        # 匹配之后不足两个字符时等待更多数据
+        if match and match.end() + 2 <= len(tail):
+            self.fields[name] = match
+        elif match:
+            self._search_from[name] = base + match.start()
+        else:
+            self._search_from[name] = max(
+                0, self._length - self.SEARCH_OVERLAP
+            )
+
+    def feed(self, chunk: str) -> bool:
+        """
+        喂入一段文本
+        :return: True 表示所需字段已全部提取，可以停止读取
+        """
+        if chunk:
+            self._chunks.append(chunk)
+            self._length += len(chunk)
+        tail = self._tail + chunk
+
+        if self.success_at < 0:
+            self._find_success(tail)
+
+        pending = []
+        for name, pattern in self.parser.extractors.items():
+            if name not in self.fields:
+                self._search(name, pattern, tail)
+            if name not in self.fields:
+                pending.append(self._search_from.get(name, 0))
+        if self.success_at < 0:
+            pending.append(self._marker_from)
+
+        # 丢弃之后不会再搜索的部分
+        keep_from = max(self._tail_start, min(pending, default=self._length))
+        self._tail = tail[keep_from - self._tail_start:]
+        self._tail_start = keep_from
+        return self.complete
+
+    def consume(self, chunks, encoding: str | None = None,
+                early_stop: bool = True):
+        """
+        从字节块迭代器中增量解码并扫描
+        :param early_stop: 为 True 时，所需字段提取完成后立即停止读取
+        """
+        decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(
+            errors='replace'
+        )
+        for chunk in chunks:
+            self.bytes_read += len(chunk)
+            if self.feed(decoder.decode(chunk)) and early_stop:
+                return
+        self.finish(decoder.decode(b'', final=True))
+
+    def finish(self, tail: str = ""):
+        """标记响应已读完，补做依赖页面结尾的匹配"""
+        self.finished = True
+        self.feed(tail)
+
+    def cookie_invalid(self) -> bool:
+        return any(m in self.text for m in self.parser.cookie_invalid_markers)
+
+    def server_error(self) -> bool:
+        return any(m in self.text for m in self.parser.server_error_markers)
+
+    def success_message(self) -> str:
+        # 按声明顺序输出字段
+        fields = {
+            name: self.fields[name] for name in self.parser.extractors
+            if name in self.fields
+        }
+        return self.parser.format_success(fields)
+
+    def numeric_values(self) -> dict:
+        return self.parser.numeric_values(self.fields)
+
+
+# 预检请求被重定向到这些地址时，说明 Cookie 已失效
+LOGIN_REDIRECT_MARKERS = ("login.php", "takelogin", "/login")
+
+
+def request_headers(site, cookie: str) -> dict:
+    """通用请求头加上站点自身的请求头和 Cookie (连接池可能由多个脚本共用)"""
+    headers = {**COMMON_HEADERS, **site.headers}
+    headers['Cookie'] = cookie
+    return headers
+
+
+def preflight(site, cookie, config: dict, pool, label=None) -> str:
+    """
+    用一个不跟随跳转的轻量请求检查 Cookie 是否有效
+    :param config: SiteDefinition.preflight_config 的返回值
+    :return: "ok"、"bad" (Cookie 失效)，或 "unknown" (无法判断，应照常签到)
+    """
+    site_name = label or site.name
+    headers = request_headers(site, cookie)
+    url = config['url']
+    try:
+        if config['method'] == 'HEAD':
+            response = pool.request(
+                'HEAD', url, headers=headers, allow_redirects=False,
+                verify=False, retry=RetryPolicy(max_attempts=1)
+            )
+            status, location = response.status_code, response.headers.get('location', '')
+        else:
+            # GET 只看状态码和跳转地址，不读取响应体
+            with pool.stream(url, headers=headers, allow_redirects=False,
+                             verify=False) as response:
+                status, location = response.status_code, response.headers.get('location', '')
+    except pool.errors as e:
+        logger.warning(f"⚠️ [{site_name}] Cookie 预检失败，照常签到: {e}")
+        return "unknown"
+
+    markers = LOGIN_REDIRECT_MARKERS + site.parser.cookie_invalid_markers
+    if 300 <= status < 400 and any(m in location for m in markers):
+        verdict = "bad"
+    elif 200 <= status < 300:
+        verdict = "ok"
+    else:
+        # 401/403 也可能是 Cloudflare 验证或限流，不据此判定 Cookie 失效，
+        # 交给签到页面的 cookie_invalid_markers 判断
+        verdict = "unknown"
+    logger.info(f"🔎 [{site_name}] Cookie 预检: HTTP {status} -> {verdict}")
+    return verdict
+
+
+def sign_in(site, cookie, attempt=1, pool=None, stream=True, label=None):
+    """
+    执行一次签到尝试，重试由 CheckinEngine 统一调度
+    :param site: SiteDefinition 站点定义
+    :param cookie: 对应站点的cookie字符串
+    :param attempt: 当前是第几次尝试 (仅用于日志)
+    :param pool: SessionPool 实例，None 时使用一个临时连接池
+    :param stream: 为 True 时提取到所需字段即停止读取页面的剩余部分
+    :param label: 日志和结果中使用的名称 (多账号时为 "站点@账号")，默认为站点名称
+    :return: 元组 (result, retryable)。result 为签到结果字典，其中
+             'outcome' 为结果分类，'stats' 为本次尝试的网络指标
+             (见 collect_request_stats，另加 total 总耗时)，签到成功时
+             'values' 为页面中的魔力值、签到天数和排名；
+             retryable 为 True 表示本次失败可稍后重试。
+    """
+    started = time.perf_counter()
+    with collect_request_stats() as stats:
+        result, retryable = _sign_in(
+            site, cookie, attempt, pool, stream, label or site.name
+        )
+    stats['total'] = time.perf_counter() - started
+    result['stats'] = stats
+    return result, retryable
+
+
+def _sign_in(site, cookie, attempt, pool, stream, site_name):
+    logger.info(f"[{site_name}] 第 {attempt} 次尝试签到...")
 
-        except requests.exceptions.RequestException as e:
-            msg = f"请求失败，原因: {e}"
+    owns_pool = pool is None
+    if owns_pool:
+        pool = SessionPool(verify=False)
+
+    headers = request_headers(site, cookie)
+
+    scanner = AttendanceScanner(site.parser)
+    try:
+        with pool.stream(site.sign_in_url, headers=headers,
+                         verify=False) as response:
+            response.raise_for_status()
+            scanner.consume(
+                pool.iter_chunks(response), response.encoding,
+                early_stop=stream
+            )
+
+        rsp_text = scanner.text
+        if scanner.success_at >= 0:
+            msg = scanner.success_message()
+            logger.info(f"✅ [{site_name}] {msg}")
+            return {
+                'site': site_name,
+                'status': '✅ 成功',
+                'outcome': 'success',
+                'message': msg,
+                'values': scanner.numeric_values(),
+                'bytes_read': scanner.bytes_read
+            }, False
+
+        elif scanner.cookie_invalid():
+            msg = "Cookie值错误! 响应跳转到第三方网站, 请检查网站cookie值"
             logger.error(f"❌ [{site_name}] {msg}")
+            return {
+                'site': site_name,
+                'status': '🍪 Cookie失效',
+                'outcome': 'cookie_invalid',
+                'message': msg,
+                'bytes_read': scanner.bytes_read
+            }, False
+
+        elif scanner.server_error():
+            outcome = 'server_error'
+            msg = "服务器异常 (50x)！"
+            logger.warning(f"⚠️ [{site_name}] {msg}")
 
-        retries += 1
-        if retries < max_retries:
-            logger.info(f"[{site_name}] 等待20秒后进行重试...")
-            time.sleep(20)
+        else:
+            outcome = 'unknown'
+            msg = "未知异常!"
+            logger.error(f"❌ [{site_name}] {msg}\n响应内容: {rsp_text[:200]}")
+
+    except pool.errors as e:
+        # 带有响应的异常来自 raise_for_status，其余为网络错误
+        has_response = getattr(e, 'response', None) is not None
+        outcome = 'http_error' if has_response else 'request_error'
+        msg = f"请求失败，原因: {e}"
+        logger.error(f"❌ [{site_name}] {msg}")
+    finally:
+        if owns_pool:
+            pool.close()
 
-    final_msg = f"达到最大重试次数({max_retries}次)，签到失败。"
-    logger.error(f"❌ [{site_name}] {final_msg}")
     return {
         'site': site_name,
         'status': '❌ 失败',
-        'message': final_msg
-    }
+        'outcome': outcome,
+        'message': msg,
+        'bytes_read': scanner.bytes_read
+    }, True
 
 
-def format_and_send_notification(results):
+NOTIFY_TITLE = "【PT多站签到报告】"
+
+
+def format_report(results) -> str | None:
     """
-    格式化签到结果并发送通知
+    将签到结果格式化为通知内容
     :param results: 签到结果列表
+    :return: 通知内容，无需通知时返回 None
     """
     if not results:
         logger.info("没有签到结果，无需发送通知。")
-        return
+        return None
 
     valid_results = [res for res in results if res is not None]
     if not valid_results:
         logger.info("所有任务均已跳过，无需发送通知。")
-        return
+        return None
+
+    if all(res['status'] in ('🟢 跳过', '🔒 跳过') for res in valid_results):
+        logger.info("所有站点今日均已签到或由其他运行处理，无需发送通知。")
+        return None
 
     content_lines = []
     text = (
@@ -487,36 +1806,494 @@ def format_and_send_notification(results):
             f"{res['site']}:\t\t{res['status']}\n"
             f"📢{res['message']}"
         )
+        if res.get('attempts'):
+            line += (
+                f"\n⏱️ 尝试 {res['attempts']} 次，网络耗时 "
+                f"{res['network_time']:.1f}s，重试等待 {res['wait_time']:.1f}s"
+            )
         content_lines.append(line)
 
-    plain_text_content = "\n".join(content_lines)
+    return "\n".join(content_lines)
+
+
+def format_and_send_notification(results):
+    """
+    格式化签到结果并发送通知
+    :param results: 签到结果列表
+    """
+    plain_text_content = format_report(results)
+    if plain_text_content is None:
+        return
 
     logger.info("准备发送汇总通知...")
-    send("【PT多站签到报告】", plain_text_content)
-    logger.info("汇总通知已发送。")
+    send(NOTIFY_TITLE, plain_text_content)
+    logger.info("汇总通知已提交，在后台发送。")
 
 
-def main():
-    logger.info("===== 开始执行PT站签到任务 =====")
-    init_db()
-    cookie_manager, sites_to_checkin = load_configuration()
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 运行指标
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+# 通知中的状态对应的指标结果分类 (未发起请求的站点)
+STATUS_OUTCOMES = {
+    '✅ 成功': 'success',
+    '🍪 Cookie失效': 'cookie_invalid',
+    '❌ 失败': 'failed',
+    '🟢 跳过': 'already_signed',
+    '🔒 跳过': 'claimed_elsewhere',
+    '🟡 跳过': 'no_cookie',
+    '⛔ 熔断': 'circuit_open',
+}
+PHASES = ('dns', 'connect', 'ttfb', 'total')
+
+
+class MetricsRecorder:
+    """
+    记录每个站点每次签到尝试的网络指标，
+    运行结束时写出 Prometheus textfile collector 文件和 JSON Lines 文件。
+    """
+
+    def __init__(self, textfile: str | None = None, jsonl: str | None = None):
+        self.textfile = textfile
+        self.jsonl = jsonl
+        self.started_at = time.time()
+        self.attempts: list[dict] = []
+
+    @classmethod
+    def from_options(cls, options: dict):
+        """根据 options.metrics 创建，未配置任何输出文件时返回 None"""
+        config = options.get('metrics') or {}
+        textfile = config.get('textfile') or os.getenv("PT_METRICS_TEXTFILE")
+        jsonl = config.get('jsonl') or os.getenv("PT_METRICS_JSONL")
+        if not (textfile or jsonl):
+            return None
+        return cls(textfile, jsonl)
+
+    def record_attempt(self, site_name: str, attempt: int, result: dict):
+        """记录一次尝试，result 为 sign_in 返回的结果字典"""
+        stats = result.get('stats') or {}
+        record = {
+            'type': 'attempt',
+            'time': round(time.time(), 3),
+            'site': site_name,
+            'attempt': attempt,
+            'retries': attempt - 1,
+            'outcome': result.get('outcome'),
+            'http_status': stats.get('http_status'),
+            'bytes': result.get('bytes_read', 0),
+            # 没有 connect 说明复用了已有连接
+            'reused_connection': 'connect' not in stats,
+        }
+        for phase in PHASES:
+            if phase in stats:
+                record[phase] = round(stats[phase], 6)
+        self.attempts.append(record)
+
+    def _last_attempts(self) -> dict:
+        return {record['site']: record for record in self.attempts}
+
+    def _site_records(self, results) -> list[dict]:
+        last_attempts = self._last_attempts()
+        records = []
+        for result in results:
+            if result is None:
+                continue
+            last = last_attempts.get(result['site'], {})
+            attempts = result.get('attempts', 0)
+            records.append({
+                'type': 'site',
+                'time': round(time.time(), 3),
+                'site': result['site'],
+                'outcome': STATUS_OUTCOMES.get(result['status'], 'unknown'),
+                'last_attempt_outcome': last.get('outcome'),
+                'attempts': attempts,
+                'retries': max(0, attempts - 1),
+                'http_status': last.get('http_status'),
+                'network_time': round(result.get('network_time', 0.0), 6),
+                'wait_time': round(result.get('wait_time', 0.0), 6),
+                'bytes': result.get('bytes_read', 0),
+            })
+        return records
+
+    def write(self, results):
+        """写出本次运行的指标，results 为最终的签到结果列表"""
+        sites = self._site_records(results or [])
+        try:
+            if self.jsonl:
+                self._write_jsonl(sites)
+            if self.textfile:
+                self._write_textfile(sites)
+        except OSError as e:
+            logger.warning(f"⚠️ 写入运行指标失败: {e}")
+
+    def _write_jsonl(self, sites: list[dict]):
+        run = round(self.started_at, 3)
+        with open(self.jsonl, 'a', encoding='utf-8') as f:
+            for record in self.attempts + sites:
+                f.write(json.dumps({'run': run, **record}, ensure_ascii=False))
+                f.write("\n")
+        logger.info(f"📈 已追加 {len(self.attempts) + len(sites)} 条指标到 {self.jsonl}")
+
+    @staticmethod
+    def _labels(**labels) -> str:
+        if not labels:
+            return ""
+        escaped = (
+            f'{key}="' + str(value).replace('\\', '\\\\')
+            .replace('"', '\\"').replace('\n', '\\n') + '"'
+            for key, value in labels.items()
+        )
+        return "{" + ",".join(escaped) + "}"
+
+    def _write_textfile(self, sites: list[dict]):
+        last_attempts = self._last_attempts()
+        metrics = {}
+
+        def add(name, kind, help_text, labels, value):
+            if value is None:
+                return
+            metric = metrics.setdefault(name, (kind, help_text, []))
+            metric[2].append(f"{name}{self._labels(**labels)} {value}")
+
+        for site in sites:
+            name = site['site']
+            last = last_attempts.get(name)
+            if last is not None:
+                for phase in PHASES:
+                    add('ptsite_last_attempt_seconds', 'gauge',
+                        "Latency of the last attempt by phase (ttfb and total "
+                        "include connection setup).",
+                        {'site': name, 'phase': phase}, last.get(phase))
+            add('ptsite_network_seconds', 'gauge',
+                "Network time summed over all attempts.",
+                {'site': name}, site['network_time'])
+            add('ptsite_retry_wait_seconds', 'gauge',
+                "Time spent waiting between retries.",
+                {'site': name}, site['wait_time'])
+            add('ptsite_response_bytes', 'gauge',
+                "Decoded response bytes read over all attempts.",
+                {'site': name}, site['bytes'])
+            add('ptsite_attempts', 'gauge', "Attempts made in the last run.",
+                {'site': name}, site['attempts'])
+            add('ptsite_retries', 'gauge', "Retries made in the last run.",
+                {'site': name}, site['retries'])
+            add('ptsite_http_status', 'gauge',
+                "HTTP status of the last attempt.",
+                {'site': name}, site['http_status'])
+            add('ptsite_outcome', 'gauge',
+                "Outcome of the last run, one series per site set to 1.",
+                {'site': name, 'outcome': site['outcome']}, 1)
+
+        add('ptsite_run_timestamp_seconds', 'gauge',
+            "Unix time the last run started.", {}, round(self.started_at, 3))
+        add('ptsite_run_duration_seconds', 'gauge',
+            "Wall time of the last run.", {},
+            round(time.time() - self.started_at, 6))
+
+        lines = []
+        for name, (kind, help_text, samples) in metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+
+        # textfile collector 可能随时读取，先写临时文件再替换
+        tmp_file = f"{self.textfile}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, self.textfile)
+        logger.info(f"📈 已写入 Prometheus 指标文件 {self.textfile}")
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 并发签到引擎
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_PER_HOST_CONCURRENCY = 1
+DEFAULT_CIRCUIT_THRESHOLD = 3
+DEFAULT_CIRCUIT_COOLDOWN = 12 * 3600
+
+
+class CheckinJob:
+    """
+    一个待执行的签到任务
+    :param site: SiteDefinition 站点定义
+    :param cookie: 使用的 Cookie
+    :param from_cookie_cloud: Cookie 是否取自 CookieCloud
+    :param probe: 是否为熔断冷却后的探测，探测只尝试一次、不重试
+    :param account: 账号名称，站点只配置了一个账号时为 None
+    """
+
+    def __init__(self, site, cookie: str, from_cookie_cloud: bool = False,
+                 probe: bool = False, account: str | None = None):
+        self.site = site
+        self.cookie = cookie
+        self.from_cookie_cloud = from_cookie_cloud
+        self.probe = probe
+        self.account = account
+
+    @property
+    def key(self) -> str:
+        """签到状态、熔断和历史记录使用的键"""
+        return account_key(self.site.name, self.account)
+
+
+def account_key(site_name: str, account: str | None) -> str:
+    """站点和账号组合成的键，单账号时即为站点名称，与旧的签到记录兼容"""
+    return f"{site_name}@{account}" if account else site_name
+
+
+class CheckinEngine:
+    """
+    基于 asyncio 的并发签到引擎。
+    所有站点同时调度，受全局并发上限和单主机并发上限约束；
+    阻塞的网络请求放到线程池中执行，不会拖慢其他站点。
+    失败的尝试按 RetryPolicy 退避后重新排队，等待期间不占用并发名额。
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 per_host_concurrency: int = DEFAULT_PER_HOST_CONCURRENCY,
+                 retry_policy: RetryPolicy | None = None,
+                 http2: bool = False, stream: bool = True,
+                 state: StateStore | None = None,
+                 circuit_threshold: int = DEFAULT_CIRCUIT_THRESHOLD,
+                 metrics: MetricsRecorder | None = None,
+                 preflight: bool = False, pool: SessionPool | None = None):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.per_host_concurrency = max(1, int(per_host_concurrency))
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.http2 = http2
+        self.stream = stream
+        self.state = state
+        self.circuit_threshold = max(1, int(circuit_threshold))
+        self.metrics = metrics
+        self.preflight = preflight
+        # 外部传入的连接池 (如 ck_all 的共享池)，由调用方负责关闭
+        self.shared_pool = pool
+        self.pool: SessionPool | None = None
+        self._global_semaphore: asyncio.Semaphore | None = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    @classmethod
+    def from_options(cls, options: dict, state: StateStore | None = None,
+                     metrics: MetricsRecorder | None = None,
+                     pool: SessionPool | None = None):
+        return cls(
+            state=state,
+            metrics=metrics,
+            pool=pool,
+            max_concurrency=options.get(
+                'max_concurrency', DEFAULT_MAX_CONCURRENCY),
+            per_host_concurrency=options.get(
+                'per_host_concurrency', DEFAULT_PER_HOST_CONCURRENCY),
+            retry_policy=RetryPolicy.from_config(options.get('retry')),
+            http2=bool(options.get('http2', False)),
+            stream=bool(options.get('stream', True)),
+            circuit_threshold=(options.get('circuit_breaker') or {}).get(
+                'threshold', DEFAULT_CIRCUIT_THRESHOLD),
+            preflight=bool(options.get('preflight', False)),
+        )
+
+    def _host_semaphore(self, host: str) -> asyncio.Semaphore:
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_concurrency)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    async def _attempt(self, job: CheckinJob, attempt):
+        # 同一主机的所有账号共用主机并发名额和连接池
+        async with self._host_semaphore(job.site.host):
+            async with self._global_semaphore:
+                return await asyncio.to_thread(
+                    sign_in, job.site, job.cookie, attempt, self.pool,
+                    self.stream, job.key
+                )
+
+    async def _preflight(self, job: CheckinJob, config: dict) -> str:
+        async with self._host_semaphore(job.site.host):
+            async with self._global_semaphore:
+                return await asyncio.to_thread(
+                    preflight, job.site, job.cookie, config, self.pool, job.key
+                )
+
+    async def _run_job(self, job: CheckinJob):
+        site = job.site
+        site_name = job.key
+        config = site.preflight_config(self.preflight)
+        if config is not None and await self._preflight(job, config) == "bad":
+            msg = "Cookie 预检未通过，已失效或过期，跳过签到。"
+            logger.error(f"❌ [{site_name}] {msg}")
+            if self.state is not None:
+                self.state.record_cookie(site_name, job.cookie, False)
+            return {
+                'site': site_name,
+                'status': '🍪 Cookie失效',
+                'message': msg,
+                'attempts': 0,
+                'network_time': 0.0,
+                'wait_time': 0.0,
+                'bytes_read': 0,
+            }
+
+        policy = RetryPolicy.from_config(site.retry, self.retry_policy)
+        if job.probe:
+            policy.max_attempts = 1
+            logger.info(f"🔌 [{site_name}] 熔断冷却结束，进行一次探测...")
+        else:
+            logger.info(f"开始为站点 [{site_name}] 执行签到...")
+
+        network_time = 0.0
+        wait_time = 0.0
+        bytes_read = 0
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.state is not None:
+                self.state.renew_lease()
+            started = time.monotonic()
+            result, retryable = await self._attempt(job, attempt)
+            network_time += time.monotonic() - started
+            if self.metrics is not None:
+                self.metrics.record_attempt(site_name, attempt, result)
+            result.pop('stats', None)
+            result.pop('outcome', None)
+            values = result.pop('values', None)
+            bytes_read += result.pop('bytes_read', 0)
+            if not retryable or attempt >= policy.max_attempts:
+                break
+
+            # 退避期间只挂起本站点的协程，其他站点继续执行
+            delay = policy.delay(attempt)
+            logger.info(f"[{site_name}] 等待{delay:.1f}秒后进行重试...")
+            started = time.monotonic()
+            await asyncio.sleep(delay)
+            wait_time += time.monotonic() - started
+
+        if retryable:
+            final_msg = f"达到最大重试次数({policy.max_attempts}次)，签到失败。"
+            logger.error(f"❌ [{site_name}] {final_msg}")
+            result = {
+                'site': site_name,
+                'status': '❌ 失败',
+                'message': f"{final_msg}最后一次: {result['message']}"
+            }
+
+        if self.state is not None:
+            if result['status'] == '✅ 成功':
+                self.state.mark_signed(site_name)
+                if values:
+                    self.state.record_values(site_name, values)
+                self.state.record_health(site_name, True, self.circuit_threshold)
+                self.state.record_cookie(site_name, job.cookie, True)
+            elif result['status'] == '❌ 失败':
+                self.state.record_health(site_name, False, self.circuit_threshold)
+            elif result['status'] == '🍪 Cookie失效':
+                self.state.record_cookie(site_name, job.cookie, False)
+
+        result['attempts'] = attempt
+        result['network_time'] = network_time
+        result['wait_time'] = wait_time
+        result['bytes_read'] = bytes_read
+        return result
+
+    async def _run_all(self, jobs):
+        loop = asyncio.get_running_loop()
+        executor_cls = lazy_import('concurrent.futures').ThreadPoolExecutor
+        loop.set_default_executor(executor_cls(
+            max_workers=self.max_concurrency, thread_name_prefix='ptsite'
+        ))
+        self._global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._host_semaphores = {}
+        return await asyncio.gather(
+            *(self._run_job(job) for job in jobs)
+        )
+
+    def run(self, jobs):
+        """
+        并发执行所有签到任务
+        :param jobs: CheckinJob 列表
+        :return: 与 jobs 顺序一致的签到结果列表
+        """
+        if not jobs:
+            return []
+        logger.info(
+            f"🚀 并发签到 {len(jobs)} 个站点 (全局上限 {self.max_concurrency}，"
+            f"单主机上限 {self.per_host_concurrency})"
+        )
+        if self.shared_pool is not None:
+            if self.http2 and self.shared_pool.httpx is None:
+                logger.warning("⚠️ 使用 ck_all.py 的共用连接池，options.http2 不生效。")
+            self.pool = self.shared_pool
+        else:
+            self.pool = SessionPool(
+                pool_size=self.per_host_concurrency, http2=self.http2,
+                verify=False
+            )
+        try:
+            return asyncio.run(self._run_all(jobs))
+        finally:
+            if self.pool is not self.shared_pool:
+                self.pool.close()
+            self.pool = None
+
+
+def _exit_on_sigterm(signum, frame):
+    # 转换为 SystemExit，使 finally 中的状态刷新得以执行
+    raise SystemExit(128 + signum)
+
+
+def run_checkin(state: StateStore, pool: SessionPool | None = None):
+    """
+    加载配置并执行所有站点的签到
+    :param state: 本次运行共用的 StateStore
+    :param pool: 共用的 SessionPool，None 时由签到引擎自行创建
+    :return: 签到结果列表，配置无效时返回 None
+    """
+    cookie_manager, sites_to_checkin, options = load_configuration()
 
     if not sites_to_checkin:
         logger.error("❌ 任务终止，无法获取任何有效的站点配置。")
-        return
+        return None
 
-    # 将SITES_CONFIG转换为字典以便快速查找
-    site_config_map = {s['name']: s for s in SITES_CONFIG}
+    registry = SiteRegistry(
+        SITES_CONFIG,
+        options.get('sites_file') or os.getenv("PT_SITES_FILE")
+    )
+    breaker = options.get('circuit_breaker') or {}
+    threshold = max(1, int(breaker.get('threshold', DEFAULT_CIRCUIT_THRESHOLD)))
+    cooldown = float(breaker.get('cooldown', DEFAULT_CIRCUIT_COOLDOWN))
+    state.start_lease(options.get('lease_timeout', DEFAULT_LEASE_TIMEOUT))
     results = []
-
-    for site_name, cookie_value in sites_to_checkin.items():
-        if site_name not in site_config_map:
-            logger.warning(f"⚠️ 发现未知站点配置 '{site_name}'，已跳过。")
+    # 待签到任务: (结果列表中的位置, CheckinJob)
+    pending = []
+
+    # 展开为 (站点定义, 账号, Cookie配置)，同一站点的同一账号只签到一次
+    entries = []
+    seen = set()
+    for site_key, accounts in sites_to_checkin.items():
+        site = registry.resolve(site_key)
+        if site is None:
+            logger.warning(f"⚠️ 发现未知站点配置 '{site_key}'，已跳过。")
             continue
+        for account, cookie_value in accounts:
+            key = account_key(site.name, account)
+            if key in seen:
+                logger.warning(f"⚠️ [{key}] 账号重复配置，已跳过。")
+                continue
+            seen.add(key)
+            entries.append((site, account, cookie_value))
+
+    if cookie_manager is not None:
+        # 只处理需要从 CookieCloud 取 Cookie 的主机，忽略 Cookie 库中的其他域名
+        cookie_manager.domains = {
+            site.host for site, _, cookie_value in entries if not cookie_value
+        }
 
-        site_config = site_config_map[site_name]
+    for site, account, cookie_value in entries:
+        site_name = account_key(site.name, account)
 
-        if check_if_signed_today(site_name):
+        if state.signed_today(site_name):
             msg = "今日已成功签到，跳过。"
             logger.info(f"🟢 [{site_name}] {msg}")
             results.append({
@@ -526,13 +2303,48 @@ def main():
             })
             continue
 
+        circuit, failures, retry_at = state.circuit(
+            site_name, threshold, cooldown
+        )
+        if circuit == "open":
+            retry_time = datetime.fromtimestamp(retry_at).strftime('%m-%d %H:%M')
+            msg = f"连续失败 {failures} 次，熔断中，{retry_time} 后再探测。"
+            logger.warning(f"⛔ [{site_name}] {msg}")
+            results.append({
+                'site': site_name,
+                'status': '⛔ 熔断',
+                'message': msg
+            })
+            continue
+
+        # 与同时运行的其他任务协调，避免重复签到
+        claim = state.claim(site_name)
+        if claim == "signed":
+            msg = "其他运行已完成今日签到，跳过。"
+            logger.info(f"🟢 [{site_name}] {msg}")
+            results.append({
+                'site': site_name,
+                'status': '🟢 跳过',
+                'message': msg
+            })
+            continue
+        if claim == "busy":
+            msg = "另一个运行中的任务正在签到该站点，跳过。"
+            logger.info(f"🔒 [{site_name}] {msg}")
+            results.append({
+                'site': site_name,
+                'status': '🔒 跳过',
+                'message': msg
+            })
+            continue
+
         cookie = None
         # 如果cookie_value是真值(非空字符串)，则直接使用
         if cookie_value:
             cookie = cookie_value
         # 否则，尝试从CookieCloud获取
         elif cookie_manager:
-            domain = urlparse(site_config['sign_in_url']).netloc
+            domain = site.host
             cookie = cookie_manager.get_cookies(domain)
             if not cookie:
                 msg = f"未能从CookieCloud获取到 {domain} 的Cookie，跳过该站点。"
@@ -554,15 +2366,210 @@ def main():
             })
             continue
 
+        # 已判定失效的 Cookie 在更新之前不再请求站点
+        if cookie and state.cookie_known_bad(site_name, cookie):
+            if not cookie_value and cookie_manager.from_cache:
+                logger.info("☁️ 缓存中的 Cookie 已知失效，刷新 CookieCloud。")
+                cookie_manager.refresh()
+                cookie = cookie_manager.get_cookies(site.host)
+            if not cookie or state.cookie_known_bad(site_name, cookie):
+                msg = "Cookie 自上次失效后未更新，跳过请求。"
+                logger.warning(f"🍪 [{site_name}] {msg}")
+                results.append({
+                    'site': site_name,
+                    'status': '🍪 Cookie失效',
+                    'message': msg
+                })
+                continue
+
         if cookie:
-            result = sign_in(site_config, cookie)
-            results.append(result)
+            job = CheckinJob(
+                site, cookie, from_cookie_cloud=not cookie_value,
+                probe=circuit == "half_open", account=account
+            )
+            pending.append((len(results), job))
+            results.append(None)
+
+    metrics = MetricsRecorder.from_options(options)
+    engine = CheckinEngine.from_options(
+        options, state=state, metrics=metrics, pool=pool
+    )
+    outcomes = engine.run([job for _, job in pending])
+    for (index, _), outcome in zip(pending, outcomes):
+        results[index] = outcome
+
+    # 来自本地缓存的 Cookie 失效时，刷新 CookieCloud 后重试 Cookie 有变化的站点
+    stale = [
+        (index, job) for (index, job), outcome in zip(pending, outcomes)
+        if job.from_cookie_cloud and outcome['status'] == '🍪 Cookie失效'
+    ]
+    if stale and cookie_manager.from_cache:
+        logger.info("☁️ 缓存的 Cookie 已失效，刷新 CookieCloud 后重试。")
+        cookie_manager.refresh()
+        retry_jobs = []
+        for index, job in stale:
+            cookie = cookie_manager.get_cookies(job.site.host)
+            if cookie and cookie != job.cookie:
+                retry_jobs.append((index, CheckinJob(
+                    job.site, cookie, from_cookie_cloud=True, probe=job.probe,
+                    account=job.account
+                )))
+        outcomes = engine.run([job for _, job in retry_jobs])
+        for (index, _), outcome in zip(retry_jobs, outcomes):
+            results[index] = outcome
+
+    if metrics is not None:
+        metrics.write(results)
+    return results
+
+
+# 签到状态按站点记录在 StateStore 中，ck_all.py 每次都运行本脚本
+TASK_ONCE_PER_DAY = False
+
+
+def task(pool: SessionPool | None = None, state: StateStore | None = None):
+    """
+    供 ck_all.py 调用的签到任务，不单独发送通知
+    :param pool: 共用的 SessionPool
+    :param state: 共用的 StateStore，None 时打开并在结束后关闭 DB_FILE
+    :return: (通知标题, 内容, 是否成功)，无需通知时返回 None
+    """
+    owns_state = state is None
+    if owns_state:
+        state = StateStore(DB_FILE)
+    try:
+        results = run_checkin(state, pool)
+    finally:
+        if owns_state:
+            state.close()
+    if results is None:
+        return None
+    content = format_report(results)
+    if content is None:
+        return None
+    return NOTIFY_TITLE, content, all(res['status'] != '❌ 失败' for res in results)
+
+
+def nothing_to_do(state: StateStore) -> bool:
+    """
+    不加载 loguru 和站点定义，判断配置中的所有账号今天是否都已签到。
+    只按配置中的站点键匹配签到记录；配置有误、站点键不是站点名称等
+    无法确定的情况返回 False，交给完整的签到流程处理 (并输出日志)
+    """
+    try:
+        sites = json.loads(os.getenv("PT_CHECKIN_CONFIG") or "")['sites']
+        keys = []
+        for site_key, value in sites.items():
+            if isinstance(value, list) and not all(
+                    item is None or isinstance(item, (str, dict))
+                    for item in value):
+                return False
+            keys.extend(
+                account_key(site_key, account)
+                for account, _ in parse_accounts(site_key, value)
+            )
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return bool(keys) and all(state.signed_today(key) for key in keys)
+
+
+def main():
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    state = StateStore(DB_FILE)
+    try:
+        # 所有账号今日都已签到时只输出一行，不导入 loguru 和网络相关的模块
+        if nothing_to_do(state):
+            print("🟢 所有站点今日均已签到，无需运行。")
+            replay_notifications()
+            report_import_times()
+            return
+        setup_logging()
+        logger.info("===== 开始执行PT站签到任务 =====")
+        results = run_checkin(state)
+    finally:
+        state.close()
+
+    if results is not None:
+        format_and_send_notification(results)
+        logger.info("===== 所有站点签到任务执行完毕 =====")
+    replay_notifications()
+    report_import_times()
+
+
+# history/daily/summary 命令输出的列: (键, 表头)
+HISTORY_COLUMNS = {
+    'history': (('site_name', '站点'), ('ts', '时间'), ('magic', '魔力值'),
+                ('streak', '连续天数'), ('rank', '排名')),
+    'daily': (('site_name', '站点'), ('day', '日期'), ('magic', '魔力值'),
+              ('delta', '变化'), ('streak', '连续天数'), ('rank', '排名')),
+    'summary': (('site_name', '站点'), ('records', '记录数'),
+                ('first_ts', '最早'), ('last_ts', '最近'),
+                ('last_magic', '魔力值'), ('magic_change', '变化'),
+                ('best_rank', '最好排名'), ('avg_rank', '平均排名'),
+                ('max_streak', '最长连续天数')),
+}
 
-        time.sleep(2)
 
-    format_and_send_notification(results)
-    logger.info("===== 所有站点签到任务执行完毕 =====")
+def _format_cell(key: str, value) -> str:
+    if value is None:
+        return "-"
+    if key.endswith('ts'):
+        return datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, float):
+        sign = "+" if key in ('delta', 'magic_change') else ""
+        return f"{value:{sign},.1f}"
+    return str(value)
+
+
+def history_cli(argv) -> int:
+    """
+    查询签到记录中的魔力值和排名:
+    ck_ptsite.py history|daily|summary [--site 站点] [--days 天数] [--json]
+    """
+    argparse = lazy_import('argparse')
+    parser = argparse.ArgumentParser(
+        prog='ck_ptsite.py', description="查询签到记录中的魔力值和排名历史"
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('history', "逐条记录"),
+                            ('daily', "每个站点每天的魔力值及变化"),
+                            ('summary', "各站点汇总")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--site', action='append',
+                             help="站点名称，可重复指定 (默认全部站点)")
+        command.add_argument('--days', type=float, default=30,
+                             help="查询最近多少天 (默认 30，0 表示全部)")
+        command.add_argument('--db', default=DB_FILE, help="状态数据库文件")
+        command.add_argument('--json', action='store_true', help="输出 JSON")
+    args = parser.parse_args(argv)
+
+    since = time.time() - args.days * 86400 if args.days > 0 else None
+    state = StateStore(args.db)
+    try:
+        rows = getattr(state, args.command)(args.site, since)
+    finally:
+        state.close()
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
+    if not rows:
+        print("没有记录。")
+        return 0
+
+    columns = HISTORY_COLUMNS[args.command]
+    table = [[title for _, title in columns]]
+    table += [[_format_cell(key, row.get(key)) for key, _ in columns]
+              for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for line in table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+    return 0
 
 
 if __name__ == "__main__":
+    # 青龙定时任务不带参数运行签到；带参数时为历史查询命令
+    if len(sys.argv) > 1:
+        setup_logging()
+        sys.exit(history_cli(sys.argv[1:]))
     main()
\ No newline at end of file
@@ -4,16 +4,12 @@ cron: 0 10 0 * * *
 new Env('思源笔记签到');
 """
 
-import requests
 import re
 import hashlib
 import os
 from loguru import logger
-import urllib3
-from notify import send  # 导入青龙后自动有这个文件
-
-# 禁用 InsecureRequestWarning 警告
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from ql_notify import replay, send  # 后台限时发送，内部使用青龙的 notify.py
+from ql_transport import SessionPool, header_profile
 
 
 paras = {
@@ -23,80 +19,27 @@ paras = {
 
 
 # https://ld246.com/login?goto=https://ld246.com/settings/point
-headers = {
-    "authority": "ld246.com",
-    "accept": "*/*",
-    "accept-language": "zh-CN,zh;q=0.9",
+headers = header_profile('xhr', {
     "cache-control": "no-cache",
+    "pragma": "no-cache",
     "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
     "origin": "https://ld246.com",
-    "pragma": "no-cache",
     "referer": "https://ld246.com/login?goto=https://ld246.com/settings/point",
-    "sec-ch-ua": "^\\^Not_A",
-    "sec-ch-ua-mobile": "?0",
-    "sec-ch-ua-platform": "^\\^Windows^\\^",
-    "sec-fetch-dest": "empty",
-    "sec-fetch-mode": "cors",
-    "sec-fetch-site": "same-origin",
-    "user-agent": (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-        "(KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36 "
-        "Edg/109.0.1518.70"
-    ),
-    "x-requested-with": "XMLHttpRequest",
-}
+})
 
 
-headersCheckIn = {
-    "Accept": (
-        "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,"
-        "image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9"
-    ),
-    "Accept-Language": "zh-CN,zh;q=0.9",
-    "Cache-Control": "no-cache",
-    "Connection": "keep-alive",
-    "Pragma": "no-cache",
-    "Referer": "https://ld246.com/settings/point",
-    "Sec-Fetch-Dest": "document",
-    "Sec-Fetch-Mode": "navigate",
-    "Sec-Fetch-Site": "same-origin",
-    "Sec-Fetch-User": "?1",
-    "Upgrade-Insecure-Requests": "1",
-    "User-Agent": (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-        "(KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36 "
-        "Edg/109.0.1518.70"
-    ),
-    "sec-ch-ua": "^\\^Not_A",
-    "sec-ch-ua-mobile": "?0",
-    "sec-ch-ua-platform": "^\\^Windows^\\^",
-}
+headersCheckIn = header_profile('navigate', {
+    "cache-control": "no-cache",
+    "pragma": "no-cache",
+    "referer": "https://ld246.com/settings/point",
+})
 
 
-headersDayliCheck = {
-    "Accept": (
-        "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,"
-        "image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9"
-    ),
-    "Accept-Language": "zh-CN,zh;q=0.9",
-    "Cache-Control": "no-cache",
-    "Connection": "keep-alive",
-    "Pragma": "no-cache",
-    "Referer": "https://ld246.com/activity/checkin",
-    "Sec-Fetch-Dest": "document",
-    "Sec-Fetch-Mode": "navigate",
-    "Sec-Fetch-Site": "same-origin",
-    "Sec-Fetch-User": "?1",
-    "Upgrade-Insecure-Requests": "1",
-    "User-Agent": (
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-        "(KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36 "
-        "Edg/109.0.1518.70"
-    ),
-    "sec-ch-ua": "^\\^Not_A",
-    "sec-ch-ua-mobile": "?0",
-    "sec-ch-ua-platform": "^\\^Windows^\\^",
-}
+headersDayliCheck = header_profile('navigate', {
+    "cache-control": "no-cache",
+    "pragma": "no-cache",
+    "referer": "https://ld246.com/activity/checkin",
+})
 
 
 def getPara(name):
@@ -109,93 +52,122 @@ def setPara(name, value):
     return value
 
 
-log_messages = []
-
-
-def appendLog(tempLog):
-    log_messages.append(tempLog)
-    logger.info(tempLog)
-
-
-def printLog():
-    final_log = "\n".join(log_messages)
-    logger.info(final_log)
-    send("思源笔记签到", final_log)
-
-
-def getMsg(htmltext):
-    try:
-        scoreGet = re.search("(今日签到获得.*积分)", htmltext).group(1)
-        scoreGet = re.sub("<[^<]*>", "", scoreGet)
-
-        scoreTotal = re.search(r"(积分余额[\s0-9]*)", htmltext).group(1)
-        appendLog(scoreGet + "\n" + scoreTotal)
-        getTopic()
-    except Exception as e:
-        logger.error(f"获取排行信息失败: {str(e)}")
-
-
-def getTopic():
-    resp = session.get(
-        "https://ld246.com/top/checkin/today",
-        data=data,
-        headers=headersDayliCheck,
-        verify=False,
-    )
-    pattern = r"([0-9]+)\.\s+<a[^<]+aria-name=\""
-    username_pattern = pattern + getPara("username")
-    index = re.search(username_pattern, resp.text, re.S).group(1)
-    count = len(re.findall(pattern, resp.text, re.S))
-    percentage = str((1 - int(index) / count) * 100)
-    appendLog(f"今日奖励排行第{index},超过了{percentage}%的人")
-
-
-md5 = hashlib.md5(getPara("password").encode(encoding="utf-8")).hexdigest()
-data = f'{{"nameOrEmail":{getPara("username")},"userPassword":{md5},' '"captcha":""}}'
-session = requests.session()
-response = session.post(
-    "https://ld246.com/login?goto=https://ld246.com/settings/point",
-    data=data,
-    headers=headers,
-    verify=False,
-)
-
-# 登录成功或失败
-try:
-    tokenName = response.json()["tokenName"]
-    token = response.json()["token"]
-    logger.info("登录成功")
-except KeyError:
-    logger.error("登录失败，未能获取 tokenName 或 token")
-    exit(1)
-
-cookie = {tokenName: token}
-
-response = session.get(
-    "https://ld246.com/activity/checkin",
-    cookies=cookie,
-    headers=headersCheckIn,
-    verify=False,
-)
-
-if response.text.find("领取今日签到奖励") >= 0:
-    res = re.findall(
-        r"<a href=\"([^>^\"]*)\"[^>]*>领取今日签到奖励</a>", response.text, re.S
-    )
-    if len(res) > 0:
-        logger.info(res[0])
-        appendLog("开始签到")
-
-        response = session.get(res[0], headers=headersDayliCheck, verify=False)
-        if response.text.find("今日签到获得") >= 0:
-            appendLog("签到成功")
-            getMsg(response.text)
-    else:
-        appendLog("未找到签到链接")
-elif response.text.find("今日签到获得") >= 0:
-    appendLog("已经签到过了")
-    getMsg(response.text)
-else:
-    logger.error(response.text)
-    appendLog("签到异常")
-printLog()
\ No newline at end of file
+class SiYuan:
+    """一次签到，日志收集在 log_messages 中作为通知内容"""
+
+    def __init__(self, username, password):
+        self.username = username
+        md5 = hashlib.md5(password.encode(encoding="utf-8")).hexdigest()
+        self.data = f'{{"nameOrEmail":{username},"userPassword":{md5},' '"captcha":""}}'
+        # 登录态保存在会话的 Cookie 中，因此不使用 ck_all 的共享池；
+        # 不校验证书 (同时关闭 InsecureRequestWarning)
+        self.session = SessionPool(verify=False, keep_cookies=True)
+        self.log_messages = []
+        # 签到成功或今日已签到
+        self.signed = False
+
+    def appendLog(self, tempLog):
+        self.log_messages.append(tempLog)
+        logger.info(tempLog)
+
+    def getMsg(self, htmltext):
+        try:
+            scoreGet = re.search("(今日签到获得.*积分)", htmltext).group(1)
+            scoreGet = re.sub("<[^<]*>", "", scoreGet)
+
+            scoreTotal = re.search(r"(积分余额[\s0-9]*)", htmltext).group(1)
+            self.appendLog(scoreGet + "\n" + scoreTotal)
+            self.getTopic()
+        except Exception as e:
+            logger.error(f"获取排行信息失败: {str(e)}")
+
+    def getTopic(self):
+        resp = self.session.get(
+            "https://ld246.com/top/checkin/today",
+            data=self.data,
+            headers=headersDayliCheck,
+        )
+        pattern = r"([0-9]+)\.\s+<a[^<]+aria-name=\""
+        username_pattern = pattern + self.username
+        index = re.search(username_pattern, resp.text, re.S).group(1)
+        count = len(re.findall(pattern, resp.text, re.S))
+        percentage = str((1 - int(index) / count) * 100)
+        self.appendLog(f"今日奖励排行第{index},超过了{percentage}%的人")
+
+    def checkin(self):
+        """
+        登录并签到
+        :return: 通知内容，登录失败时返回 None
+        """
+        try:
+            response = self.session.post(
+                "https://ld246.com/login?goto=https://ld246.com/settings/point",
+                data=self.data,
+                headers=headers,
+            )
+
+            # 登录成功或失败
+            try:
+                tokenName = response.json()["tokenName"]
+                token = response.json()["token"]
+                logger.info("登录成功")
+            except KeyError:
+                logger.error("登录失败，未能获取 tokenName 或 token")
+                return None
+
+            cookie = {tokenName: token}
+
+            response = self.session.get(
+                "https://ld246.com/activity/checkin",
+                cookies=cookie,
+                headers=headersCheckIn,
+            )
+
+            if response.text.find("领取今日签到奖励") >= 0:
+                res = re.findall(
+                    r"<a href=\"([^>^\"]*)\"[^>]*>领取今日签到奖励</a>", response.text, re.S
+                )
+                if len(res) > 0:
+                    logger.info(res[0])
+                    self.appendLog("开始签到")
+
+                    response = self.session.get(res[0], headers=headersDayliCheck)
+                    if response.text.find("今日签到获得") >= 0:
+                        self.signed = True
+                        self.appendLog("签到成功")
+                        self.getMsg(response.text)
+                else:
+                    self.appendLog("未找到签到链接")
+            elif response.text.find("今日签到获得") >= 0:
+                self.signed = True
+                self.appendLog("已经签到过了")
+                self.getMsg(response.text)
+            else:
+                logger.error(response.text)
+                self.appendLog("签到异常")
+        finally:
+            self.session.close()
+
+        final_log = "\n".join(self.log_messages)
+        logger.info(final_log)
+        return final_log
+
+
+def task(pool=None, state=None):
+    """供 ck_all.py 调用，未配置账号时跳过；返回 (通知标题, 内容, 是否成功)"""
+    if not (getPara("username") and getPara("password")):
+        logger.info("未添加SIYUAN_USERNAME/SIYUAN_PASSWORD变量，跳过思源笔记签到")
+        return None
+    siyuan = SiYuan(getPara("username"), getPara("password"))
+    final_log = siyuan.checkin()
+    return ("思源笔记签到", final_log or "登录失败，未能获取 tokenName 或 token",
+            siyuan.signed)
+
+
+if __name__ == "__main__":
+    final_log = SiYuan(getPara("username"), getPara("password")).checkin()
+    if final_log is not None:
+        send("思源笔记签到", final_log)
+    replay()
+    if final_log is None:
+        exit(1)
@@ -6,56 +6,52 @@ new Env('WPS签到');
 
 import json
 import random
-import sys
 import time
 import logging
-import requests
 import os
 
+from ql_transport import SessionPool, header_profile
+
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
 try:
-    from notify import send
+    from ql_notify import replay, send
 except:
     logger.info("无推送文件")
 
 
 class WPS:
-    def __init__(self, cookie):
+    def __init__(self, cookie, pool=None):
         self.cookie = cookie
         self.is_sign = False
+        self.valid = True
+        # 今日已签到或本次签到成功
+        self.signed = False
+        # 带默认超时的会话，所有请求复用同一个连接；可传入 ck_all 的共享池
+        self.pool = pool or SessionPool()
 
     # 判断 Cookie 是否失效 和 今日是否签到
     def check(self, cookie):
         url0 = "https://vip.wps.cn/sign/mobile/v3/get_data"
-        headers = {
-            "Cookie": cookie,
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/46.0.2486.0 Safari/537.36 Edge/13.10586",
-        }
-        response = requests.get(url0, headers=headers)
+        response = self.pool.get(url0, headers=header_profile('api', {"Cookie": cookie}))
         if "会员登录" in response.text:
             print("cookie 失效")
-            sys.exit()
+            self.valid = False
+            return
         is_sign = response.json().get("data", {}).get("is_sign")
         if is_sign:
             self.is_sign = True
 
     def sign(self, cookie):
-        headers = {
-            "Cookie": cookie,
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/46.0.2486.0 Safari/537.36 Edge/13.10586",
-        }
+        headers = header_profile('api', {"Cookie": cookie})
         if self.is_sign:
             msg = "今日已签到"
+            self.signed = True
         else:
             data0 = {"platform": "8"}  # 不带验证坐标的请求
             url = "https://vip.wps.cn/sign/v2"
-            response = requests.post(url, data0, headers=headers)
+            response = self.pool.post(url, data=data0, headers=headers)
             if "msg" not in response.text:
                 msg = "cookie 失效"
             else:
@@ -73,25 +69,41 @@ class WPS:
                         "img_height": "69.184",
                     }  # 带验证坐标的请求
                     for n in range(10):
-                        requests.get(yz_url, headers=headers)
-                        response = requests.post(url, data, headers=headers)
+                        self.pool.get(yz_url, headers=headers)
+                        response = self.pool.post(url, data=data, headers=headers)
                         sus = json.loads(response.text)["result"]
                         msg += f"{str(n + 1)} 尝试验证签到 --> {sus}\n"
                         time.sleep(random.randint(0, 5) / 10)
                         if sus == "ok":
                             break
                 msg += f"最终签到结果 --> {sus}\n"
+                self.signed = sus == "ok"
                 # {"result":"ok","data":{"exp":0,"wealth":0,"weath_double":0,"count":5,"double":0,"gift_type":"space_5","gift_id":133,"url":""},"msg":""}
         return msg
 
     def main(self):
         cookie = self.cookie
         self.check(cookie)
+        if not self.valid:
+            return None
         msg = self.sign(cookie)
         return msg
 
 
+def task(pool=None, state=None):
+    """供 ck_all.py 调用，未配置 WPS_COOKIE 时跳过；返回 (通知标题, 内容, 是否成功)"""
+    cookie = os.getenv("WPS_COOKIE")
+    if not cookie:
+        logger.info("未添加WPS_COOKIE变量，跳过WPS签到")
+        return None
+    wps = WPS(cookie=cookie, pool=pool)
+    result = wps.main()
+    return "WPS", result or "cookie 失效", wps.signed
+
+
 if __name__ == "__main__":
     cookie = os.getenv("WPS_COOKIE")
     result = WPS(cookie=cookie).main()
-    send("WPS", result)
+    if result is not None:
+        send("WPS", result)
+    replay()
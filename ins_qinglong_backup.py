@@ -4,20 +4,43 @@
 项目名称: qinglong_Backup
 Author: Ukenn2112
 功能：自动备份
+说明：QLBK_MODE=repo 的去重仓库依赖 fastcdc (pip install fastcdc) 按内容分块；
+     未安装时退回固定大小分块，速度不受影响，但文件中间改动后去重效果较差
 Date: 2022/02/03 上午12:00
 cron: 0 2 * * *
 new Env('青龙备份');
 '''
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import fnmatch
+import functools
+import io
+import json
 import logging
 import os
+import re
+import shutil
+import stat
+import struct
 import sys
 import tarfile
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import grp
+    import pwd
+except ImportError:  # Windows
+    grp = pwd = None
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 try:
-    from notify import send
+    from ql_notify import replay, send
 except:
     logger.info("无推送文件")
 
@@ -26,22 +49,92 @@ def env(key):
     return os.environ.get(key)
 
 
-QLBK_EXCLUDE_NAMES = ['log', '.git', '.github',
-                      'node_modules', 'backups', '.pnpm-store']  # 排除目录名
+# 排除规则，逗号或换行分隔，对任意深度的文件和目录生效:
+#   node_modules       不含 / 的通配符，匹配文件或目录名
+#   /log、scripts/*.js  含 / 的通配符，匹配相对于运行目录的路径 (开头的 / 表示运行目录)
+#   re:\.log$          正则表达式，在相对路径中搜索
+QLBK_EXCLUDE_NAMES = ['/log', '.git', '.github', 'node_modules',
+                      '/backups', '.pnpm-store', '__pycache__']
 if env("QLBK_EXCLUDE_NAMES"):
-    QLBK_EXCLUDE_NAMES = env("QLBK_EXCLUDE_NAMES")
+    QLBK_EXCLUDE_NAMES = [
+        name.strip() for name in env("QLBK_EXCLUDE_NAMES").replace('\n', ',').split(',')
+        if name.strip()
+    ]
     logger.info(f'检测到设置变量 {QLBK_EXCLUDE_NAMES}')
 
+QLBK_MAX_FILE_SIZE = 0  # 单个文件的大小上限 (MB)，超过的文件不备份，0 表示不限制
+if env("QLBK_MAX_FILE_SIZE"):
+    QLBK_MAX_FILE_SIZE = float(env("QLBK_MAX_FILE_SIZE"))
+    logger.info(f'检测到设置变量 {QLBK_MAX_FILE_SIZE}')
+
 QLBK_BACKUPS_PATH = 'backups'  # 备份目标目录
 if env("QLBK_BACKUPS_PATH"):
     QLBK_BACKUPS_PATH = str(env("QLBK_BACKUPS_PATH"))
     logger.info(f'检测到设置变量 {QLBK_BACKUPS_PATH}')
 
-QLBK_MAX_FLIES = 5  # 最大备份保留数量默认5个
+QLBK_MAX_FLIES = 5  # 最大备份保留数量默认5个 (始终保留最新的这些备份)
 if env("QLBK_MAX_FLIES"):
     QLBK_MAX_FLIES = int(env("QLBK_MAX_FLIES"))
     logger.info(f'检测到设置变量 {QLBK_MAX_FLIES}')
 
+# 祖父-父-子保留规则: 另外保留最近 N 天/周/月中每天/周/月最新的一个备份，0 表示不启用
+QLBK_KEEP_DAILY = 0
+if env("QLBK_KEEP_DAILY"):
+    QLBK_KEEP_DAILY = int(env("QLBK_KEEP_DAILY"))
+    logger.info(f'检测到设置变量 {QLBK_KEEP_DAILY}')
+
+QLBK_KEEP_WEEKLY = 0
+if env("QLBK_KEEP_WEEKLY"):
+    QLBK_KEEP_WEEKLY = int(env("QLBK_KEEP_WEEKLY"))
+    logger.info(f'检测到设置变量 {QLBK_KEEP_WEEKLY}')
+
+QLBK_KEEP_MONTHLY = 0
+if env("QLBK_KEEP_MONTHLY"):
+    QLBK_KEEP_MONTHLY = int(env("QLBK_KEEP_MONTHLY"))
+    logger.info(f'检测到设置变量 {QLBK_KEEP_MONTHLY}')
+
+QLBK_MAX_SIZE = 0  # 备份文件总大小上限 (MB)，超过时从最旧的备份开始删除，0 表示不限制
+if env("QLBK_MAX_SIZE"):
+    QLBK_MAX_SIZE = float(env("QLBK_MAX_SIZE"))
+    logger.info(f'检测到设置变量 {QLBK_MAX_SIZE}')
+
+QLBK_COMPRESS = 'gzip'  # 压缩格式 gzip 或 zstd (需要 pip install zstandard)
+if env("QLBK_COMPRESS"):
+    QLBK_COMPRESS = env("QLBK_COMPRESS").strip().lower()
+    logger.info(f'检测到设置变量 {QLBK_COMPRESS}')
+
+QLBK_LEVEL = None  # 压缩级别，默认 gzip 为 6，zstd 为 3
+if env("QLBK_LEVEL"):
+    QLBK_LEVEL = int(env("QLBK_LEVEL"))
+    logger.info(f'检测到设置变量 {QLBK_LEVEL}')
+
+QLBK_THREADS = os.cpu_count() or 1  # 压缩线程数，默认为 CPU 核数
+if env("QLBK_THREADS"):
+    QLBK_THREADS = max(1, int(env("QLBK_THREADS")))
+    logger.info(f'检测到设置变量 {QLBK_THREADS}')
+
+# 备份模式: full 每次完整备份；incremental 只备份变化的文件；
+# repo 分块去重保存到备份目录下的 repo 仓库，快照与备份文件使用相同的保留规则；
+# repo 模式建议 pip install fastcdc，未安装时按固定大小分块，插入内容后的去重效果较差
+QLBK_MODE = 'full'
+if env("QLBK_MODE"):
+    QLBK_MODE = env("QLBK_MODE").strip().lower()
+    logger.info(f'检测到设置变量 {QLBK_MODE}')
+
+QLBK_FULL_EVERY = 7  # 增量模式下每隔多少次运行做一次完整备份
+if env("QLBK_FULL_EVERY"):
+    QLBK_FULL_EVERY = max(1, int(env("QLBK_FULL_EVERY")))
+    logger.info(f'检测到设置变量 {QLBK_FULL_EVERY}')
+
+# 备份文件的扩展名
+BACKUP_SUFFIXES = ('.tar.gz', '.tar.zst')
+# 增量模式的文件清单，保存在备份目录中
+MANIFEST_NAME = 'qlbk_manifest.json'
+# 备份目录清单，记录每个备份的时间、大小和 sha256，见 BackupCatalog
+CATALOG_NAME = 'qlbk_catalog.json'
+# 增量模式的归档中第一个成员，记录类型、基础备份和已删除的文件
+INFO_MEMBER = '.qlbk/info.json'
+
 
 def start():
     """开始备份"""
@@ -49,9 +142,34 @@ def start():
     retval = os.getcwd()
     mkdir(QLBK_BACKUPS_PATH)
     now_time = time.strftime("%Y%m%d_%H%M%S", time.localtime())
-    files_name = f'{QLBK_BACKUPS_PATH}/qinglong_{now_time}.tar.gz'
-    logger.info(f'创建备份文件: {retval}/{files_name}')
-    if make_targz(files_name, retval):
+    compress = backup_compress()
+    if QLBK_MODE == 'repo':
+        repo_path = os.path.join(QLBK_BACKUPS_PATH, 'repo')
+        files_name = f'{repo_path}/snapshots/qinglong_{now_time}{ChunkRepository.SNAPSHOT_SUFFIX}'
+        logger.info(f'创建快照: {retval}/{files_name}')
+        ok = make_snapshot(repo_path, f'qinglong_{now_time}', retval)
+    elif QLBK_MODE == 'incremental':
+        manifest = load_manifest(QLBK_BACKUPS_PATH)
+        full = needs_full_backup(manifest, QLBK_BACKUPS_PATH)
+        kind = '' if full else '.inc'
+        files_name = f'{QLBK_BACKUPS_PATH}/qinglong_{now_time}{kind}.tar.{compress}'
+        logger.info(f'创建{"完整" if full else "增量"}备份文件: {retval}/{files_name}')
+        ok = make_incremental(files_name, retval, manifest, full)
+    else:
+        files_name = f'{QLBK_BACKUPS_PATH}/qinglong_{now_time}.tar.{compress}'
+        logger.info(f'创建备份文件: {retval}/{files_name}')
+        ok = make_targz(files_name, retval)
+    if ok and QLBK_MODE != 'repo':
+        # 新备份完成后再按清单清理旧备份
+        catalog = BackupCatalog(QLBK_BACKUPS_PATH)
+        name = os.path.basename(files_name)
+        chain = []
+        if QLBK_MODE == 'incremental':
+            chain = load_manifest(QLBK_BACKUPS_PATH).get('chain', [])
+        base = chain[-2] if len(chain) > 1 and chain[-1] == name else None
+        catalog.add(name, ok['size'], ok['sha256'], base)
+        catalog.apply_retention()
+    if ok:
         logger.info('备份文件压缩完成...')
         message_up_time = time.strftime(
             "%Y年%m月%d日 %H时%M分%S秒", time.localtime())
@@ -65,43 +183,932 @@ def start():
         sys.exit(1)
 
 
+class ParallelGzipWriter:
+    """
+    多线程 gzip 压缩 (与 pigz 相同的做法)。
+    输入按块切分，每块由线程池独立压缩为 raw deflate，以前一块末尾 32KB 作为
+    预设字典以保持压缩率，块之间用 Z_SYNC_FLUSH 对齐字节边界，
+    按顺序拼接后就是一个标准的 gzip 流，gzip/tar 均可直接解压。
+    zlib 压缩时释放 GIL，线程可以占满多个核。
+    """
+
+    BLOCK_SIZE = 1024 * 1024
+    WINDOW = 32 * 1024
+
+    def __init__(self, fileobj, level: int = 6, threads: int = 1):
+        self.fileobj = fileobj
+        self.level = level
+        self.threads = max(1, threads)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.threads, thread_name_prefix='gzip')
+        self.pending = []  # 按顺序等待写出的压缩结果
+        self.buffer = bytearray()
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        # gzip 头: 魔数、deflate、无标志、修改时间、无额外标志、操作系统未知
+        self.fileobj.write(struct.pack(
+            '<BBBBIBB', 0x1f, 0x8b, 8, 0, int(time.time()), 0, 255))
+
+    def _compress(self, block: bytes, dictionary: bytes, last: bool) -> bytes:
+        compressor = zlib.compressobj(
+            self.level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary
+        ) if dictionary else zlib.compressobj(
+            self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def _submit(self, block: bytes, last: bool = False):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending.append(self.executor.submit(
+            self._compress, block, self.dictionary, last))
+        self.dictionary = block[-self.WINDOW:]
+        # 最多保留 2 倍线程数的块在内存中
+        while len(self.pending) > self.threads * 2:
+            self.fileobj.write(self.pending.pop(0).result())
+
+    def write(self, data) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.BLOCK_SIZE:
+            block = bytes(self.buffer[:self.BLOCK_SIZE])
+            del self.buffer[:self.BLOCK_SIZE]
+            self._submit(block)
+        return len(data)
+
+    def close(self):
+        try:
+            self._submit(bytes(self.buffer), last=True)
+            self.buffer.clear()
+            for future in self.pending:
+                self.fileobj.write(future.result())
+            self.pending.clear()
+            self.fileobj.write(struct.pack(
+                '<II', self.crc, self.size & 0xffffffff))
+        finally:
+            self.executor.shutdown()
+
+
+def backup_compress() -> str:
+    """实际使用的压缩格式，zstd 不可用时回退为 gzip"""
+    if QLBK_COMPRESS == 'zstd':
+        if importlib.util.find_spec('zstandard') is not None:
+            return 'zst'
+        logger.info('未安装 zstandard，改用 gzip 压缩 (pip install zstandard)')
+    elif QLBK_COMPRESS != 'gzip':
+        logger.info(f'未知的压缩格式 {QLBK_COMPRESS}，改用 gzip 压缩')
+    return 'gz'
+
+
+def open_compressor(fileobj, compress: str):
+    """在 fileobj 上创建压缩写入流，返回需要 close 的对象"""
+    if compress == 'zst':
+        zstandard = importlib.import_module('zstandard')
+        level = QLBK_LEVEL if QLBK_LEVEL is not None else 3
+        compressor = zstandard.ZstdCompressor(
+            level=level, threads=QLBK_THREADS if QLBK_THREADS > 1 else 0)
+        logger.info(f'使用 zstd 压缩，级别 {level}，{QLBK_THREADS} 线程')
+        return compressor.stream_writer(fileobj, closefd=False)
+    level = QLBK_LEVEL if QLBK_LEVEL is not None else 6
+    logger.info(f'使用 gzip 压缩，级别 {level}，{QLBK_THREADS} 线程')
+    return ParallelGzipWriter(fileobj, level, QLBK_THREADS)
+
+
 def make_targz(output_filename, retval):
     """
-    压缩为 tar.gz
+    压缩为 tar.gz 或 tar.zst (按扩展名)，多线程压缩
     :param output_filename: 压缩文件名
     :param retval: 备份目录
-    :return: bool
+    :return: 成功时返回备份文件的 {'size', 'sha256'}，失败时返回 None
     """
+    compress = 'zst' if output_filename.endswith('.zst') else 'gz'
+    result = None
     try:
-        tar = tarfile.open(output_filename, "w:gz")
-        os.chdir(retval)
-        path = os.listdir(os.getcwd())
-        for p in path:
-            if os.path.isdir(p):
-                if p not in QLBK_EXCLUDE_NAMES:
-                    pathfile = os.path.join(retval, p)
-                    tar.add(pathfile)
-        tar.close()
+        with open(output_filename, 'wb') as f:
+            writer = HashingWriter(f)
+            compressor = open_compressor(writer, compress)
+            try:
+                # 边遍历边流式写入 tar，压缩由 compressor 完成
+                tar = tarfile.open(fileobj=compressor, mode="w|")
+                for path, arcname, st in walk_files(retval, include_dirs=True):
+                    add_file(tar, path, arcname, st)
+                tar.close()
+            finally:
+                compressor.close()
+        result = writer.result()
+    except Exception as e:
+        logger.info(f'压缩失败: {str(e)}')
+    finally:
+        # 失败或被中断时删除不完整的备份文件，以免之后被当作有效的备份
+        if result is None:
+            fileremove(output_filename)
+    return result
+
+
+class HashingWriter:
+    """写入备份文件的同时计算 sha256 和大小，不必再读一遍"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def result(self) -> dict:
+        return {'size': self.size, 'sha256': self.hash.hexdigest()}
+
+
+class HashingReader:
+    """读取文件的同时计算 sha256，写入归档和计算哈希只需读一遍"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+
+def file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compile_excludes(patterns) -> list:
+    """将 QLBK_EXCLUDE_NAMES 编译为 [(是否匹配相对路径, 匹配函数)]"""
+    rules = []
+    for pattern in patterns:
+        if pattern.startswith('re:'):
+            rules.append((True, re.compile(pattern[3:]).search))
+        elif '/' in pattern:
+            regex = re.compile(fnmatch.translate(pattern.lstrip('/')))
+            rules.append((True, regex.match))
+        else:
+            rules.append((False, re.compile(fnmatch.translate(pattern)).match))
+    return rules
+
+
+def walk_files(retval, include_dirs=False):
+    """
+    用 os.scandir 遍历运行目录，按 QLBK_EXCLUDE_NAMES 排除任意深度的文件和目录，
+    跳过超过 QLBK_MAX_FILE_SIZE 的文件、备份目录本身和特殊文件 (套接字、管道、设备)。
+    边遍历边生成，归档不必等待整个目录树扫描完成。
+    :param include_dirs: 是否同时生成目录 (用于在归档中保留空目录)
+    :return: 生成 (绝对路径, 归档中的名称, os.stat_result)，只有目录、普通文件和符号链接
+    """
+    rules = compile_excludes(QLBK_EXCLUDE_NAMES)
+    max_size = QLBK_MAX_FILE_SIZE * 1024 * 1024
+    backups_real = os.path.realpath(QLBK_BACKUPS_PATH)
+    skipped = {'exclude': 0, 'size': 0, 'special': 0}
+    stack = [(os.path.abspath(retval), '')]
+    while stack:
+        dirpath, rel = stack.pop()
+        try:
+            with os.scandir(dirpath) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.info(f'无法读取目录 {dirpath}: {e}')
+            continue
+        subdirs = []
+        for entry in entries:
+            relpath = rel + entry.name
+            if any(match(relpath if by_path else entry.name)
+                   for by_path, match in rules):
+                skipped['exclude'] += 1
+                continue
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            # 与 tar.add 一致，归档名称为去掉开头 / 的绝对路径
+            arcname = entry.path.lstrip('/')
+            if stat.S_ISDIR(st.st_mode):
+                if os.path.realpath(entry.path) == backups_real:
+                    continue
+                if include_dirs:
+                    yield entry.path, arcname, st
+                subdirs.append((entry.path, relpath + '/'))
+            elif stat.S_ISLNK(st.st_mode):
+                yield entry.path, arcname, st
+            elif stat.S_ISREG(st.st_mode):
+                if max_size and st.st_size > max_size:
+                    logger.info(f'跳过超过大小上限的文件 {entry.path} '
+                                f'({st.st_size / 1024 / 1024:.1f}MB)')
+                    skipped['size'] += 1
+                    continue
+                yield entry.path, arcname, st
+            else:
+                skipped['special'] += 1
+        # 深度优先，按名称顺序处理子目录
+        stack.extend(reversed(subdirs))
+    logger.info(f'遍历完成，排除 {skipped["exclude"]} 项，'
+                f'跳过 {skipped["size"]} 个过大的文件和 {skipped["special"]} 个特殊文件')
+
+
+def load_manifest(backups_path) -> dict:
+    """读取增量模式的文件清单，不存在或损坏时返回空清单"""
+    try:
+        with open(os.path.join(backups_path, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.info(f'文件清单无法读取，将进行完整备份: {e}')
+        return {}
+
+
+def save_manifest(backups_path, manifest):
+    """原子地写入文件清单"""
+    filename = os.path.join(backups_path, MANIFEST_NAME)
+    with open(f'{filename}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(f'{filename}.tmp', filename)
+
+
+def needs_full_backup(manifest, backups_path) -> bool:
+    """没有清单、增量链已满 QLBK_FULL_EVERY 次或链上的备份文件缺失时做完整备份"""
+    chain = manifest.get('chain') or []
+    if not chain or not manifest.get('files'):
+        return True
+    if len(chain) >= QLBK_FULL_EVERY:
+        logger.info(f'增量链已有 {len(chain)} 个备份，进行完整备份')
         return True
+    missing = [name for name in chain
+               if not os.path.exists(os.path.join(backups_path, name))]
+    if missing:
+        logger.info(f'增量链中的备份文件已缺失 ({missing[0]} 等)，进行完整备份')
+        return True
+    return False
+
+
+def make_incremental(output_filename, retval, manifest, full):
+    """
+    增量模式的备份。按清单中记录的大小、修改时间和 sha256 找出变化的文件，
+    只归档这些文件，并在 .qlbk/info.json 中记录已删除的文件 (墓碑)；
+    full 为 True 时归档全部文件，开始新的增量链。成功后更新清单。
+    :return: 成功时返回备份文件的 {'size', 'sha256'}，失败时返回 None
+    """
+    old_files = {} if full else manifest.get('files', {})
+    files = {}
+    changed = []
+    # 与完整备份一样包含目录，还原时保留空目录和目录权限
+    for path, arcname, st in walk_files(retval, include_dirs=True):
+        entry = [st.st_size, st.st_mtime_ns, None]
+        old = old_files.get(arcname)
+        if old is not None and old[:2] == entry[:2]:
+            files[arcname] = old
+            continue
+        if old is not None and old[0] == st.st_size and stat.S_ISREG(st.st_mode):
+            # 只有修改时间变化，内容相同时不必归档
+            try:
+                entry[2] = file_hash(path)
+            except OSError as e:
+                # 暂时无法读取，沿用上次的记录，下次运行再比较
+                logger.info(f'跳过无法读取的文件 {path}: {e}')
+                files[arcname] = old
+                continue
+            if entry[2] == old[2]:
+                files[arcname] = entry
+                continue
+        files[arcname] = entry
+        changed.append((path, arcname, st))
+    deleted = []
+    for arcname in sorted(set(old_files) - set(files)):
+        # 仍然存在 (如新加入排除规则或超过大小上限) 的文件不写墓碑，还原时不会被删除
+        if os.path.lexists(os.sep + arcname):
+            files[arcname] = old_files[arcname]
+        else:
+            deleted.append(arcname)
+    logger.info(f'共 {len(files)} 个文件，{len(changed)} 个需要归档，{len(deleted)} 个已删除')
+
+    backup_name = os.path.basename(output_filename)
+    chain = [] if full else list(manifest.get('chain', []))
+    info = {
+        'type': 'full' if full else 'incremental',
+        'base': chain[-1] if chain else None,
+        'created': time.time(),
+        'deleted': deleted,
+    }
+    compress = 'zst' if output_filename.endswith('.zst') else 'gz'
+    try:
+        with open(output_filename, 'wb') as f:
+            writer = HashingWriter(f)
+            compressor = open_compressor(writer, compress)
+            try:
+                tar = tarfile.open(fileobj=compressor, mode="w|")
+                add_bytes(tar, INFO_MEMBER, json.dumps(info, ensure_ascii=False).encode('utf-8'))
+                for path, arcname, st in changed:
+                    try:
+                        files[arcname][2] = add_file(tar, path, arcname, st)
+                    except OSError as e:
+                        # 备份期间被删除或无法读取，沿用上次的记录，下次运行再处理
+                        logger.info(f'跳过无法读取的文件 {path}: {e}')
+                        if arcname in old_files:
+                            files[arcname] = old_files[arcname]
+                        else:
+                            files.pop(arcname, None)
+                tar.close()
+            finally:
+                compressor.close()
     except Exception as e:
         logger.info(f'压缩失败: {str(e)}')
+        fileremove(output_filename)
+        return None
+
+    chain.append(backup_name)
+    save_manifest(os.path.dirname(output_filename) or '.', {
+        'chain': chain,
+        'files': files,
+    })
+    return writer.result()
+
+
+def add_bytes(tar, arcname, data):
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = len(data)
+    tarinfo.mtime = int(time.time())
+    tar.addfile(tarinfo, io.BytesIO(data))
+
+
+@functools.lru_cache(maxsize=None)
+def _owner_names(uid, gid):
+    """与 tarfile 相同，记录属主和属组名称 (查找结果缓存)"""
+    try:
+        uname = pwd.getpwuid(uid)[0] if pwd else ''
+    except KeyError:
+        uname = ''
+    try:
+        gname = grp.getgrgid(gid)[0] if grp else ''
+    except KeyError:
+        gname = ''
+    return uname, gname
+
+
+def make_tarinfo(path, arcname, st):
+    """由遍历时已取得的 stat 结果生成 TarInfo，不再重复 stat"""
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.mode = stat.S_IMODE(st.st_mode)
+    tarinfo.uid, tarinfo.gid = st.st_uid, st.st_gid
+    tarinfo.uname, tarinfo.gname = _owner_names(st.st_uid, st.st_gid)
+    tarinfo.mtime = st.st_mtime
+    if stat.S_ISDIR(st.st_mode):
+        tarinfo.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(st.st_mode):
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = os.readlink(path)
+    else:
+        tarinfo.type = tarfile.REGTYPE
+        tarinfo.size = st.st_size
+    return tarinfo
+
+
+def add_file(tar, path, arcname, st=None):
+    """
+    将文件、目录或符号链接加入归档
+    :param st: walk_files 取得的 os.lstat 结果，None 时重新获取
+    :return: 普通文件内容的 sha256，其他类型为 None
+    """
+    if st is None:
+        st = os.lstat(path)
+    tarinfo = make_tarinfo(path, arcname, st)
+    if not tarinfo.isreg():
+        tar.addfile(tarinfo)
+        return None
+    with open(path, 'rb') as f:
+        reader = HashingReader(f)
+        tar.addfile(tarinfo, reader)
+    return reader.hash.hexdigest()
+
+
+def open_archive(filename):
+    """以流模式打开 .tar.gz/.tar.zst 归档，返回 (TarFile, 需要关闭的文件列表)"""
+    f = open(filename, 'rb')
+    if filename.endswith('.zst'):
+        zstandard = importlib.import_module('zstandard')
+        reader = zstandard.ZstdDecompressor().stream_reader(f)
+        return tarfile.open(fileobj=reader, mode='r|'), [reader, f]
+    return tarfile.open(fileobj=f, mode='r|gz'), [f]
+
+
+def read_info(filename) -> dict:
+    """读取归档的 .qlbk/info.json，非增量模式的归档视为完整备份"""
+    tar, handles = open_archive(filename)
+    try:
+        member = tar.next()
+        if member is not None and member.name == INFO_MEMBER:
+            return json.load(tar.extractfile(member))
+        return {'type': 'full', 'base': None, 'deleted': []}
+    finally:
+        tar.close()
+        for handle in handles:
+            handle.close()
+
+
+def restore(filename, target):
+    """
+    还原到 filename 对应的时间点: 依次解压其所在增量链的完整备份和各个增量，
+    并删除墓碑中记录的文件
+    :param filename: 要还原到的备份文件
+    :param target: 解压到的目录，归档中的路径相对于该目录
+    :return: bool
+    """
+    backup_dir = os.path.dirname(filename) or '.'
+    chain = [os.path.basename(filename)]
+    infos = {}
+    while True:
+        path = os.path.join(backup_dir, chain[0])
+        if not os.path.exists(path):
+            logger.info(f'增量链中的备份文件 {path} 不存在，无法还原')
+            return False
+        infos[chain[0]] = read_info(path)
+        base = infos[chain[0]].get('base')
+        if infos[chain[0]].get('type') != 'incremental' or not base:
+            break
+        chain.insert(0, base)
+
+    os.makedirs(target, exist_ok=True)
+    # tar 过滤器同样拒绝归档外的路径，但与 data 不同，保留目录的权限
+    extract_args = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+    for name in chain:
+        logger.info(f'解压 {name} ...')
+        tar, handles = open_archive(os.path.join(backup_dir, name))
+        try:
+            for member in tar:
+                if member.name == INFO_MEMBER:
+                    continue
+                tar.extract(member, target, **extract_args)
+        finally:
+            tar.close()
+            for handle in handles:
+                handle.close()
+        for arcname in infos[name].get('deleted', []):
+            path = os.path.join(target, arcname)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+    logger.info(f'已还原 {len(chain)} 个备份到 {target}')
+    return True
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 去重备份仓库 (QLBK_MODE=repo)
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+# 内容定义分块 (FastCDC) 的块大小
+CDC_MIN_SIZE = 16 * 1024
+CDC_AVG_SIZE = 64 * 1024
+CDC_MAX_SIZE = 256 * 1024
+
+
+def fixed_chunks(f):
+    """
+    未安装 fastcdc 时按固定大小分块。纯 Python 逐字节计算内容定义的边界
+    只有每秒几 MB，首次备份几 GB 的数据要几十分钟，因此不使用；代价是文件中间
+    插入或删除内容后，其后的块都会变化，去重效果不如内容定义分块
+    """
+    while data := f.read(CDC_AVG_SIZE):
+        yield data
+
+
+def _fastcdc_chunks(path):
+    """已安装 fastcdc (Cython 版) 时按内容定义的边界分块"""
+    fastcdc = importlib.import_module('fastcdc.fastcdc_cy').fastcdc_cy
+    for chunk in fastcdc(path, CDC_MIN_SIZE, CDC_AVG_SIZE, CDC_MAX_SIZE, fat=True):
+        yield chunk.data
+
+
+def fastcdc_available() -> bool:
+    try:
+        return importlib.util.find_spec('fastcdc.fastcdc_cy') is not None
+    except ImportError:
         return False
 
 
+class ChunkRepository:
+    """
+    内容寻址的去重备份仓库。
+
+    文件按内容定义的边界 (需要 fastcdc，否则按固定大小) 切分为块，
+    每个块以其 sha256 命名，压缩后只保存一份 (chunks/ab/abcd...)；每次备份是一个快照索引 (snapshots/<名称>.json.gz)，
+    记录每个文件的元数据和块列表。大小和修改时间与上一个快照相同的文件直接沿用
+    上次的块列表，不再读取。
+    refs.json 记录每个块被多少个快照引用，删除快照时引用数归零的块随之删除；
+    refs.json 与快照列表不一致时 (如上次运行中断) 从全部快照重新统计。
+    """
+
+    SNAPSHOT_SUFFIX = '.json.gz'
+
+    def __init__(self, path):
+        self.path = path
+        self.chunks_dir = os.path.join(path, 'chunks')
+        self.snapshots_dir = os.path.join(path, 'snapshots')
+        self.refs_file = os.path.join(path, 'refs.json')
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        self.compress = backup_compress()
+        if self.compress == 'zst':
+            self.level = QLBK_LEVEL if QLBK_LEVEL is not None else 3
+        else:
+            self.level = QLBK_LEVEL if QLBK_LEVEL is not None else 6
+        self.new_chunks = 0
+        self.new_bytes = 0
+        self._lock = threading.Lock()
+
+    # ---------- 块 ----------
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def _encode(self, data) -> bytes:
+        # 第一个字节标记压缩格式，读取时不依赖当前的 QLBK_COMPRESS
+        if self.compress == 'zst':
+            zstandard = importlib.import_module('zstandard')
+            return b's' + zstandard.ZstdCompressor(level=self.level).compress(data)
+        return b'z' + zlib.compress(data, self.level)
+
+    @staticmethod
+    def _decode(blob) -> bytes:
+        if blob[:1] == b's':
+            zstandard = importlib.import_module('zstandard')
+            return zstandard.ZstdDecompressor().decompress(blob[1:])
+        return zlib.decompress(blob[1:])
+
+    def put_chunk(self, data) -> str:
+        """保存一个块 (已存在则跳过)，返回其 sha256"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest
+        blob = self._encode(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        with self._lock:
+            self.new_chunks += 1
+            self.new_bytes += len(blob)
+        return digest
+
+    def get_chunk(self, digest) -> bytes:
+        with open(self.chunk_path(digest), 'rb') as f:
+            data = self._decode(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f'块 {digest} 已损坏')
+        return data
+
+    # ---------- 快照 ----------
+
+    def snapshots(self) -> list:
+        """按名称 (即时间) 排序的快照名称"""
+        suffix = self.SNAPSHOT_SUFFIX
+        return sorted(name[:-len(suffix)] for name in os.listdir(self.snapshots_dir)
+                      if name.endswith(suffix))
+
+    def snapshot_path(self, name):
+        return os.path.join(self.snapshots_dir, name + self.SNAPSHOT_SUFFIX)
+
+    def load_snapshot(self, name) -> dict:
+        with gzip.open(self.snapshot_path(name), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_snapshot(self, name, snapshot):
+        path = self.snapshot_path(name)
+        with gzip.open(f'{path}.tmp', 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(f'{path}.tmp', path)
+
+    @staticmethod
+    def snapshot_chunks(snapshot) -> set:
+        return {digest for entry in snapshot['files'] for digest in entry.get('chunks', ())}
+
+    # ---------- 引用计数 ----------
+
+    def load_refs(self) -> dict:
+        """{块: 引用它的快照数}，与快照列表不一致时重新统计"""
+        snapshots = self.snapshots()
+        if not snapshots:
+            return {}
+        try:
+            with open(self.refs_file, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('snapshots') == snapshots:
+                return saved['refs']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.info(f'引用计数无法读取: {e}')
+        logger.info('重新统计块的引用计数...')
+        refs = {}
+        for name in snapshots:
+            for digest in self.snapshot_chunks(self.load_snapshot(name)):
+                refs[digest] = refs.get(digest, 0) + 1
+        return refs
+
+    def _save_refs(self, refs):
+        with open(f'{self.refs_file}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'snapshots': self.snapshots(), 'refs': refs}, f)
+        os.replace(f'{self.refs_file}.tmp', self.refs_file)
+
+    # ---------- 备份、清理、还原 ----------
+
+    def backup(self, retval, name) -> dict:
+        """
+        为 retval 下需要备份的文件创建快照
+        :return: 统计信息
+        """
+        refs = self.load_refs()
+        previous = {}
+        if snapshots := self.snapshots():
+            previous = {entry['path']: entry
+                        for entry in self.load_snapshot(snapshots[-1])['files']}
+
+        use_fastcdc = fastcdc_available()
+        if not use_fastcdc:
+            logger.info('未安装 fastcdc，改为按固定大小分块，去重效果较差 (pip install fastcdc)')
+        files = []
+        reused = 0
+        with ThreadPoolExecutor(max_workers=QLBK_THREADS,
+                                thread_name_prefix='chunk') as executor:
+            for path, arcname, st in walk_files(retval):
+                entry = {'path': arcname, 'mode': stat.S_IMODE(st.st_mode),
+                         'mtime': st.st_mtime_ns, 'size': st.st_size}
+                if stat.S_ISLNK(st.st_mode):
+                    entry['type'] = 'link'
+                    entry['target'] = os.readlink(path)
+                    files.append(entry)
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                entry['type'] = 'file'
+                old = previous.get(arcname)
+                if (old is not None and old.get('type') == 'file'
+                        and old['size'] == st.st_size and old['mtime'] == st.st_mtime_ns):
+                    entry['chunks'] = old['chunks']
+                    reused += 1
+                    files.append(entry)
+                    continue
+                try:
+                    entry['chunks'] = self._store_file(executor, path, use_fastcdc)
+                except OSError as e:
+                    logger.info(f'跳过无法读取的文件 {path}: {e}')
+                    continue
+                files.append(entry)
+
+        snapshot = {'created': time.time(), 'files': files}
+        self._save_snapshot(name, snapshot)
+        for digest in self.snapshot_chunks(snapshot):
+            refs[digest] = refs.get(digest, 0) + 1
+        self._save_refs(refs)
+        return {'files': len(files), 'reused': reused, 'new_chunks': self.new_chunks,
+                'new_bytes': self.new_bytes, 'chunks': len(refs)}
+
+    def _store_file(self, executor, path, use_fastcdc) -> list:
+        """分块后在线程池中计算哈希、压缩并保存，返回按顺序的块列表"""
+        window = QLBK_THREADS * 4
+        futures = []
+        with open(path, 'rb') as f:
+            chunks = _fastcdc_chunks(path) if use_fastcdc else fixed_chunks(f)
+            for data in chunks:
+                futures.append(executor.submit(self.put_chunk, data))
+                # 限制排队中的块，避免大文件占用过多内存
+                if len(futures) > window:
+                    futures[-window - 1].result()
+        return [future.result() for future in futures]
+
+    def prune(self) -> int:
+        """
+        按保留规则 (见 select_retained，不计总大小上限) 删除旧快照和不再被引用的块
+        :return: 删除的块数
+        """
+        snapshots = self.snapshots()
+        # 名称中没有时间时按名称顺序
+        keep = select_retained([
+            {'name': name, 'time': backup_time(name, index), 'size': 0}
+            for index, name in enumerate(snapshots)
+        ])
+        expired = [name for name in snapshots if name not in keep]
+        if not expired:
+            return 0
+        refs = self.load_refs()
+        released = set()
+        for name in expired:
+            chunks = self.snapshot_chunks(self.load_snapshot(name))
+            os.remove(self.snapshot_path(name))
+            logger.info(f'已删除旧的快照: {name}')
+            for digest in chunks:
+                refs[digest] = refs.get(digest, 1) - 1
+                if refs[digest] <= 0:
+                    del refs[digest]
+                    released.add(digest)
+        # 先保存引用计数再删除块，中断时最多留下未引用的块，不会误删
+        self._save_refs(refs)
+        for digest in released:
+            try:
+                os.remove(self.chunk_path(digest))
+            except FileNotFoundError:
+                pass
+        logger.info(f'删除了 {len(released)} 个不再被引用的块')
+        return len(released)
+
+    def restore(self, name, target):
+        """将快照还原到 target 目录，快照中的路径相对于该目录"""
+        snapshot = self.load_snapshot(name)
+        target = os.path.abspath(target)
+        for entry in snapshot['files']:
+            path = os.path.abspath(os.path.join(target, entry['path']))
+            if not path.startswith(target + os.sep):
+                logger.info(f'跳过不安全的路径: {entry["path"]}')
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.lexists(path):
+                os.remove(path)
+            if entry['type'] == 'link':
+                os.symlink(entry['target'], path)
+                continue
+            with open(path, 'wb') as f:
+                for digest in entry['chunks']:
+                    f.write(self.get_chunk(digest))
+            os.chmod(path, entry['mode'])
+            os.utime(path, ns=(entry['mtime'], entry['mtime']))
+        logger.info(f'已还原快照 {name} 的 {len(snapshot["files"])} 个文件到 {target}')
+        return True
+
+
+def make_snapshot(repo_path, name, retval):
+    """
+    在去重仓库中创建快照，并按保留规则清理旧快照
+    :return: bool
+    """
+    try:
+        repo = ChunkRepository(repo_path)
+        stats = repo.backup(retval, name)
+        logger.info(
+            f'快照包含 {stats["files"]} 个文件 (沿用 {stats["reused"]} 个)，'
+            f'新增 {stats["new_chunks"]} 个块 {stats["new_bytes"] / 1024 / 1024:.1f}MB，'
+            f'仓库共 {stats["chunks"]} 个块'
+        )
+        repo.prune()
+        return True
+    except Exception as e:
+        logger.info(f'创建快照失败: {str(e)}')
+        return False
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 备份目录清单和保留策略
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+BACKUP_TIME_PATTERN = re.compile(r'qinglong_(\d{8}_\d{6})')
+
+
+def backup_time(name, default=None):
+    """从 qinglong_<时间> 格式的名称中取出备份时间"""
+    match = BACKUP_TIME_PATTERN.search(name)
+    if match is None:
+        return default
+    return time.mktime(time.strptime(match.group(1), "%Y%m%d_%H%M%S"))
+
+
+def select_retained(records) -> set:
+    """
+    按保留规则选出要保留的备份 (祖父-父-子)
+    :param records: [{'name', 'time', 'size', 'base'}]，base 为增量备份依赖的上一个备份
+    :return: 要保留的备份名称
+    规则: 最新的 QLBK_MAX_FLIES 个；最近 QLBK_KEEP_DAILY 天、QLBK_KEEP_WEEKLY 周、
+    QLBK_KEEP_MONTHLY 个月中每天/周/月最新的一个；被保留的增量备份所依赖的整条链；
+    设置 QLBK_MAX_SIZE 时再从最旧的开始删除 (连同依赖它的增量备份)，
+    直到总大小不超过上限。最新的备份及其所在的链始终保留，即使 QLBK_MAX_FLIES 为 0。
+    """
+    newest_first = sorted(records, key=lambda r: r['time'], reverse=True)
+    by_name = {r['name']: r for r in records}
+    keep = {r['name'] for r in newest_first[:max(QLBK_MAX_FLIES, 1)]}
+    for count, fmt in ((QLBK_KEEP_DAILY, '%Y-%m-%d'), (QLBK_KEEP_WEEKLY, '%G-W%V'),
+                       (QLBK_KEEP_MONTHLY, '%Y-%m')):
+        periods = set()
+        for record in newest_first:
+            if len(periods) >= count:
+                break
+            period = time.strftime(fmt, time.localtime(record['time']))
+            if period not in periods:
+                periods.add(period)
+                keep.add(record['name'])
+
+    def chain(name):
+        """name 及其依赖的所有备份"""
+        names = []
+        while name in by_name and name not in names:
+            names.append(name)
+            name = by_name[name].get('base')
+        return names
+
+    for name in list(keep):
+        keep.update(chain(name))
+
+    budget = QLBK_MAX_SIZE * 1024 * 1024
+    if budget and newest_first:
+        protected = set(chain(newest_first[0]['name']))
+        total = sum(by_name[name]['size'] for name in keep)
+        for record in reversed(newest_first):
+            if total <= budget:
+                break
+            if record['name'] not in keep or record['name'] in protected:
+                continue
+            # 依赖该备份的增量备份也无法还原，一并删除
+            dropped = {name for name in keep if record['name'] in chain(name)}
+            total -= sum(by_name[name]['size'] for name in dropped)
+            keep -= dropped
+        if total > budget:
+            logger.info(f'最新的备份链已有 {total / 1024 / 1024:.1f}MB，超过上限 {QLBK_MAX_SIZE}MB')
+    return keep
+
+
+class BackupCatalog:
+    """
+    备份目录清单 (备份目录下的 qlbk_catalog.json)，记录每个备份的时间、大小、
+    sha256 和所依赖的上一个备份。保留策略只根据清单决定删除哪些备份，
+    不必每次列出和 stat 整个备份目录；清单不存在时扫描一次导入已有的备份。
+    """
+
+    def __init__(self, backups_path):
+        self.backups_path = backups_path
+        self.filename = os.path.join(backups_path, CATALOG_NAME)
+        self.records = self._load()
+
+    def _load(self) -> list:
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                return json.load(f)['backups']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.info(f'备份清单无法读取，重新导入: {e}')
+        return self._import()
+
+    def _import(self) -> list:
+        records = []
+        for name in sorted(os.listdir(self.backups_path)):
+            if not name.endswith(BACKUP_SUFFIXES):
+                continue
+            path = os.path.join(self.backups_path, name)
+            st = os.stat(path)
+            base = None
+            if '.inc.' in name:
+                try:
+                    base = read_info(path).get('base')
+                except Exception as e:
+                    logger.info(f'无法读取 {name} 的备份信息: {e}')
+            records.append({'name': name, 'time': backup_time(name, st.st_mtime),
+                            'size': st.st_size, 'sha256': None, 'base': base})
+        if records:
+            logger.info(f'首次使用备份清单，导入已有的 {len(records)} 个备份')
+        return records
+
+    def save(self):
+        with open(f'{self.filename}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'backups': self.records}, f, ensure_ascii=False, indent=1)
+        os.replace(f'{self.filename}.tmp', self.filename)
+
+    def add(self, name, size, checksum, base=None):
+        # 清单刚从目录导入时可能已包含这个新备份
+        self.records = [r for r in self.records if r['name'] != name]
+        self.records.append({'name': name, 'time': backup_time(name, time.time()),
+                             'size': size, 'sha256': checksum, 'base': base})
+
+    def apply_retention(self) -> list:
+        """
+        删除保留规则之外的备份并更新清单
+        :return: 删除的备份名称
+        """
+        keep = select_retained(self.records)
+        expired = [r['name'] for r in self.records if r['name'] not in keep]
+        for name in expired:
+            fileremove(os.path.join(self.backups_path, name))
+        self.records = [r for r in self.records if r['name'] in keep]
+        total = sum(r['size'] for r in self.records)
+        logger.info(f'当前保留 {len(self.records)} 个备份，共 {total / 1024 / 1024:.1f}MB')
+        self.save()
+        return expired
+
+
 def mkdir(path):
-    """创建备份目录"""
-    folder = os.path.exists(path)
-    if not folder:  # 判断是否存在文件夹如果不存在则创建为文件夹
+    """创建备份目录，旧备份在新备份完成后由 BackupCatalog 按保留规则清理"""
+    if not os.path.exists(path):  # 判断是否存在文件夹如果不存在则创建为文件夹
         logger.info(f'第一次备份,创建备份目录: {QLBK_BACKUPS_PATH}')
         os.makedirs(path)  # 创建文件时如果路径不存在会创建这个路径
-    else:  # 如有备份文件夹则检查备份文件数量
-        backup_files = f'{run_path}{path}'
-        files_all = os.listdir(backup_files)  # backup_files中的所有文件
-        logger.info(f'当前备份文件 {len(files_all)}/{QLBK_MAX_FLIES}')
-        files_num = len(files_all)
-        if files_num > QLBK_MAX_FLIES:
-            logger.info(f'达到最大备份数量 {QLBK_MAX_FLIES} 个')
-            check_files(files_all, files_num, backup_files, QLBK_MAX_FLIES)
 
 
 def show(qr_link: str):
@@ -119,25 +1126,19 @@ def fileremove(filename):
         pass
 
 
-def check_files(files_all, files_num, backup_files, QLBK_MAX_FLIES):
-    """检查旧的备份文件"""
-    create_time = []
-    file_name = []
-    for names in files_all:
-        if names.endswith(".tar.gz"):
-            filename = os.path.join(backup_files, names)
-            file_name.append(filename)
-            create_time.append(os.path.getctime(filename))  # 获取文件的修改时间
-    # 将两个list转换为dict
-    dit = dict(zip(create_time, file_name))
-    # 根据dit的key对dit进行排序（变为list）
-    dit = sorted(dit.items(), key=lambda d: d[-2], reverse=False)
-    for i in range(files_num - QLBK_MAX_FLIES):  # 删除文件个数
-        file_location = dit[i][1]
-        fileremove(file_location)
-
-
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['restore']:
+        # python ins_qinglong_backup.py restore <备份文件> <还原目录>
+        if len(sys.argv) != 4:
+            logger.info('用法: python ins_qinglong_backup.py restore <备份文件> <还原目录>')
+            sys.exit(2)
+        filename, target = sys.argv[2], sys.argv[3]
+        if filename.endswith(ChunkRepository.SNAPSHOT_SUFFIX):
+            # 去重仓库的快照: <仓库>/snapshots/<名称>.json.gz
+            repo = ChunkRepository(os.path.dirname(os.path.dirname(os.path.abspath(filename))))
+            name = os.path.basename(filename)[:-len(ChunkRepository.SNAPSHOT_SUFFIX)]
+            sys.exit(0 if repo.restore(name, target) else 1)
+        sys.exit(0 if restore(filename, target) else 1)
     nowtime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
     logger.info('---------' + str(nowtime) + ' 备份程序开始执行------------')
     if os.path.exists('/ql/data/'):
@@ -148,4 +1149,5 @@ if __name__ == '__main__':
     
     os.chdir(run_path)  # 设置运行目录
     start()
+    replay()  # 本次没有发送通知时也重发之前未能发出的通知
     sys.exit(0)
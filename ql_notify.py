@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+青龙脚本共用的通知发送，替代直接调用 notify.send。
+
+- 后台发送: send() 立即返回，脚本继续做自己的事；进程退出前最多再等到
+  截止时间 (环境变量 QL_NOTIFY_TIMEOUT，默认 15 秒，从调用 send 时算起)。
+- 多渠道并行: notify.py 提供 add_notify_function 时，每个已配置的渠道单独
+  一个线程发送，一个渠道卡住不影响其他渠道。
+- 发件箱: 截止时仍未完成或抛出异常的渠道，连同标题和内容追加到发件箱文件
+  (环境变量 QL_NOTIFY_OUTBOX，默认为脚本目录下的 notify_outbox.jsonl)，
+  下次任意脚本调用 send() 或 replay() 时在后台重发。超过 3 天或重发 5 次的消息
+  会被丢弃。没有通知要发送的运行也应在退出前调用 replay()。
+
+notify.py 的渠道函数大多只打印失败信息而不抛出异常，这类失败无法识别，
+不会进入发件箱。为避免额外的网络请求，这里不附加一言 (HITOKOTO)。
+
+用法:
+    from ql_notify import send, replay
+    send("标题", "内容")
+    replay()  # 脚本结束前调用，本次没有发送时也会重发发件箱
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+
+NOTIFY_TIMEOUT = float(os.getenv("QL_NOTIFY_TIMEOUT") or 15)
+OUTBOX_FILE = os.getenv("QL_NOTIFY_OUTBOX") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "notify_outbox.jsonl"
+)
+OUTBOX_MAX_AGE = 3 * 86400
+OUTBOX_MAX_ATTEMPTS = 5
+
+_lock = threading.Lock()
+_dispatches = []
+_replayed = False
+_notify = None
+
+
+def _load_notify():
+    """导入青龙的 notify.py，不存在时返回 None"""
+    global _notify
+    if _notify is None:
+        try:
+            import notify
+        except ImportError:
+            print("⚠️ 未找到 notify.py，跳过通知。")
+            notify = False
+        _notify = notify
+    return _notify or None
+
+
+def _channel_functions(notify) -> dict:
+    """{渠道名: 发送函数}，notify.py 不支持按渠道发送时整体作为一个渠道"""
+    add_notify_function = getattr(notify, 'add_notify_function', None)
+    if add_notify_function is None:
+        return {'send': notify.send}
+    functions = add_notify_function() or []
+    return {function.__name__: function for function in functions}
+
+
+class _Dispatch:
+    """一条消息的一次发送，每个渠道一个后台线程"""
+
+    def __init__(self, title: str, content: str, channels=None,
+                 attempts: int = 0, created: float | None = None):
+        self.title = title
+        self.content = content
+        self.attempts = attempts + 1
+        self.created = created or time.time()
+        self.deadline = time.monotonic() + NOTIFY_TIMEOUT
+        self.requested = channels
+        # 渠道名 -> None (发送中) / True (完成) / False (异常)
+        self.results = {}
+        self.threads = []
+
+    def start(self, notify):
+        functions = _channel_functions(notify)
+        if self.requested is not None:
+            functions = {
+                name: function for name, function in functions.items()
+                if name in self.requested
+            }
+        for name, function in functions.items():
+            self.results[name] = None
+            thread = threading.Thread(
+                target=self._call, args=(name, function),
+                name=f"notify-{name}", daemon=True
+            )
+            self.threads.append(thread)
+            thread.start()
+
+    def _call(self, name: str, function):
+        try:
+            function(self.title, self.content)
+        except Exception as e:
+            print(f"❌ 通知渠道 {name} 发送失败: {e}")
+            self.results[name] = False
+        else:
+            self.results[name] = True
+
+    def wait(self):
+        """等待所有渠道结束，最多到截止时间"""
+        for thread in self.threads:
+            thread.join(max(0.0, self.deadline - time.monotonic()))
+
+    def unfinished(self) -> list[str]:
+        """超时或失败、需要放入发件箱的渠道"""
+        return [name for name, result in self.results.items() if not result]
+
+    def outbox_entry(self) -> dict:
+        return {
+            'title': self.title,
+            'content': self.content,
+            'channels': self.unfinished(),
+            'attempts': self.attempts,
+            'created': self.created,
+        }
+
+
+def _claim_outbox() -> list[dict]:
+    """取走发件箱中的所有消息，并发运行的脚本不会重复取到同一条"""
+    claimed = f"{OUTBOX_FILE}.{os.getpid()}"
+    try:
+        os.replace(OUTBOX_FILE, claimed)
+    except FileNotFoundError:
+        return []
+    except OSError as e:
+        print(f"⚠️ 读取通知发件箱失败: {e}")
+        return []
+
+    entries = []
+    try:
+        with open(claimed, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    finally:
+        os.remove(claimed)
+
+    now = time.time()
+    valid = [
+        entry for entry in entries
+        if now - entry.get('created', 0) <= OUTBOX_MAX_AGE
+        and entry.get('attempts', 0) < OUTBOX_MAX_ATTEMPTS
+    ]
+    if len(valid) < len(entries):
+        print(f"🗑️ 丢弃 {len(entries) - len(valid)} 条过期或多次失败的通知。")
+    return valid
+
+
+def _write_outbox(entries: list[dict]):
+    try:
+        with open(OUTBOX_FILE, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"❌ 写入通知发件箱失败: {e}")
+        return
+    print(f"📮 {len(entries)} 条通知未能及时发出，已存入发件箱，下次运行时重发。")
+
+
+def _start(notify, dispatch: _Dispatch):
+    dispatch.start(notify)
+    with _lock:
+        _dispatches.append(dispatch)
+
+
+def replay():
+    """
+    在后台重发发件箱中的消息，立即返回，每个进程只执行一次。
+    send() 第一次调用时自动执行；发件箱为空时不导入 notify.py。
+    """
+    global _replayed
+    with _lock:
+        if _replayed:
+            return
+        _replayed = True
+    if not os.path.exists(OUTBOX_FILE):
+        return
+    notify = _load_notify()
+    if notify is None:
+        return
+    entries = _claim_outbox()
+    if entries:
+        print(f"📮 重发发件箱中的 {len(entries)} 条通知。")
+    for entry in entries:
+        _start(notify, _Dispatch(
+            entry['title'], entry['content'],
+            channels=entry.get('channels') or None,
+            attempts=entry.get('attempts', 0),
+            created=entry.get('created'),
+        ))
+
+
+def send(title: str, content: str):
+    """
+    在后台发送通知，立即返回。
+    第一次调用时同时在后台重发发件箱中的消息。
+    """
+    notify = _load_notify()
+    if notify is None:
+        return
+    replay()
+
+    if not content:
+        print(f"{title} 推送内容为空！")
+        return
+    skip_titles = os.getenv("SKIP_PUSH_TITLE")
+    if skip_titles and title in skip_titles.split("\n"):
+        print(f"{title} 在 SKIP_PUSH_TITLE 环境变量内，跳过推送！")
+        return
+    _start(notify, _Dispatch(title, content))
+
+
+def flush():
+    """
+    等待所有后台发送结束或到达截止时间，未完成的存入发件箱。
+    进程退出时自动调用。
+    """
+    with _lock:
+        dispatches = list(_dispatches)
+        _dispatches.clear()
+    failed = []
+    for dispatch in dispatches:
+        dispatch.wait()
+        if dispatch.unfinished():
+            failed.append(dispatch.outbox_entry())
+    if failed:
+        _write_outbox(failed)
+
+
+atexit.register(flush)
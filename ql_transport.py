@@ -0,0 +1,556 @@
+# -*- coding: utf-8 -*-
+"""
+青龙脚本共用的 HTTP 传输层。
+
+- SessionPool: 按主机复用的会话 (keep-alive 连接池)，默认超时，按 RetryPolicy
+  退避重试，由 urllib3 协商压缩格式，可选 HTTP/2 (需要 httpx[http2])。
+- header_profile: 常用的浏览器请求头，脚本只需补充 Cookie、referer 等。
+- 计时: 每个请求记录 DNS 解析、建立连接、首字节和总耗时，可用
+  collect_request_stats 收集，或通过 SessionPool.add_timing_hook 注册回调。
+
+环境变量:
+- QL_HTTP_TIMEOUT: 默认超时秒数 (默认 15)
+- QL_HTTP_TIMING: 设为 1 时打印每个请求的耗时
+
+requests/urllib3 在第一次创建会话时才导入，只用到 RetryPolicy 或请求头的
+脚本不需要加载它们。
+
+用法:
+    from ql_transport import SessionPool, header_profile
+    pool = SessionPool(header_profile('navigate'))
+    response = pool.get(url, headers={'Cookie': cookie})
+"""
+
+from __future__ import annotations
+
+import importlib
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+DEFAULT_TIMEOUT = float(os.getenv("QL_HTTP_TIMEOUT") or 15)
+TIMING_LOG = os.getenv("QL_HTTP_TIMING", "").lower() in ("1", "true", "yes")
+
+# 流式读取结束时，剩余内容不超过该字节数才读完以复用连接
+DRAIN_LIMIT = 64 * 1024
+# 默认只自动重试不会产生副作用的请求
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+# 网关错误通常是暂时的，值得重试
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 请求头
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+)
+
+_CLIENT_HINTS = {
+    'sec-ch-ua': (
+        '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"'
+    ),
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+}
+
+HEADER_PROFILES = {
+    # 在浏览器中打开页面
+    'navigate': {
+        'accept': (
+            'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,'
+            'image/webp,image/apng,*/*;q=0.8,'
+            'application/signed-exchange;v=b3;q=0.7'
+        ),
+        'accept-language': 'zh-CN,zh;q=0.9,und;q=0.8',
+        **_CLIENT_HINTS,
+        'sec-fetch-dest': 'document',
+        'sec-fetch-mode': 'navigate',
+        'sec-fetch-site': 'same-origin',
+        'sec-fetch-user': '?1',
+        'sec-gpc': '1',
+        'upgrade-insecure-requests': '1',
+        'user-agent': USER_AGENT,
+    },
+    # 页面内的 XHR/fetch 请求
+    'xhr': {
+        'accept': '*/*',
+        'accept-language': 'zh-CN,zh;q=0.9',
+        **_CLIENT_HINTS,
+        'sec-fetch-dest': 'empty',
+        'sec-fetch-mode': 'cors',
+        'sec-fetch-site': 'same-origin',
+        'x-requested-with': 'XMLHttpRequest',
+        'user-agent': USER_AGENT,
+    },
+    # 接口请求，只带 UA
+    'api': {
+        'accept': 'application/json, text/plain, */*',
+        'user-agent': USER_AGENT,
+    },
+}
+
+
+def header_profile(name: str = 'navigate', extra: dict | None = None) -> dict:
+    """
+    返回一份请求头配置的副本
+    :param name: HEADER_PROFILES 中的名称
+    :param extra: 追加或覆盖的请求头
+    """
+    headers = dict(HEADER_PROFILES[name])
+    headers.update(extra or {})
+    return headers
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 重试策略
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+class RetryPolicy:
+    """
+    指数退避重试策略。
+    第 n 次失败后等待 base_delay * multiplier^(n-1) 秒 (不超过 max_delay)，
+    再按 jitter 比例随机缩短，避免多个请求同时重试。
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 5.0,
+                 max_delay: float = 60.0, multiplier: float = 2.0,
+                 jitter: float = 0.5):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+        self.multiplier = max(1.0, float(multiplier))
+        self.jitter = min(1.0, max(0.0, float(jitter)))
+
+    @classmethod
+    def from_config(cls, config: dict | None, default=None):
+        """
+        从配置字典构建策略，未设置的键沿用 default 策略的值
+        :param config: 形如 {"max_attempts": 3, "base_delay": 5} 的字典
+        :param default: 作为默认值的 RetryPolicy，None 时使用内置默认值
+        """
+        base = default or cls()
+        config = config or {}
+        return cls(
+            max_attempts=config.get('max_attempts', base.max_attempts),
+            base_delay=config.get('base_delay', base.base_delay),
+            max_delay=config.get('max_delay', base.max_delay),
+            multiplier=config.get('multiplier', base.multiplier),
+            jitter=config.get('jitter', base.jitter),
+        )
+
+    def delay(self, attempt: int) -> float:
+        """第 attempt 次尝试失败后，下一次重试前的等待秒数"""
+        delay = min(
+            self.max_delay,
+            self.base_delay * self.multiplier ** (attempt - 1)
+        )
+        return delay * (1 - self.jitter * random.random())
+
+
+# 普通脚本的请求重试: 最多 3 次，间隔约 1~2 秒、2~4 秒
+DEFAULT_RETRY = RetryPolicy(max_attempts=3, base_delay=2.0, max_delay=10.0)
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 请求计时
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+# 当前线程中正在收集的指标，连接和会话池在请求过程中写入其中的每一个
+_local = threading.local()
+
+
+@contextmanager
+def collect_request_stats():
+    """
+    收集当前线程中请求的网络指标，可以嵌套:
+    dns / connect (新建连接时才有，复用连接时缺省)、ttfb (收到响应头)、http_status
+    """
+    stats = {}
+    stack = _local.__dict__.setdefault('stack', [])
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+
+def _add_stat(name: str, value: float):
+    for stats in getattr(_local, 'stack', ()):
+        stats[name] = stats.get(name, 0.0) + value
+
+
+def _set_stat(name: str, value):
+    for stats in getattr(_local, 'stack', ()):
+        stats[name] = value
+
+
+_timed_pool_classes = None
+
+
+def _get_timed_pool_classes() -> dict:
+    """
+    返回按协议区分的 urllib3 连接池类，其连接在建立时记录 DNS 解析和
+    建立连接 (TCP 握手，HTTPS 还包括 TLS 握手) 的耗时
+    """
+    global _timed_pool_classes
+    if _timed_pool_classes is not None:
+        return _timed_pool_classes
+
+    socket = importlib.import_module('socket')
+    urllib3_connection = importlib.import_module('urllib3.connection')
+    urllib3_pool = importlib.import_module('urllib3.connectionpool')
+    allowed_gai_family = importlib.import_module(
+        'urllib3.util.connection').allowed_gai_family
+    # urllib3 的 NewConnectionError 是 ConnectTimeoutError 的子类
+    ConnectTimeoutError = importlib.import_module(
+        'urllib3.exceptions').ConnectTimeoutError
+
+    class TimedConnectionMixin:
+        _dns_seconds = 0.0
+
+        def _new_conn(self):
+            # 先自行解析，单独计时，再逐个地址交给 urllib3 建立连接；
+            # 与 urllib3 一样按 allowed_gai_family() 选择 IPv4/IPv6，
+            # 一个地址连接失败或超时后继续尝试下一个
+            host = self._dns_host
+            started = time.perf_counter()
+            try:
+                infos = socket.getaddrinfo(
+                    host.strip('[]'), self.port, allowed_gai_family(),
+                    socket.SOCK_STREAM
+                )
+                addresses = list(dict.fromkeys(info[4][0] for info in infos))
+            except (OSError, UnicodeError):
+                # 解析失败时交给 urllib3 抛出它自己的异常
+                addresses = [host]
+            self._dns_seconds = time.perf_counter() - started
+            try:
+                for index, address in enumerate(addresses):
+                    self._dns_host = address
+                    try:
+                        return super()._new_conn()
+                    except (ConnectTimeoutError, OSError):
+                        if index == len(addresses) - 1:
+                            raise
+            finally:
+                self._dns_host = host
+
+        def connect(self):
+            self._dns_seconds = 0.0
+            started = time.perf_counter()
+            try:
+                super().connect()
+            finally:
+                elapsed = time.perf_counter() - started
+                _add_stat('dns', self._dns_seconds)
+                _add_stat('connect', elapsed - self._dns_seconds)
+
+    class TimedHTTPConnection(TimedConnectionMixin,
+                              urllib3_connection.HTTPConnection):
+        pass
+
+    class TimedHTTPSConnection(TimedConnectionMixin,
+                               urllib3_connection.HTTPSConnection):
+        pass
+
+    class TimedHTTPConnectionPool(urllib3_pool.HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSConnectionPool(urllib3_pool.HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    _timed_pool_classes = {
+        'http': TimedHTTPConnectionPool,
+        'https': TimedHTTPSConnectionPool,
+    }
+    return _timed_pool_classes
+
+
+def _httpx_trace(event_name: str, info: dict):
+    """httpcore 的 trace 回调，记录建立连接的耗时 (DNS 解析计入 connect)"""
+    if not event_name.startswith((
+            'connection.connect_tcp.', 'connection.start_tls.')):
+        return
+    phase_started = _local.__dict__.setdefault('phase_started', {})
+    phase, _, step = event_name.rpartition('.')
+    if step == 'started':
+        phase_started[phase] = time.perf_counter()
+    elif phase in phase_started:
+        _add_stat('connect', time.perf_counter() - phase_started.pop(phase))
+
+
+def print_timing(record: dict):
+    """QL_HTTP_TIMING=1 时使用的计时回调，每个请求打印一行"""
+    phases = " ".join(
+        f"{name}={record[name] * 1000:.0f}ms"
+        for name in ('dns', 'connect', 'ttfb', 'total') if name in record
+    )
+    status = record.get('http_status') or record.get('error', '-').split(':')[0]
+    print(f"⏱️ {record['method']} {record['url']} [{status}] "
+          f"第{record['attempt']}次 {phases}")
+
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# 会话池
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+def _load_httpx():
+    try:
+        httpx = importlib.import_module('httpx')
+        importlib.import_module('h2')  # httpx 的 HTTP/2 支持依赖 h2
+    except ImportError:
+        return None
+    return httpx
+
+
+def _accept_encoding() -> str:
+    """由 urllib3 决定可解码的压缩格式 (安装 brotli/zstandard 后自动包含)"""
+    try:
+        return importlib.import_module('urllib3.util.request').ACCEPT_ENCODING
+    except (ImportError, AttributeError):
+        return "gzip,deflate"
+
+
+class SessionPool:
+    """
+    按主机复用的 HTTP 会话池。
+    每个主机一个会话，预置通用请求头，重试和多次请求之间复用 keep-alive 连接，
+    避免每次都重新进行 TCP/TLS 握手。
+    默认 Cookie 按请求显式传入，会话本身不保存服务器下发的 Cookie，
+    多个账号可以安全地共用同一个连接池；需要登录态的脚本传入 keep_cookies=True。
+    请求时传入 verify 可覆盖池的证书校验设置 (按主机和 verify 分别建立会话)，
+    多个脚本因此可以共用一个池，见 ck_all.py。
+    """
+
+    def __init__(self, base_headers: dict | None = None, pool_size: int = 1,
+                 timeout: float = DEFAULT_TIMEOUT, http2: bool = False,
+                 retry: RetryPolicy | None = None, verify: bool = True,
+                 keep_cookies: bool = False):
+        self.base_headers = dict(base_headers or {})
+        self.base_headers.setdefault('accept-encoding', _accept_encoding())
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = timeout
+        self.retry = retry or DEFAULT_RETRY
+        self.verify = verify
+        self.keep_cookies = keep_cookies
+        self.httpx = _load_httpx() if http2 else None
+        if http2 and self.httpx is None:
+            print("⚠️ 未安装 httpx[http2]，HTTP/2 不可用，改用 HTTP/1.1。")
+        self.timing_hooks = [print_timing] if TIMING_LOG else []
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def add_timing_hook(self, hook):
+        """
+        注册计时回调，每个请求 (每次重试) 结束后调用 hook(record)。
+        record 包含 method、url、attempt，以及 collect_request_stats 中的指标和
+        total 总耗时；请求失败时还有 error。
+        """
+        self.timing_hooks.append(hook)
+
+    def _report(self, method: str, url: str, attempt: int, stats: dict,
+                error=None):
+        if not self.timing_hooks:
+            return
+        record = {'method': method, 'url': url, 'attempt': attempt, **stats}
+        if error is not None:
+            record['error'] = f"{type(error).__name__}: {error}"
+        for hook in self.timing_hooks:
+            try:
+                hook(record)
+            except Exception as e:
+                print(f"⚠️ 计时回调出错: {e}")
+
+    def _adapt_kwargs(self, kwargs: dict) -> dict:
+        # httpx 用 follow_redirects 代替 requests 的 allow_redirects
+        if self.httpx is not None and 'allow_redirects' in kwargs:
+            kwargs['follow_redirects'] = kwargs.pop('allow_redirects')
+        kwargs.setdefault('timeout', self.timeout)
+        return kwargs
+
+    @property
+    def errors(self) -> tuple:
+        """请求失败时可能抛出的异常类型"""
+        requests = importlib.import_module('requests')
+        if self.httpx is not None:
+            return requests.exceptions.RequestException, self.httpx.HTTPError
+        return (requests.exceptions.RequestException,)
+
+    def _new_session(self, verify: bool):
+        if not verify:
+            urllib3 = importlib.import_module('urllib3')
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        cookie_policy = None
+        if not self.keep_cookies:
+            # 会话不保存服务器下发的 Cookie
+            cookie_policy = importlib.import_module(
+                'http.cookiejar').DefaultCookiePolicy(allowed_domains=[])
+        if self.httpx is not None:
+            session = self.httpx.Client(
+                http2=True,
+                verify=verify,
+                headers=self.base_headers,
+                timeout=self.timeout,
+                limits=self.httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+            )
+            if cookie_policy is not None:
+                session.cookies.jar.set_policy(cookie_policy)
+            return session
+
+        requests = importlib.import_module('requests')
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size, max_retries=0
+        )
+        adapter.poolmanager.pool_classes_by_scheme = _get_timed_pool_classes()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(self.base_headers)
+        session.verify = verify
+        if cookie_policy is not None:
+            session.cookies.set_policy(cookie_policy)
+        return session
+
+    def session(self, url: str, verify: bool | None = None):
+        """获取 url 所在主机的会话，不存在时创建"""
+        if verify is None:
+            verify = self.verify
+        parsed = urlparse(url)
+        key = (parsed.scheme, parsed.netloc, bool(verify))
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._new_session(bool(verify))
+                self._sessions[key] = session
+            return session
+
+    def request(self, method: str, url: str,
+                retry: RetryPolicy | None = None, **kwargs):
+        """
+        发起请求并读取完整的响应。
+        连接失败、超时和 502/503/504 按重试策略退避后重试，默认只重试
+        GET/HEAD/OPTIONS，其他方法需显式传入 retry；
+        用完重试次数后返回最后一次的响应，或抛出最后一次的异常。
+        """
+        method = method.upper()
+        policy = retry or self.retry
+        attempts = policy.max_attempts
+        if retry is None and method not in IDEMPOTENT_METHODS:
+            attempts = 1
+        verify = kwargs.pop('verify', None)
+        kwargs = self._adapt_kwargs(kwargs)
+        session = self.session(url, verify)
+        errors = self.errors
+
+        for attempt in range(1, attempts + 1):
+            response = error = None
+            with collect_request_stats() as stats:
+                started = time.perf_counter()
+                try:
+                    if self.httpx is not None:
+                        response = session.request(method, url, **kwargs)
+                    else:
+                        response = session.request(
+                            method, url, stream=True, **kwargs
+                        )
+                        _set_stat('ttfb', time.perf_counter() - started)
+                        response.content  # 读完响应体，连接放回连接池
+                    _set_stat('http_status', response.status_code)
+                except errors as e:
+                    error = e
+                stats['total'] = time.perf_counter() - started
+            self._report(method, url, attempt, stats, error)
+
+            retryable = (
+                error is not None or response.status_code in RETRY_STATUSES
+            )
+            if not retryable or attempt >= attempts:
+                break
+            delay = policy.delay(attempt)
+            reason = type(error).__name__ if error else response.status_code
+            print(f"⚠️ {method} {url} 第{attempt}次请求失败 ({reason})，"
+                  f"{delay:.1f}秒后重试")
+            time.sleep(delay)
+
+        if error is not None:
+            raise error
+        return response
+
+    def get(self, url: str, headers: dict | None = None, **kwargs):
+        """在主机对应的会话上发起 GET 请求"""
+        return self.request('GET', url, headers=headers, **kwargs)
+
+    def post(self, url: str, data=None, headers: dict | None = None, **kwargs):
+        """在主机对应的会话上发起 POST 请求 (默认不重试)"""
+        return self.request('POST', url, data=data, headers=headers, **kwargs)
+
+    @contextmanager
+    def stream(self, url: str, headers: dict | None = None, **kwargs):
+        """
+        发起流式 GET 请求，响应体按需读取，退出时释放连接。不自动重试。
+        收到响应头时记录 ttfb 和 http_status，见 collect_request_stats
+        """
+        verify = kwargs.pop('verify', None)
+        kwargs = self._adapt_kwargs(kwargs)
+        session = self.session(url, verify)
+        with collect_request_stats() as stats:
+            started = time.perf_counter()
+            error = None
+            try:
+                if self.httpx is not None:
+                    kwargs.setdefault('extensions', {'trace': _httpx_trace})
+                    with session.stream('GET', url, headers=headers,
+                                        **kwargs) as response:
+                        _set_stat('ttfb', time.perf_counter() - started)
+                        _set_stat('http_status', response.status_code)
+                        yield response
+                else:
+                    response = session.get(
+                        url, headers=headers, stream=True, **kwargs
+                    )
+                    _set_stat('ttfb', time.perf_counter() - started)
+                    _set_stat('http_status', response.status_code)
+                    try:
+                        yield response
+                    finally:
+                        self._release(response)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                stats['total'] = time.perf_counter() - started
+                self._report('GET', url, 1, stats, error)
+
+    @staticmethod
+    def _release(response):
+        # 剩余内容不多时读完再关闭，连接可以放回连接池复用；
+        # 提前结束的大页面则直接断开，避免为复用连接下载整页
+        length = response.headers.get('content-length', '')
+        if length.isdigit() and int(length) <= DRAIN_LIMIT:
+            try:
+                response.raw.drain_conn()
+            except Exception:
+                pass
+        response.close()
+
+    def iter_chunks(self, response, chunk_size: int = 16 * 1024):
+        """逐块读取 (已解压的) 响应体字节"""
+        if self.httpx is not None:
+            return response.iter_bytes(chunk_size)
+        return response.iter_content(chunk_size)
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""ins_qinglong_backup 保留规则的测试"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ins_qinglong_backup as bk  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_gfs(monkeypatch):
+    for name in ('QLBK_KEEP_DAILY', 'QLBK_KEEP_WEEKLY', 'QLBK_KEEP_MONTHLY',
+                 'QLBK_MAX_SIZE'):
+        monkeypatch.setattr(bk, name, 0)
+
+
+def record(stamp, base=None, size=1):
+    return {'name': f'qinglong_{stamp}.tar.gz', 'time': bk.backup_time(f'qinglong_{stamp}'),
+            'size': size, 'base': base}
+
+
+def test_max_files_zero_keeps_newest_chain(monkeypatch):
+    monkeypatch.setattr(bk, 'QLBK_MAX_FLIES', 0)
+    full = record('20260101_000000')
+    inc = record('20260102_000000', base=full['name'])
+    old = record('20251231_000000')
+    assert bk.select_retained([old, full, inc]) == {full['name'], inc['name']}
+
+
+def test_max_files_limit(monkeypatch):
+    monkeypatch.setattr(bk, 'QLBK_MAX_FLIES', 2)
+    records = [record(f'2026010{day}_000000') for day in range(1, 5)]
+    assert bk.select_retained(records) == {r['name'] for r in records[-2:]}
+
+
+def test_catalog_retention_keeps_new_backup(monkeypatch, tmp_path):
+    monkeypatch.setattr(bk, 'QLBK_MAX_FLIES', 0)
+    names = ['qinglong_20260101_000000.tar.gz', 'qinglong_20260102_000000.tar.gz']
+    for name in names:
+        (tmp_path / name).write_bytes(b'x')
+    catalog = bk.BackupCatalog(str(tmp_path))
+    assert catalog.apply_retention() == names[:1]
+    assert sorted(os.listdir(tmp_path)) == [names[1], bk.CATALOG_NAME]
+
+
+def test_repository_prune_keeps_new_snapshot(monkeypatch, tmp_path):
+    monkeypatch.setattr(bk, 'QLBK_MAX_FLIES', 0)
+    repo = bk.ChunkRepository(str(tmp_path))
+    old, new = repo.put_chunk(b'old'), repo.put_chunk(b'new')
+    repo._save_snapshot('qinglong_20260101_000000', {'files': [{'path': 'a', 'chunks': [old]}]})
+    repo._save_snapshot('qinglong_20260102_000000', {'files': [{'path': 'a', 'chunks': [new]}]})
+    assert repo.prune() == 1
+    assert repo.snapshots() == ['qinglong_20260102_000000']
+    assert os.path.exists(repo.chunk_path(new))
+    assert not os.path.exists(repo.chunk_path(old))